@@ -0,0 +1,246 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TYPES = ["PER", "ORG", "LOC", "GPE", "FAC", "VEH", "WEA"]
+WORDS = ["the", "president", "of", "bank", "new", "york", "city", "protein", "cell", "receptor",
+         "river", "north", "company", "minister", "state", "human", "gene", "army", "airport", "car"]
+
+# (sentences, maximum nesting depth) of the fixed corpora, from small and flat to large and deep
+CORPORA = {
+    "small": (1000, 2),
+    "medium": (10000, 4),
+    "large": (50000, 4),
+    "deep": (10000, 8),
+}
+DEFAULT_CORPORA = ["small", "medium", "deep"]
+
+
+def corpus_profile(n_sentences, max_depth):
+    """
+    Generation profile (src.data.synthetic) of a corpus whose entity counts halve
+    at every nesting level, down to max_depth, with span lengths shrinking with depth.
+    """
+    from src.data.synthetic import profile_from_statistics
+
+    statistics = {
+        "counts": {depth: round(1.5 * n_sentences * 0.5 ** (depth - 1)) for depth in range(1, max_depth + 1)},
+        "sentence_count": n_sentences,
+        "entity_types": {entity_type: 1 for entity_type in TYPES},
+    }
+    profile = profile_from_statistics(statistics)
+    # Spans long enough at every level for the deepest ones to fit
+    for depth in range(1, max_depth + 1):
+        levels_below = max_depth - depth
+        profile["lengths"][str(depth)] = {str(k): 1 for k in range(levels_below + 1, 2 * levels_below + 3)}
+    profile["tokens"] = {word: 1 for word in WORDS}
+    return profile
+
+
+def write_corpus(directory, n_sentences, max_depth, seed=0):
+    """
+    Write a deterministic gold.data generated with src.data.synthetic and a
+    perturbed pred.data (dropped, shifted and relabeled entities) to directory.
+    """
+    from src.data.synthetic import generate
+    from src.data.utils import read_data
+
+    gold_file = generate(corpus_profile(n_sentences, max_depth), n_sentences,
+                         os.path.join(directory, "gold.data"), seed)
+    pred_file = os.path.join(directory, "pred.data")
+    rng = random.Random(seed)
+    with open(gold_file, 'r', encoding='utf-8') as gold, open(pred_file, 'w', encoding='utf-8') as pred:
+        for tokens, entities in read_data(gold):
+            predicted = set()
+            for t, s, e in entities:
+                r = rng.random()
+                if r < 0.1:
+                    continue
+                elif r < 0.15:
+                    e = min(e + 1, len(tokens) - 1)
+                elif r < 0.2:
+                    t = rng.choice(TYPES)
+                predicted.add((s, e, t))
+            annotations = "|".join(f"{s},{e} {t}" for s, e, t in sorted(predicted))
+            pred.write(f"{' '.join(tokens)}\n{annotations}\n\n")
+    return gold_file, pred_file
+
+
+def corpus_directory(corpora_dir, corpus):
+    n_sentences, max_depth = CORPORA[corpus]
+    return os.path.join(corpora_dir, f"{corpus}_{n_sentences}_{max_depth}_synthetic")
+
+
+def benchmarks(directory):
+    """
+    The benchmarked functions, as name -> zero-argument callable. Functions
+    missing in the benchmarked source tree are left out.
+    """
+    from src.data import utils
+    from src.evaluation.evaluator import Evaluator
+
+    gold_file = os.path.join(directory, "gold.data")
+    pred_file = os.path.join(directory, "pred.data")
+    trees_file = os.path.join(directory, "gold.trees")
+    output_file = os.path.join(directory, "output.data")
+    if not os.path.exists(trees_file):
+        utils.to_parenthesized(gold_file, trees_file)
+    entities = utils.find_entities(gold_file)
+
+    cases = {
+        "to_parenthesized": lambda: utils.to_parenthesized(gold_file, output_file),
+        "trees_to_data": lambda: utils.trees_to_data(trees_file, output_file),
+        "find_entities": lambda: utils.find_entities(gold_file),
+    }
+    if hasattr(utils, 'nesting_depths'):
+        cases["nesting_depths"] = lambda: [utils.nesting_depths(e) for e in entities]
+
+    for backend in ('python', 'columnar'):
+        try:
+            evaluator = Evaluator(backend=backend)
+        except TypeError:
+            if backend != 'python':
+                continue
+            evaluator = Evaluator()
+        if hasattr(evaluator, 'evaluate_all'):
+            cases[f"evaluate_all_{backend}"] = lambda evaluator=evaluator: evaluator.evaluate_all(gold_file, pred_file)
+        else:
+            cases[f"evaluate_all_{backend}"] = lambda evaluator=evaluator: [
+                method(gold_file, pred_file) for method in (
+                    evaluator.calculate_metrics, evaluator.calculate_metrics_by_depth,
+                    evaluator.calculate_metrics_by_length, evaluator.calculate_metrics_by_label
+                )
+            ]
+    return cases
+
+
+def measure(function, repeat):
+    """
+    Run function repeat times and return its timings and the peak memory traced
+    during one extra run.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "peak_mb": peak / 2 ** 20,
+        "repeat": repeat,
+    }
+
+
+def git_revision(source):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=source, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every benchmark against the baseline and return the
+    names of the ones whose median time grew by more than threshold.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:45s} {result['median_s']:10.4f}s (new)")
+            continue
+        base = baseline["results"][name]
+        ratio = result["median_s"] / base["median_s"] if base["median_s"] > 0 else float('inf')
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:45s} {base['median_s']:10.4f}s -> {result['median_s']:10.4f}s "
+              f"({ratio:5.2f}x, peak {base['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and profile the memory of the data conversion and evaluation functions")
+    parser.add_argument('--corpora', nargs='+', default=DEFAULT_CORPORA, choices=sorted(CORPORA))
+    parser.add_argument('--benchmarks', nargs='+', default=None, help="Only run these benchmarks (default: all)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--source', type=str, default=PROJECT_ROOT,
+                        help="Checkout whose src package is benchmarked, e.g. a git worktree of another revision")
+    parser.add_argument('--output', type=str, default="results/benchmark.json")
+    parser.add_argument('--compare', type=str, default=None, help="Baseline JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative slowdown of the median time flagged as a regression")
+    args = parser.parse_args()
+
+    # The corpora do not depend on the benchmarked revision, so all runs share them.
+    # They are generated with this checkout, which is then unloaded so that the src
+    # package of the benchmarked source is imported
+    corpora_dir = os.path.join(tempfile.gettempdir(), "nner_benchmark_corpora")
+    sys.path.insert(0, PROJECT_ROOT)
+    for corpus in args.corpora:
+        directory = corpus_directory(corpora_dir, corpus)
+        if not os.path.exists(os.path.join(directory, "pred.data")):
+            os.makedirs(directory, exist_ok=True)
+            write_corpus(directory, *CORPORA[corpus])
+    sys.path.remove(PROJECT_ROOT)
+    for module in [name for name in sys.modules if name == 'src' or name.startswith('src.')]:
+        del sys.modules[module]
+
+    source = os.path.abspath(args.source)
+    sys.path.insert(0, source)
+
+    results = {
+        "revision": git_revision(source),
+        "python": platform.python_version(),
+        "corpora": {name: {"sentences": CORPORA[name][0], "max_depth": CORPORA[name][1]} for name in args.corpora},
+        "results": {},
+    }
+    for corpus in args.corpora:
+        directory = corpus_directory(corpora_dir, corpus)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ("gold.data", "pred.data"):
+                os.symlink(os.path.join(directory, name), os.path.join(tmp_dir, name))
+            for name, function in benchmarks(tmp_dir).items():
+                if args.benchmarks and name not in args.benchmarks:
+                    continue
+                result = measure(function, args.repeat)
+                results["results"][f"{corpus}/{name}"] = result
+                print(f"{corpus}/{name:35s} median {result['median_s']:.4f}s  min {result['min_s']:.4f}s  "
+                      f"peak {result['peak_mb']:.1f} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
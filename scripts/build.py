@@ -0,0 +1,40 @@
+import os
+import sys
+import argparse
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.machamp.pipeline import Build, pipeline_nodes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally prepare, train and evaluate a grid of models, "
+                                                 "rebuilding only what changed since the last build")
+    parser.add_argument('--datasets', nargs='+', default=["ace2004", "ace2005", "nne", "genia"])
+    parser.add_argument('--encoders', nargs='+', required=True, help="Encoder models from HuggingFace")
+    parser.add_argument('--encodings', nargs='+', default=['ABS', 'REL', 'JUX', 'DYN', '4EC'],
+                        choices=['ABS', 'REL', 'JUX', 'DYN', '4EC'])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--num_epochs', type=int, default=30)
+    parser.add_argument('--devices', nargs='+', default=['0'], help="GPU ids, or 'cpu' for CPU slots")
+    parser.add_argument('--per_device', type=int, default=1, help="Maximum number of jobs running on each device")
+    parser.add_argument('--retries', type=int, default=1, help="Times a failed node is run again")
+    parser.add_argument('--workers', type=int, default=1, help="Processes used to prepare the data of each node")
+    parser.add_argument('--host_slots', type=int, default=None,
+                        help="Maximum number of data preparation nodes running at a time "
+                             "(default: the number of CPUs divided by --workers)")
+    parser.add_argument('--manifest', type=str, default='logs/build/manifest.json')
+    parser.add_argument('--force', nargs='+', default=[], help="Rebuild the nodes whose id starts with these prefixes, "
+                                                                "e.g. evaluate/genia")
+    parser.add_argument('--dry_run', action='store_true', help="Only list the stale nodes and the nodes depending on them")
+    parser.add_argument('--poll_interval', type=float, default=5.0)
+    args = parser.parse_args()
+    host_slots = args.host_slots or max(1, (os.cpu_count() or 1) // args.workers)
+
+    nodes = pipeline_nodes(args.datasets, args.encoders, args.encodings, args.seeds, args.num_epochs, args.workers)
+    build = Build(nodes, args.manifest, args.devices, args.per_device, args.retries, args.poll_interval, host_slots)
+    counts = build.run(args.force, args.dry_run)
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if counts.get('failed'):
+        sys.exit(1)
@@ -0,0 +1,25 @@
+import os
+import sys
+import argparse
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.data.binary import compile_data, BinaryCorpus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile .data files into memory-mapped binary corpora")
+    parser.add_argument('data_files', nargs='*', help=".data files to compile (written next to them as .nnerbin)")
+    parser.add_argument('--dataset', type=str, default=None, help="Compile the train, dev and test splits of data/<dataset>")
+    args = parser.parse_args()
+
+    data_files = list(args.data_files)
+    if args.dataset:
+        data_files += [os.path.join("data", args.dataset, f"{split}.data") for split in ["train", "dev", "test"]]
+    if not data_files:
+        parser.error("No .data files given")
+
+    for data_file in data_files:
+        output_file = compile_data(data_file)
+        corpus = BinaryCorpus(output_file)
+        print(f"{data_file} -> {output_file}: {len(corpus)} sentences, {corpus.header['n_tokens']} tokens, "
+              f"{corpus.header['n_entities']} entities")
@@ -1,37 +1,19 @@
 import os
 import sys
+import json
+import argparse
 import statistics
 from collections import defaultdict, Counter
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.data.utils import find_entities
+from src.data.utils import find_entities, nesting_depths
+from src.data.binary import resolve
 
 
-def calculate_nesting_depth(entities):
-    """Sort entities by start position and then by end position (descending)"""
-    sorted_entities = sorted(entities, key=lambda x: (x[1], -x[2]))
-    depths = {}
-    
-    for entity in sorted_entities:
-        depth = 1
-
-        for other in sorted_entities:
-            if entity == other:
-                continue
-            if other[1] <= entity[1] and entity[2] <= other[2]:
-                if other in depths:
-                    depth = max(depth, depths[other] + 1)
-                else:
-                    depth = max(depth, 2)
-
-        depths[entity] = depth
-    return depths
-
 def entity_count(dataset):
     """
-    Extract the number of entities in the three splits of a given dataset,
-    and save the counts in a JSON file.
+    Extract the number of entities in the three splits of a given dataset.
     
     Returns:
         dict: Statistics about entities including counts, percentages, average depth, median depth, etc.
@@ -49,20 +31,21 @@ def entity_count(dataset):
     all_entity_depths = []
     
     for file in files:
-        entities = find_entities(f"{dataset_directory}{file}")
+        # Compiled corpora (scripts/compile_corpus.py) are used when up to date
+        entities = find_entities(resolve(f"{dataset_directory}{file}"))
         total_sentence_count += len(entities)
         n_gold["all"] += sum(len(sentence) for sentence in entities)
 
         for sentence in entities:
-            depths = calculate_nesting_depth(sentence)
+            depths = nesting_depths(sentence)
             
             # Add all depth values to list for statistics
             all_entity_depths.extend(depths.values())
             
             # Count entities at each depth
-            for depth in set(depths.values()):
+            for depth in depths.values():
                 all_depths.add(depth)
-                n_gold[depth] = n_gold.get(depth, 0) + len([e for e in sentence if depths[e] == depth])
+                n_gold[depth] = n_gold.get(depth, 0) + 1
             
             # Count entity types
             for entity in sentence:
@@ -96,8 +79,14 @@ def entity_count(dataset):
 if __name__ == "__main__":
     import pandas as pd
     from tabulate import tabulate
-    
-    datasets = ["ace2004", "ace2005", "nne", "genia"]
+
+    parser = argparse.ArgumentParser(description="Entities per nesting depth of every dataset")
+    parser.add_argument('--datasets', nargs='+', default=["ace2004", "ace2005", "nne", "genia"])
+    parser.add_argument('--json_dir', type=str, default=None,
+                        help="Also save the statistics of every dataset to <json_dir>/<dataset>.json, "
+                             "usable as a --profile of scripts/generate_corpus.py")
+    args = parser.parse_args()
+    datasets = args.datasets
     
     # Create dictionaries to store data for each dataset
     data = {
@@ -112,9 +101,15 @@ if __name__ == "__main__":
     # Create separate depth data
     depth_data = defaultdict(list)
     
+    results = {}
     for dataset in datasets:
-        result = entity_count(dataset)
-        
+        result = results[dataset] = entity_count(dataset)
+
+        if args.json_dir:
+            os.makedirs(args.json_dir, exist_ok=True)
+            with open(os.path.join(args.json_dir, f"{dataset}.json"), 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=4, ensure_ascii=False)
+
         # Add basic info to main data
         data["Dataset"].append(dataset)
         data["Total Entities"].append(result["counts"]["all"])
@@ -157,8 +152,7 @@ if __name__ == "__main__":
     # Print entity type distribution as separate tables
     print("\nEntity Type Distribution:")
     for dataset in datasets:
-        result = entity_count(dataset)
-        entity_types = result["entity_types"]
+        entity_types = results[dataset]["entity_types"]
         
         # Convert to DataFrame for nice display
         et_df = pd.DataFrame({
@@ -1,119 +1,185 @@
 from src.evaluation.evaluator import Evaluator
 from src.evaluation.utils import average_dictionary
+from src.evaluation.tracing import Tracer
+from src.machamp.export import QUANTIZED_MODEL, compare_predictions
 import argparse
-from src.data.utils import trees_to_data, decode, add_bos_eos
+from src.data.utils import read_data
+from src.data.binary import resolve
+from src.tagger import labels_to_data
 import json
 import os
-import time
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 # Add the project root to the python path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+
+def count_sentences(data_file):
+    """
+    Number of sentences and tokens of a .data file.
+    """
+    num_sentences = 0
+    num_tokens = 0
+    with open(data_file, 'r', encoding='utf-8') as f:
+        for tokens, _ in read_data(f):
+            num_sentences += 1
+            num_tokens += len(tokens)
+    return num_sentences, num_tokens
+
+
+def process_seed(evaluator, seed, predicted_labels, gold_data, breakdowns, latency=False):
+    """
+    Post-prediction stages for one seed: BOS/EOS fix-up, decoding, conversion to
+    .data and scoring, each recorded in a Tracer (with per-sentence decoding
+    latencies if latency is set). Returns the seed results (None if the
+    predictions are missing), the sentence and token counts, and the tracer state.
+    """
+    tracer = Tracer()
+    evaluator.tracer = tracer
+    try:
+        # Decode (-BOS-/-EOS- rows are added on the fly where missing)
+        with tracer.span('labels_to_data', seed=seed):
+            pred_trees = predicted_labels.replace('labels', 'trees')
+            pred_data = labels_to_data(evaluator.encoding, predicted_labels, pred_trees.replace('trees', 'data'),
+                                       pred_trees, tracer=tracer, latency=latency)
+        num_sentences, num_tokens = count_sentences(pred_data)
+    except FileNotFoundError as e:
+        print(f"Predictions not found: {e.filename}. Skipping this seed.")
+        evaluator.tracer = None
+        return None, {'num_sentences': 0, 'num_tokens': 0}, tracer.to_dict()
+
+    # Calculate metrics
+    with tracer.span('evaluate', seed=seed):
+        seed_results = evaluator.evaluate_all(gold_data, pred_data, breakdowns)
+    evaluator.tracer = None
+    return seed_results, {'num_sentences': num_sentences, 'num_tokens': num_tokens}, tracer.to_dict()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate a Machamp model (caio evaluator only)")
     parser.add_argument('--encoder', type=str, required=True, help="Name of the encoder used from HF")
     parser.add_argument('--encoding', type=str, required=True, help="Constituency encoding")
     parser.add_argument('--dataset', type=str, required=True, help="Name of the dataset to evaluate on")
-    parser.add_argument('--device', type=str, default='0', help="Device to run the evaluation on")
+    parser.add_argument('--device', type=str, default=None,
+                        help="Device to run the evaluation on (default: 0, or -1 (CPU) with --quantized)")
     parser.add_argument('--predict', action='store_true', help="Whether to predict (default: False)")
     parser.add_argument('--no-predict', dest='predict', action='store_false', help="Whether to use existing predictions")
     parser.add_argument('--by-label', action='store_true', help="Evaluate metrics by label")
     parser.add_argument('--by-depth', action='store_true', help="Evaluate metrics by depth")
     parser.add_argument('--by-length', action='store_true', help="Evaluate metrics by entity length")
+    parser.add_argument('--backend', type=str, default='columnar', choices=['python', 'columnar'],
+                        help="Metric backend: per-sentence Python sets or columnar NumPy arrays")
+    parser.add_argument('--server', type=str, default=None,
+                        help="URL of a running prediction server (scripts/serve.py) to predict with")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of processes decoding and scoring seeds while the next ones are predicted")
+    parser.add_argument('--predict-workers', type=int, default=1,
+                        help="Number of CPU processes predicting shards of the test set (sharded prediction if > 1)")
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help="Torch threads of every prediction process")
+    parser.add_argument('--quantized', action='store_true',
+                        help="Predict on CPU with the int8 models exported by scripts/export.py (model.int8.pt)")
+    parser.add_argument('--fp32_check', action='store_true',
+                        help="With --quantized, also predict with the fp32 models on CPU and compare them with "
+                             "the int8 predictions (quantization_check.json in every seed directory)")
+    parser.add_argument('--seeds', nargs='+', default=None, help="Seeds to evaluate (default: all)")
+    parser.add_argument('--latency', action='store_true',
+                        help="Decode sentences one by one to report per-sentence latency percentiles (slower)")
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Chrome trace JSON of all the stages (default: trace.json in the model directory)")
     parser.set_defaults(predict=True, by_depth=True, by_label=True, by_length=True)
 
     args = parser.parse_args()
-
-    evaluator = Evaluator(args.encoder, args.dataset, args.encoding, args.device)
+    if args.quantized:
+        # Dynamically quantized models only run on CPU
+        if args.server:
+            parser.error("--quantized models are evaluated locally on CPU, not with --server")
+        if args.device not in (None, '-1', 'cpu'):
+            parser.error(f"--quantized models only run on CPU, got --device {args.device}")
+        args.device = '-1'
+    elif args.fp32_check:
+        parser.error("--fp32_check compares the --quantized predictions with the fp32 ones")
+    elif args.device is None:
+        args.device = '0'
+
+    evaluator = Evaluator(args.encoder, args.dataset, args.encoding, args.device, args.backend, args.server,
+                          model_file=QUANTIZED_MODEL if args.quantized else 'model.pt',
+                          predict_workers=args.predict_workers, threads_per_worker=args.threads_per_worker)
+    if args.seeds:
+        evaluator.seeds = args.seeds
     all_results = []
     all_times = []
+    tracer = Tracer()
 
     # Base directory for model evaluations
     model_dirs = f'logs/machamp/{evaluator.dataset}/{evaluator.encoder}/{evaluator.encoding}/'
-    gold_data = f'data/{evaluator.dataset}/test.data'
+    gold_data = resolve(f'data/{evaluator.dataset}/test.data')
+
+    breakdowns = [name for name, enabled in [('depth', args.by_depth), ('length', args.by_length),
+                                             ('label', args.by_label)] if enabled]
+    executor = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    evaluated_seeds = []
+    outcomes = []
 
+    # Predictions run one after another in this process; the decoding and scoring of
+    # each seed runs in the pool (if any) while the next seed is predicted
     for seed in evaluator.seeds:
         print(f"Evaluating seed: {seed}")
-        time_dict = {}
-        total_start = time.time()
-        predict_end = predict_start = total_start # Initialize in case --no-predict and file missing
 
         # Predict
         if args.predict:
-            predict_start = time.time()
-            predicted_labels = evaluator.predict(seed)
-            predict_end = time.time()
-            predicted_labels = add_bos_eos(predicted_labels)
-            time_dict['predict'] = predict_end - predict_start
+            with tracer.span('predict', seed=seed):
+                predicted_labels = evaluator.predict(seed)
+            predict_time = tracer.events[-1]["dur"] / 1e6
+            if args.fp32_check:
+                # The int8 predictions are the ones just made: only the fp32 model runs again
+                seed_dir = os.path.join(model_dirs, f"seed_{seed}")
+                with tracer.span('fp32_check', seed=seed):
+                    fp32_labels = evaluator.predict(seed, model_file='model.pt',
+                                                    output_file=os.path.join(seed_dir, 'output.fp32.labels'))
+                check = compare_predictions(fp32_labels, predicted_labels, tracer.events[-1]["dur"] / 1e6,
+                                            predict_time, gold_data, evaluator.encoding)
+                with open(os.path.join(seed_dir, "quantization_check.json"), "w") as f:
+                    json.dump(check, f, indent=2)
+                print(f"Seed {seed}: int8 {check['speedup']:.2f}x faster than fp32, "
+                      f"F1 delta {100 * check['f1_delta']:+.2f}")
         else:
             predicted_labels = f'{model_dirs}seed_{seed}/output.labels'
             if not os.path.exists(predicted_labels):
                 print(f"Prediction file not found for seed {seed}. Skipping...")
                 continue
             # If not predicting, set predict time to 0 or handle appropriately
-            time_dict['predict'] = 0.0 # Or load from a previous run if available
-
-        # Decode
-        decode_start = time.time()
-        pred_trees = decode(args.encoding, predicted_labels, predicted_labels.replace('labels', 'trees'))
-        pred_data = trees_to_data(pred_trees, pred_trees.replace('trees', 'data'))
-        decode_end = time.time()
-        time_dict['decode'] = decode_end - decode_start
-
-        # Count sentences and tokens
-        num_sentences = 0
-        num_tokens = 0
-        try:
-            with open(pred_data, 'r') as f:
-                for line in f:
-                    num_sentences += 1
-                    num_tokens += len(line.strip().split())
-        except FileNotFoundError:
-             print(f"Decoded data file not found: {pred_data}. Skipping timing calculation for this seed.")
-             # Handle error appropriately, maybe skip this seed or set counts to 0
-             num_sentences = 0
-             num_tokens = 0
-             # Decide how to handle timing if counts are zero
-             time_dict['total'] = time.time() - total_start # Still record total time spent so far
-             time_dict['num_sentences'] = 0
-             time_dict['num_tokens'] = 0
-             # Add basic timing to all_times before continuing
-             all_times.append({
-                 'predict': time_dict.get('predict', 0.0),
-                 'decode': time_dict.get('decode', 0.0),
-                 'total': time_dict.get('total', 0.0),
-                 'num_sentences': 0,
-                 'num_tokens': 0,
-             })
-             continue # Skip metric calculation and saving for this seed
-
-
-        time_dict['num_sentences'] = num_sentences
-        time_dict['num_tokens'] = num_tokens
-        time_dict['total'] = time.time() - total_start
-
-        seed_results = {}
-        # Calculate metrics
-        seed_results["overall"] = evaluator.calculate_metrics(gold_data, pred_data)
-        if args.by_depth:
-            seed_results["by_depth"] = evaluator.calculate_metrics_by_depth(gold_data, pred_data)
-        if args.by_length:
-            seed_results["by_length"] = evaluator.calculate_metrics_by_length(gold_data, pred_data)
-        if args.by_label:
-            seed_results["by_label"] = evaluator.calculate_metrics_by_label(gold_data, pred_data)
-
-        # Add simplified timing info to results and track for averaging
+            predict_time = 0.0 # Or load from a previous run if available
+
+        seed_args = (evaluator, seed, predicted_labels, gold_data, breakdowns, args.latency)
+        evaluated_seeds.append((seed, predict_time))
+        outcomes.append(executor.submit(process_seed, *seed_args) if executor else process_seed(*seed_args))
+
+    if executor:
+        outcomes = [future.result() for future in outcomes]
+        executor.shutdown()
+
+    # Merge in seed order
+    for (seed, predict_time), (seed_results, counts, seed_trace) in zip(evaluated_seeds, outcomes):
+        seed_tracer = Tracer.from_dict(seed_trace)
+        tracer.merge(seed_tracer)
+        # Labelling time is prediction plus decoding; scoring is reported separately in the stages
+        decode_time = seed_tracer.total_seconds('labels_to_data')
         simplified_timing = {
-            'predict': time_dict.get('predict', 0.0), # Use .get for safety
-            'decode': time_dict['decode'],
-            'total': time_dict['total'],
-            'num_sentences': time_dict['num_sentences'],
-            'num_tokens': time_dict['num_tokens'],
+            'predict': predict_time,
+            'decode': decode_time,
+            'total': predict_time + decode_time,
+            'num_sentences': counts['num_sentences'],
+            'num_tokens': counts['num_tokens'],
         }
+        simplified_timing.update(seed_tracer.summary())
+        all_times.append(simplified_timing) # Append the simplified dict
+        if seed_results is None:
+            continue
+
         seed_results['timing'] = simplified_timing
         all_results.append(seed_results)
-        all_times.append(simplified_timing) # Append the simplified dict
 
         seed_dir = os.path.join(model_dirs, f"seed_{seed}")
         os.makedirs(seed_dir, exist_ok=True)
@@ -142,8 +208,7 @@ if __name__ == "__main__":
         else:
              global_time['avg_time_per_sentence'] = float('inf')
 
-    # Removed micro and macro average sections for rates
-
+    global_time.update(tracer.summary())
     avg_results['timing'] = global_time  # Ensure timing is in average results
 
     # Save averaged results in the base model directory
@@ -151,4 +216,5 @@ if __name__ == "__main__":
     with open(os.path.join(model_dirs, "avg_results.json"), "w") as f:
         json.dump(avg_results, f, indent=2)
 
-    print("Done! Per-seed results and averaged results saved.")
+    trace_file = tracer.write_chrome_trace(args.trace or os.path.join(model_dirs, "trace.json"))
+    print(f"Done! Per-seed results and averaged results saved. Trace saved to {trace_file}.")
@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import argparse
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.machamp.export import export_quantized, accuracy_report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export trained models with dynamic int8 quantization for CPU inference")
+    parser.add_argument('--encoder', type=str, required=True, help="Name of the encoder used from HF")
+    parser.add_argument('--encoding', type=str, required=True, help="Constituency encoding")
+    parser.add_argument('--dataset', type=str, required=True, help="Name of the dataset")
+    parser.add_argument('--seeds', nargs='+', default=None, help="Seeds to export (default: all)")
+    parser.add_argument('--report', action='store_true',
+                        help="Compare the exported and fp32 models on the test set (default: True)")
+    parser.add_argument('--no-report', dest='report', action='store_false', help="Export without the comparison")
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.set_defaults(report=True)
+    args = parser.parse_args()
+
+    encoder_name = args.encoder.split('/')[-1]
+    model_dirs = f'logs/machamp/{args.dataset}/{encoder_name}/{args.encoding}/'
+    seeds = args.seeds or sorted(d.split('_')[-1] for d in os.listdir(model_dirs)
+                                 if d.startswith('seed_') and os.path.exists(os.path.join(model_dirs, d, 'model.pt')))
+
+    for seed in seeds:
+        model_dir = os.path.join(model_dirs, f'seed_{seed}')
+        output_file = export_quantized(model_dir)
+        print(f"Seed {seed}: exported {output_file}")
+
+        if args.report:
+            report = accuracy_report(
+                model_dir, f'data/{args.dataset}/{args.encoding}/test.labels',
+                gold_data=f'data/{args.dataset}/test.data', encoding=args.encoding,
+                dataset=args.dataset, batch_size=args.batch_size,
+            )
+            with open(os.path.join(model_dir, 'export_report.json'), 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Seed {seed}: {report['speedup']:.2f}x faster, "
+                  f"F1 delta {100 * report.get('f1_delta', 0):+.2f}")
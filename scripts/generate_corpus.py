@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+import argparse
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.data.synthetic import fit_profile, load_profile, generate, SHARD_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic nested NER corpus matching the profile of a dataset")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dataset', type=str, help="Fit the profile on the train, dev and test splits of data/<dataset>")
+    source.add_argument('--data_files', nargs='+', help="Fit the profile on these .data files")
+    source.add_argument('--profile', type=str, help="JSON profile (--save_profile), or statistics saved by "
+                                                     "scripts/entities_per_depth.py --json_dir")
+    parser.add_argument('--save_profile', type=str, default=None, help="Save the fitted profile as JSON")
+    parser.add_argument('--sentences', type=int, default=1000000)
+    parser.add_argument('--output', type=str, required=True, help="Output .data file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--shard_size', type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile = load_profile(args.profile)
+    else:
+        data_files = args.data_files or [os.path.join("data", args.dataset, f"{split}.data") for split in ["train", "dev", "test"]]
+        profile = fit_profile(data_files)
+
+    if args.save_profile:
+        with open(args.save_profile, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=4, ensure_ascii=False)
+
+    generate(profile, args.sentences, args.output, args.seed, args.workers, args.shard_size)
+    print(f"{args.sentences} sentences written to {args.output}")
@@ -1,11 +1,16 @@
 import os
 import sys
 import csv
-from datetime import datetime
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import tempfile
-from src.data.utils import to_parenthesized, encode, trees_to_data, decode, add_bos_eos, find_entities
+from src.data.codelin import get_codelin
+from src.data.transforms import write_atomic
+from src.data.utils import to_parenthesized, parse_tree, find_entities, read_data
 
 
 def create_joint_file(dataset):
@@ -14,45 +19,50 @@ def create_joint_file(dataset):
         os.path.join(data_dir, f"{split}.data") 
         for split in ["train", "dev", "test"]
     ]
-    joint_text = ""
-    for file in [train, dev, test]:
-        with open(file, 'r', encoding='utf-8') as file_:
-            lines = file_.readlines()
-            for line in lines:
-                if '-BOS-' not in line and '-EOS-' not in line:
-                    joint_text += line.strip() + "\n"
-
     joint_gold = tempfile.NamedTemporaryFile(delete=False)
-    with open(joint_gold.name, 'w', encoding='utf-8') as file_:
-        file_.write(joint_text)
+    with open(joint_gold.name, 'w', encoding='utf-8') as joint_file:
+        for file in [train, dev, test]:
+            with open(file, 'r', encoding='utf-8') as file_:
+                lines = (line for line in file_ if '-BOS-' not in line and '-EOS-' not in line)
+                for tokens, entities in read_data(lines):
+                    annotations = "|".join(f"{start},{end} {etype}" for etype, start, end in entities)
+                    joint_file.write(f"{' '.join(tokens)}\n{annotations}\n\n")
     return joint_gold.name
 
-def max_possible_recall(filename, encoding):
+def file_hash(filename):
+    """
+    SHA-256 of the contents of a file, read in blocks.
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def max_possible_recall(filename, encoding, trees_file=None):
     """
     Calculate the maximum possible recall for a given dataset and encoding.
+    The .trees file of the dataset can be given to avoid rebuilding it; the
+    encoding and decoding round trip runs in memory.
     """    
-    # encoding
-    trees_file = tempfile.NamedTemporaryFile(delete=False)
-    trees_file_name = to_parenthesized(
-        filename, trees_file.name
-    )
-
-    encoded_file = tempfile.NamedTemporaryFile(delete=False)
-    encoded_file_name = encode(
-        encoding, trees_file_name, encoded_file.name,
-    )
-    # decoding
-    decoded_file = tempfile.NamedTemporaryFile(delete=False)
-    decoded_file_name = decode(
-        encoding, encoded_file_name, decoded_file.name
-    )
-    decoded_file_name = trees_to_data(
-        decoded_file_name, decoded_file_name
-    )
+    created_trees = trees_file is None
+    if created_trees:
+        trees_file = to_parenthesized(filename, tempfile.NamedTemporaryFile(delete=False).name)
+    with open(trees_file, 'r', encoding='utf-8') as f:
+        trees = [line for line in f if line.strip()]
+    if created_trees:
+        os.unlink(trees_file)
+
+    # encoding and decoding
+    codelin = get_codelin(encoding)
+    decoded_trees = codelin.decode(codelin.encode(trees))
+    predicted_entities = [
+        {(etype, start, end) for start, end, etype in parse_tree(tree)[1]}
+        for tree in decoded_trees
+    ]
 
     # calculate recall
-    gold_entities = find_entities(filename)  # Use input filename, not joint_gold.name
-    predicted_entities = find_entities(decoded_file_name)
+    gold_entities = find_entities(filename)
     
     n_correct = 0
     n_gold = 0
@@ -70,11 +80,6 @@ def max_possible_recall(filename, encoding):
     # Return max possible recall as a percentage
     max_recall = 0 if n_gold == 0 else (n_correct / n_gold)
     
-    # Clean up temporary files
-    os.unlink(trees_file.name)
-    os.unlink(encoded_file.name)
-    os.unlink(decoded_file.name)
-    
     return {
         "max_recall": max_recall,
         "correct_entities": n_correct,
@@ -82,6 +87,25 @@ def max_possible_recall(filename, encoding):
         "predicted_entities": sum(len(pred) for pred in predicted_entities)
     }
 
+def cached_max_possible_recall(data_file, trees_file, encoding, cache_file):
+    """
+    max_possible_recall, saved to cache_file.
+    """
+    result = max_possible_recall(data_file, encoding, trees_file)
+    # Written atomically: a killed worker must not leave a truncated cache file
+    write_atomic([json.dumps(result)], cache_file)
+    return result
+
+def read_cache(cache_file):
+    """
+    The cached result of a cell, or None if it is missing or unreadable.
+    """
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 def save_results_to_csv(results, output_file):
     """
     Save results to a CSV file.
@@ -107,44 +131,70 @@ def save_results_to_csv(results, output_file):
     print(f"Results saved to: {output_file}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maximum recall reachable by every encoding (encode-decode round trip)")
+    parser.add_argument('--datasets', nargs='+', default=["ace2004", "ace2005", "nne", "genia"])
+    parser.add_argument('--encodings', nargs='+', default=["ABS", "REL", "DYN", "4EC"])
+    parser.add_argument('--workers', type=int, default=1, help="Number of (dataset, encoding) cells computed in parallel")
+    parser.add_argument('--cache_dir', type=str, default="results/label_coverage_cache",
+                        help="Directory where the results of every cell are cached")
+    args = parser.parse_args()
+
     # Setup output file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = f"results/label_coverage.csv"
-    
-    # Example usage
-    datasets = ["ace2004", "ace2005", "nne", "genia"]
-    encodings = ["ABS", "REL", "DYN", "4EC"]
-    
-    # Store all results for CSV
+    os.makedirs(args.cache_dir, exist_ok=True)
+
+    # Results are cached by the content hash of the joint dataset and the encoding,
+    # so only new (dataset, encoding) cells are computed
+    cells = []
+    results = {}
+    pending = {}
+    temp_files = []
+    with ProcessPoolExecutor(args.workers) as executor:
+        for dataset_name in args.datasets:
+            print(f"Processing dataset: {dataset_name}")
+            data_file = create_joint_file(dataset_name)
+            temp_files.append(data_file)
+            data_hash = file_hash(data_file)
+            trees_file = None
+
+            for encoding_type in args.encodings:
+                cache_file = os.path.join(args.cache_dir, f"{data_hash}_{encoding_type}.json")
+                cells.append((dataset_name, encoding_type, cache_file))
+                results[cache_file] = read_cache(cache_file)
+                if results[cache_file] is not None:
+                    print(f"  Cached encoding: {encoding_type}")
+                    continue
+
+                # The trees do not depend on the encoding: build them once per dataset
+                if trees_file is None:
+                    trees_file = to_parenthesized(data_file, tempfile.NamedTemporaryFile(delete=False).name)
+                    temp_files.append(trees_file)
+                print(f"  Testing encoding: {encoding_type}")
+                pending[cache_file] = executor.submit(
+                    cached_max_possible_recall, data_file, trees_file, encoding_type, cache_file
+                )
+
+        for cache_file, future in pending.items():
+            results[cache_file] = future.result()
+
+    for file in temp_files:
+        os.unlink(file)
+
+    # Store all results for CSV, in grid order
     all_results = []
-    
-    for dataset_name in datasets:
-        print(f"Processing dataset: {dataset_name}")
-        data_file = create_joint_file(dataset_name)
-        
-        # Check if file exists
-        if not os.path.exists(data_file):
-            print(f"Warning: File {data_file} does not exist. Skipping.")
-            continue
-            
-        for encoding_type in encodings:
-            print(f"  Testing encoding: {encoding_type}")
-            
-            # Run the test
-            result = max_possible_recall(data_file, encoding_type)
-            
-            # Add metadata to result
-            result["dataset"] = dataset_name
-            result["encoding"] = encoding_type
-            result["max_recall_percentage"] = f"{result['max_recall']:.2%}"
-            
-            # Store result for CSV
-            all_results.append(result)
-            
-            # Print progress
-            print(f"  - Max Recall: {result['max_recall']:.2%}, "
-                  f"Correct: {result['correct_entities']}, "
-                  f"Gold: {result['gold_entities']}")
+    for dataset_name, encoding_type, cache_file in cells:
+        result = dict(results[cache_file])
+
+        # Add metadata to result
+        result["dataset"] = dataset_name
+        result["encoding"] = encoding_type
+        result["max_recall_percentage"] = f"{result['max_recall']:.2%}"
+        all_results.append(result)
+
+        # Print progress
+        print(f"{dataset_name} {encoding_type} - Max Recall: {result['max_recall']:.2%}, "
+              f"Correct: {result['correct_entities']}, "
+              f"Gold: {result['gold_entities']}")
     
     # Save all results to CSV
-    save_results_to_csv(all_results, output_file)
\ No newline at end of file
+    save_results_to_csv(all_results, output_file)
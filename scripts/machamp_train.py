@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import runpy
+import argparse
+import functools
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.machamp.checkpoint import CheckpointManager, EpochCheckpointing, DEV_METRIC, METRICS_FILE, read_dev_score
+from src.machamp.predictor import MACHAMP_DIR
+from src.data.transforms import write_atomic
+
+
+# Run the MaChAmp training script with per-epoch checkpoints in model_dir/checkpoints.
+# If model_dir already has a checkpoint (e.g. the job was preempted), training
+# resumes from it and only runs the remaining epochs. Every other argument is
+# passed to MaChAmp unchanged.
+#
+# MaChAmp is started again with num_epochs reduced to the remaining epochs, so
+# - the learning rate scheduler is built for that shorter horizon and follows the
+#   original schedule because its restored state (which holds the number of
+#   epochs) overrides it; a warning is printed if it does not,
+# - MaChAmp only chooses its best model among the remaining epochs: the dev score
+#   of every epoch (read from the metrics files MaChAmp writes to model_dir) and
+#   the weights of the best one are kept in the checkpoints, and if an epoch
+#   before the resume is still the best, its weights replace those of model.pt,
+# - the epochs MaChAmp reports (and its metrics files) are numbered from 1 again.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable MaChAmp training")
+    parser.add_argument('--parameters_config', required=True)
+    parser.add_argument('--model_dir', required=True)
+    parser.add_argument('--keep_checkpoints', type=int, default=2, help="Number of checkpoints kept on disk")
+    parser.add_argument('--dev_metric', default=DEV_METRIC,
+                        help=f"Key of the dev score in the MaChAmp metrics files ({METRICS_FILE}) used to keep "
+                             f"the best epoch across resumes")
+    args, machamp_args = parser.parse_known_args()
+
+    manager = CheckpointManager(args.model_dir, keep=args.keep_checkpoints)
+    state = manager.latest()
+    parameters_config = args.parameters_config
+    with open(parameters_config, 'r') as f:
+        config = json.load(f)
+    num_epochs = int(config["training"]["num_epochs"])
+    if state is not None:
+        if state['epoch'] >= num_epochs:
+            print(f"The checkpoint of epoch {state['epoch']} is already the last one, training from scratch")
+            state = None
+        elif state.get('scheduler') is None:
+            print(f"The checkpoint of epoch {state['epoch']} has no learning rate scheduler state and cannot be "
+                  f"resumed exactly, training from scratch")
+            manager.clear()
+            state = None
+        else:
+            config["training"]["num_epochs"] = num_epochs - state['epoch']
+            parameters_config = os.path.join(args.model_dir, 'params-config.resume.json')
+            write_atomic([json.dumps(config)], parameters_config)
+            print(f"Resuming training after epoch {state['epoch']} of {num_epochs}")
+
+    checkpointing = EpochCheckpointing(manager, state, num_epochs,
+                                       functools.partial(read_dev_score, args.model_dir, metric=args.dev_metric))
+    checkpointing.install()
+
+    sys.path.insert(0, MACHAMP_DIR)
+    sys.argv = [os.path.join(MACHAMP_DIR, 'train.py'), '--parameters_config', parameters_config,
+                '--model_dir', args.model_dir] + machamp_args
+    model_file = os.path.join(args.model_dir, 'model.pt')
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+        try:
+            checkpointing.check()
+        except RuntimeError:
+            # Trained from scratch on the remaining epochs only: not a valid model
+            if os.path.exists(model_file):
+                os.remove(model_file)
+            raise
+        checkpointing.keep_best(model_file)
+    finally:
+        checkpointing.uninstall()
+        # Training finished: the checkpoints are not needed anymore
+        if os.path.exists(model_file):
+            manager.clear()
@@ -0,0 +1,40 @@
+import os
+import sys
+import argparse
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.machamp.scheduler import Scheduler, grid_jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a grid of datasets, encoders, encodings and seeds on a set of devices")
+    parser.add_argument('--datasets', nargs='+', default=["ace2004", "ace2005", "nne", "genia"])
+    parser.add_argument('--encoders', nargs='+', required=True, help="Encoder models from HuggingFace")
+    parser.add_argument('--encodings', nargs='+', default=['ABS', 'REL', 'JUX', 'DYN', '4EC'],
+                        choices=['ABS', 'REL', 'JUX', 'DYN', '4EC'])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--num_epochs', type=int, default=30)
+    parser.add_argument('--devices', nargs='+', default=['0'], help="GPU ids, or 'cpu' for CPU slots")
+    parser.add_argument('--per_device', type=int, default=1, help="Maximum number of jobs running on each device")
+    parser.add_argument('--retries', type=int, default=1, help="Times a failed job is run again")
+    parser.add_argument('--retry_failed', action='store_true', help="Queue again the jobs that failed in a previous run")
+    parser.add_argument('--workers', type=int, default=1, help="Processes used to prepare the data of each job")
+    parser.add_argument('--host_slots', type=int, default=None,
+                        help="Maximum number of data preparation jobs running at a time "
+                             "(default: the number of CPUs divided by --workers)")
+    parser.add_argument('--queue', type=str, default='logs/scheduler/queue.json', help="Persistent job queue")
+    parser.add_argument('--poll_interval', type=float, default=5.0)
+    args = parser.parse_args()
+    host_slots = args.host_slots or max(1, (os.cpu_count() or 1) // args.workers)
+
+    scheduler = Scheduler(args.queue, args.devices, args.per_device, args.retries, poll_interval=args.poll_interval,
+                          host_slots=host_slots)
+    if args.retry_failed:
+        scheduler.reset_failed()
+    scheduler.add(grid_jobs(args.datasets, args.encoders, args.encodings, args.seeds, args.num_epochs, args.workers))
+    counts = scheduler.run()
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if counts.get('failed'):
+        sys.exit(1)
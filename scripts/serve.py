@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.machamp.predictor import PredictionServer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve MaChAmp predictions from models kept in memory")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (localhost only)")
+    parser.add_argument('--device', type=str, default='cpu', help="Device to load the models on")
+    parser.add_argument('--max_models', type=int, default=2, help="Number of models kept loaded (LRU)")
+    parser.add_argument('--batch_window', type=float, default=0.01,
+                        help="Seconds to wait for more sentence requests to batch together")
+    parser.add_argument('--max_batch_sentences', type=int, default=256,
+                        help="Maximum number of sentences tagged in one batch")
+    args = parser.parse_args()
+
+    server = PredictionServer(args.port, device=args.device, max_models=args.max_models,
+                              batch_window=args.batch_window, max_batch_sentences=args.max_batch_sentences)
+    print(f"Serving predictions on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,38 @@
+import argparse
+import json
+import os
+import sys
+
+# Add the project root to the python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.evaluation.evaluator import Evaluator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals and paired significance tests")
+    parser.add_argument('--gold', type=str, required=True, help="Gold .data file")
+    parser.add_argument('--pred', type=str, required=True, help="Predicted .data file")
+    parser.add_argument('--pred_b', type=str, default=None,
+                        help="Second predicted .data file, to test the difference with --pred")
+    parser.add_argument('--breakdowns', nargs='*', default=['label', 'depth'], choices=['label', 'depth'])
+    parser.add_argument('--n_resamples', type=int, default=10000)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    evaluator = Evaluator()
+    results = {"bootstrap": evaluator.bootstrap(args.gold, args.pred, args.breakdowns,
+                                                args.n_resamples, args.confidence, args.seed)}
+    if args.pred_b:
+        results["bootstrap_b"] = evaluator.bootstrap(args.gold, args.pred_b, args.breakdowns,
+                                                     args.n_resamples, args.confidence, args.seed)
+        results["paired_test"] = evaluator.paired_test(args.gold, args.pred, args.pred_b, args.breakdowns,
+                                                       args.n_resamples, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
@@ -1,4 +1,5 @@
 import argparse
+import subprocess
 import torch
 import os
 import sys
@@ -7,16 +8,18 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.machamp.configs import ConfigCreator
-from src.data.utils import to_parenthesized, remove_bos_eos, encode, remove_features
+from src.machamp.checkpoint import CheckpointManager
+from src.data.utils import to_parenthesized, encode
+from src.data.transforms import drop_bos_eos
 from tqdm import tqdm
 
 
-machamp_training_script = os.path.join(os.path.dirname(__file__), '..', 'machamp', 'train.py')
+machamp_training_script = os.path.join(os.path.dirname(__file__), 'machamp_train.py')
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument("--dataset", help="NNER dataset", required=True)
-parser.add_argument('--encoder', help="Encoder model from HuggingFace.", required=True)
+parser.add_argument('--encoder', help="Encoder model from HuggingFace. Required unless --prepare_only.")
 parser.add_argument('--encoding', help="Sequence labeling encoding", 
                     choices=['ABS', 'REL', 'JUX', 'DYN', '4EC'], required=True)
 parser.add_argument('--device', default=0, type=int)
@@ -24,14 +27,24 @@ parser.add_argument('--num_epochs', help="Number of epochs for the experiment",
 parser.add_argument('--n_seeds',
                     help="Number of random initializations for the experiment", 
                     default=1)
+parser.add_argument('--seeds', nargs='+', type=int, default=None,
+                    help="Seeds to train (default: 0 to n_seeds - 1)")
+parser.add_argument('--prepare_only', action='store_true', default=False,
+                    help="Only create the .trees and .labels files")
+parser.add_argument('--keep_checkpoints', type=int, default=2,
+                    help="Number of per-epoch checkpoints kept to resume interrupted runs")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of processes used to convert and encode the data")
 parser.add_argument('--time', action='store_true', default=False, help='Measure and print training time for each seed')
 
 args = parser.parse_args()
+if not args.encoder and not args.prepare_only:
+    parser.error("--encoder is required unless --prepare_only is given")
 
 if args.device == None:
     device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
-encoder_name = args.encoder.split('/')[-1]
+encoder_name = args.encoder.split('/')[-1] if args.encoder else None
 data_dir = f'data/{args.dataset}'
 
 # create .label data if it does not exist
@@ -39,7 +52,8 @@ if not os.path.exists(f'data/{args.dataset}/{args.encoding}/train.labels'):
     for split in tqdm(['test', 'dev', 'train']):
         to_parenthesized(
             f'{data_dir}/{split}.data', 
-            f'{data_dir}/{split}.trees'
+            f'{data_dir}/{split}.trees',
+            workers=args.workers
             )
         print(f'{split}.trees file created.')
         input_file = f"{data_dir}/{split}.trees"
@@ -49,44 +63,56 @@ if not os.path.exists(f'data/{args.dataset}/{args.encoding}/train.labels'):
             os.makedirs(encoding_dir)
         
         output_file = f"{encoding_dir}/{split}.labels"
-        encode(args.encoding, input_file, output_file)
-        remove_bos_eos(output_file)
+        # -BOS-/-EOS- rows are dropped while the labels are written
+        encode(args.encoding, input_file, output_file, workers=args.workers, transforms=[drop_bos_eos])
         print(f'{split}.labels file created.')
 
-for seed in range(int(args.n_seeds)):
+if args.prepare_only:
+    sys.exit(0)
+
+
+def run_machamp(dataset_config, parameter_config, seed, model_dir):
+    """
+    Run the MaChAmp training script and return its exit code.
+    """
+    return subprocess.run([
+        sys.executable, machamp_training_script, '--dataset_configs', dataset_config,
+        '--device', str(args.device), '--parameters_config', parameter_config,
+        '--seed', str(seed), '--model_dir', model_dir, '--keep_checkpoints', str(args.keep_checkpoints)
+    ]).returncode
+
+
+failed_seeds = []
+seeds = args.seeds if args.seeds is not None else range(int(args.n_seeds))
+for seed in seeds:
     model_dir = f'logs/machamp/{args.dataset}/{encoder_name}/{args.encoding}/seed_{seed}'
     if args.time:
         import time
         start_time = time.time()
     
     # Check if directory exists and has a completed model
-    if os.path.exists(model_dir):
-        if os.path.exists(f'{model_dir}/model.pt'):
-            print(f"Seed {seed} already has a completed model. Skipping...")
-        
-        else: # TODO: properly resume the training of a particular seed, using the last checkpoint
-            print(f"Seed {seed} has an incomplete model. Resuming training...")
-            config_creator = ConfigCreator(args.dataset, args.encoder, 
-                                args.encoding, args.num_epochs,
-                                seed, template_dir='parameter_configs')
-            dataset_config = config_creator.create_dataset_config()
-            parameter_config = config_creator.create_parameters_config()
-
-        os.system(f'python {machamp_training_script} --dataset_configs {dataset_config} \
-                --device {args.device} --parameters_config {parameter_config} \
-                --seed {seed} --model_dir {model_dir}')
-        
-    else:
-        config_creator = ConfigCreator(args.dataset, args.encoder, 
-                                args.encoding, args.num_epochs,
-                                seed, template_dir='parameter_configs')
-        dataset_config = config_creator.create_dataset_config()
-        parameter_config = config_creator.create_parameters_config()
-
-        os.system(f'python {machamp_training_script} --dataset_configs {dataset_config} \
-                --device {args.device} --parameters_config {parameter_config} \
-                --seed {seed} --model_dir {model_dir}')
+    if os.path.exists(f'{model_dir}/model.pt'):
+        print(f"Seed {seed} already has a completed model. Skipping...")
+        continue
+
+    # An incomplete model resumes from its last checkpoint (in machamp_train.py)
+    checkpoints = CheckpointManager(model_dir).epochs()
+    if checkpoints:
+        print(f"Seed {seed} has an incomplete model. Resuming training after epoch {checkpoints[0]}...")
+
+    config_creator = ConfigCreator(args.dataset, args.encoder, 
+                            args.encoding, args.num_epochs,
+                            seed, template_dir='parameter_configs')
+    dataset_config = config_creator.create_dataset_config()
+    parameter_config = config_creator.create_parameters_config()
+
+    if run_machamp(dataset_config, parameter_config, seed, model_dir) != 0:
+        failed_seeds.append(seed)
     
     if args.time:
         elapsed = time.time() - start_time
-        print(f"[Timing] Training for seed {seed} took {elapsed:.2f} seconds.")
\ No newline at end of file
+        print(f"[Timing] Training for seed {seed} took {elapsed:.2f} seconds.")
+
+if failed_seeds:
+    print(f"Training failed for seeds {failed_seeds}")
+    sys.exit(1)
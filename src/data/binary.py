@@ -0,0 +1,184 @@
+import os
+import json
+import struct
+from array import array
+
+import numpy as np
+
+from src.data.utils import read_data
+
+# Layout of a compiled corpus: MAGIC, the length of the JSON header (uint64), the
+# JSON header (vocabularies, counts and the byte offset of every array) and the
+# arrays, each aligned to ALIGNMENT bytes:
+#   sentence_offsets int64 (n_sentences + 1): first token of every sentence
+#   entity_offsets   int64 (n_sentences + 1): first entity of every sentence
+#   tokens           int32 (n_tokens): token ids
+#   entities         int32 (n_entities, 3): start, end and type id, sorted per sentence
+MAGIC = b'NNERBIN1'
+BINARY_SUFFIX = '.nnerbin'
+ALIGNMENT = 64
+ARRAYS = (
+    ("sentence_offsets", np.int64, 1),
+    ("entity_offsets", np.int64, 1),
+    ("tokens", np.int32, 1),
+    ("entities", np.int32, 3),
+)
+
+
+def binary_path(data_file):
+    return os.path.splitext(data_file)[0] + BINARY_SUFFIX
+
+
+def is_binary(path):
+    return path.endswith(BINARY_SUFFIX)
+
+
+def resolve(data_file):
+    """
+    The compiled version of a .data file if it exists and is up to date, else the
+    .data file itself.
+    """
+    compiled = binary_path(data_file)
+    if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(data_file):
+        return compiled
+    return data_file
+
+
+def compile_data(data_file, output_file=None):
+    """
+    Compile a .data file into the binary format, in one pass over the text.
+    Entities are deduplicated per sentence as in find_entities.
+    """
+    output_file = output_file or binary_path(data_file)
+    token_vocab, type_vocab = {}, {}
+    sentence_offsets, entity_offsets = array('q', [0]), array('q', [0])
+    tokens, entities = array('i'), array('i')
+
+    with open(data_file, 'r', encoding='utf-8') as f:
+        for sentence_tokens, sentence_entities in read_data(f):
+            tokens.extend(token_vocab.setdefault(token, len(token_vocab)) for token in sentence_tokens)
+            spans = sorted(
+                (start, end, type_vocab.setdefault(entity_type, len(type_vocab)))
+                for entity_type, start, end in set(sentence_entities)
+            )
+            for span in spans:
+                entities.extend(span)
+            sentence_offsets.append(len(tokens))
+            entity_offsets.append(len(entities) // 3)
+
+    arrays = {
+        "sentence_offsets": sentence_offsets, "entity_offsets": entity_offsets,
+        "tokens": tokens, "entities": entities,
+    }
+    header = {
+        "n_sentences": len(sentence_offsets) - 1,
+        "n_tokens": len(tokens),
+        "n_entities": len(entities) // 3,
+        "token_vocab": list(token_vocab),
+        "type_vocab": list(type_vocab),
+    }
+    # Offsets depend on the header length, which depends on the offsets: reserve
+    # room by formatting them with a fixed width
+    header["offsets"] = {name: 10 ** 18 for name in arrays}
+    header_length = len(json.dumps(header, ensure_ascii=False).encode('utf-8'))
+    position = _align(len(MAGIC) + 8 + header_length)
+    for name, dtype, _ in ARRAYS:
+        header["offsets"][name] = position
+        position = _align(position + len(arrays[name]) * np.dtype(dtype).itemsize)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8').ljust(header_length)
+
+    with open(output_file, 'wb') as out:
+        out.write(MAGIC + struct.pack('<Q', header_length) + header_bytes)
+        for name, dtype, _ in ARRAYS:
+            out.write(b'\0' * (header["offsets"][name] - out.tell()))
+            arrays[name].tofile(out)
+    return output_file
+
+
+def _align(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+class BinaryCorpus:
+    """
+    Read-only, memory-mapped view of a compiled corpus. Opening it only parses the
+    header; the arrays are paged in on access and shared between the processes
+    that map the same file. Slicing sentences returns views, not copies.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled NNER corpus")
+            header_length, = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(header_length))
+
+        self.token_vocab = self.header["token_vocab"]
+        self.type_vocab = self.header["type_vocab"]
+        sizes = {
+            "sentence_offsets": self.header["n_sentences"] + 1,
+            "entity_offsets": self.header["n_sentences"] + 1,
+            "tokens": self.header["n_tokens"],
+            "entities": self.header["n_entities"],
+        }
+        for name, dtype, width in ARRAYS:
+            shape = (sizes[name], width) if width > 1 else (sizes[name],)
+            if sizes[name]:
+                values = np.memmap(path, dtype=dtype, mode='r', offset=self.header["offsets"][name], shape=shape)
+            else:
+                values = np.zeros(shape, dtype=dtype)
+            setattr(self, name, values)
+
+    def __len__(self):
+        return self.header["n_sentences"]
+
+    def token_ids(self, i):
+        return self.tokens[self.sentence_offsets[i]:self.sentence_offsets[i + 1]]
+
+    def entity_array(self, i):
+        """
+        (n, 3) view with the start, end and type id of the entities of sentence i.
+        """
+        return self.entities[self.entity_offsets[i]:self.entity_offsets[i + 1]]
+
+    def sentence_range(self, start, end):
+        """
+        Views of the token ids and entities of sentences [start, end), with their
+        offsets relative to the first sentence of the range.
+        """
+        token_offsets = self.sentence_offsets[start:end + 1]
+        entity_offsets = self.entity_offsets[start:end + 1]
+        return (
+            self.tokens[token_offsets[0]:token_offsets[-1]], token_offsets - token_offsets[0],
+            self.entities[entity_offsets[0]:entity_offsets[-1]], entity_offsets - entity_offsets[0],
+        )
+
+    def sentence_tokens(self, i):
+        return [self.token_vocab[t] for t in self.token_ids(i)]
+
+    def sentence_entities(self, i):
+        """
+        The entities of sentence i as a set of (type, start, end) tuples.
+        """
+        return {(self.type_vocab[t], int(s), int(e)) for s, e, t in self.entity_array(i)}
+
+    def entity_sets(self, start=0, end=None):
+        """
+        The entities of sentences [start, end) as a list of sets, as returned by find_entities.
+        """
+        end = len(self) if end is None else end
+        _, _, entities, offsets = self.sentence_range(start, end)
+        types = self.type_vocab
+        rows = entities.tolist()
+        offsets = offsets.tolist()
+        return [
+            {(types[t], s, e) for s, e, t in rows[offsets[i]:offsets[i + 1]]}
+            for i in range(end - start)
+        ]
+
+    def __iter__(self):
+        """
+        Yield (tokens, entities) for every sentence, like read_data.
+        """
+        for i in range(len(self)):
+            yield self.sentence_tokens(i), sorted(self.sentence_entities(i), key=lambda x: (x[1], -x[2]))
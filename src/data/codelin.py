@@ -0,0 +1,188 @@
+import os
+import sys
+import multiprocessing
+from functools import lru_cache
+from itertools import islice
+
+from src.data.transforms import BOS, EOS, apply, write_atomic
+
+CODELIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'CoDeLin'))
+
+# Options we always pass to CoDeLin (the separator is not present in the labels)
+SEPARATOR = '[_]'
+UNARY_JOINER = '[+]'
+BINARY_MARKER = '[b]'
+N_LABEL_COLS = 3
+
+
+def _import_codelin():
+    """
+    Make the CoDeLin submodule importable and return the classes we need.
+    """
+    if CODELIN_DIR not in sys.path:
+        sys.path.insert(0, CODELIN_DIR)
+
+    from codelin.models.const_tree import C_Tree
+    from codelin.models.linearized_tree import LinearizedTree
+    from codelin.encs.enc_const import (
+        C_NaiveAbsoluteEncoding, C_NaiveRelativeEncoding, C_NaiveDynamicEncoding,
+        C_JuxtaposedEncoding, C_Tetratag
+    )
+    from codelin.utils.constants import C_STRAT_MAX
+
+    encoders = {
+        'ABS': C_NaiveAbsoluteEncoding,
+        'REL': C_NaiveRelativeEncoding,
+        'DYN': C_NaiveDynamicEncoding,
+        'JUX': C_JuxtaposedEncoding,
+        '4EC': C_Tetratag,
+    }
+    return C_Tree, LinearizedTree, encoders, C_STRAT_MAX
+
+
+class Codelin:
+    """
+    In-process CoDeLin encoder/decoder for one (encoding, separator, multitask)
+    configuration. Build it once and call encode/decode on lists of trees or
+    label blocks, instead of running CoDeLin/main.py once per file.
+    """
+    def __init__(self, encoding, separator=SEPARATOR, unary_joiner=UNARY_JOINER,
+                 binary_marker=BINARY_MARKER, multitask=True, n_label_cols=N_LABEL_COLS):
+        self.C_Tree, self.LinearizedTree, encoders, self.conflict_strategy = _import_codelin()
+        if encoding not in encoders:
+            raise ValueError(f"Unknown encoding {encoding}, expected one of {sorted(encoders)}")
+
+        self.options = (encoding, separator, unary_joiner, binary_marker, multitask, n_label_cols)
+        self.encoding = encoding
+        self.separator = separator
+        self.unary_joiner = unary_joiner
+        self.multitask = multitask
+        self.n_label_cols = n_label_cols if multitask else 1
+        self.encoder = encoders[encoding](
+            separator=separator, unary_joiner=unary_joiner,
+            reverse=False, binary_marker=binary_marker
+        )
+
+    def encode(self, trees):
+        """
+        Encode a list of parenthesized trees into a list of .labels blocks
+        (one string per sentence, with -BOS- and -EOS- rows).
+        """
+        blocks = []
+        for tree in trees:
+            c_tree = self.C_Tree.from_string(tree.strip())
+            # equivalent to --ignore_postag: our trees have no preterminals
+            c_tree = c_tree.add_dummy_preterminals()
+            linearized = self.encoder.encode(c_tree)
+            blocks.append(linearized.to_string(
+                f_idx_dict=None, add_bos_eos=True,
+                separate_columns=self.multitask, n_label_cols=self.n_label_cols
+            ).rstrip('\n'))
+        return blocks
+
+    def decode(self, blocks):
+        """
+        Decode a list of .labels blocks (one string per sentence) into a list
+        of parenthesized trees.
+        """
+        trees = []
+        for block in blocks:
+            linearized = self.LinearizedTree.from_string(
+                block, mode='CONST', separator=self.separator, unary_joiner=self.unary_joiner,
+                separate_columns=self.multitask, n_label_cols=self.n_label_cols
+            )
+            c_tree = self.encoder.decode(linearized)
+            c_tree = c_tree.postprocess_tree(conflict_strat=self.conflict_strategy, clean_nulls=True)
+            trees.append(str(c_tree).replace('\n', ' '))
+        return trees
+
+    def map_chunks(self, operation, items, workers=1, chunksize=1000):
+        """
+        Apply encode or decode to consecutive chunks of items, yielding the results
+        of every chunk in order. With workers > 1 the chunks are processed in a pool
+        of processes, each building its own Codelin once.
+        """
+        chunks = chunked(items, chunksize)
+        if workers <= 1:
+            for chunk in chunks:
+                yield getattr(self, operation)(chunk)
+            return
+
+        with multiprocessing.Pool(workers) as pool:
+            yield from pool.imap(_run_chunk, ((self.options, operation, chunk) for chunk in chunks))
+
+    def encode_file(self, trees_file, labels_file, workers=1, transforms=()):
+        """
+        Encode a .trees file (one tree per line) into a .labels file, sharding the
+        sentences across workers processes if workers > 1. The output lines go
+        through the given src.data.transforms in the same pass, and the file is
+        written atomically.
+        """
+        def lines(trees):
+            for blocks in self.map_chunks('encode', trees, workers):
+                for block in blocks:
+                    yield from block.split('\n')
+                    yield ''
+
+        with open(trees_file, 'r', encoding='utf-8') as f:
+            trees = (line for line in f if line.strip())
+            return write_atomic(apply(lines(trees), transforms), labels_file)
+
+    def decode_file(self, labels_file, trees_file, workers=1):
+        """
+        Decode a .labels file (blank-line separated sentences) into a .trees file,
+        sharding the sentences across workers processes if workers > 1. The file
+        is written atomically.
+        """
+        def lines(blocks):
+            for trees in self.map_chunks('decode', blocks, workers):
+                yield from trees
+
+        with open(labels_file, 'r', encoding='utf-8') as f:
+            return write_atomic(lines(read_label_blocks(f)), trees_file)
+
+
+def chunked(items, size):
+    """
+    Split an iterable into consecutive lists of at most size items.
+    """
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+@lru_cache(maxsize=None)
+def _codelin_from_options(options):
+    return Codelin(*options)
+
+
+def _run_chunk(task):
+    options, operation, chunk = task
+    return getattr(_codelin_from_options(options), operation)(chunk)
+
+
+def read_label_blocks(f):
+    """
+    Yield the sentences of a .labels file handle as strings, one block of
+    non-empty lines at a time.
+    """
+    block = []
+    for line in f:
+        line = line.rstrip('\n')
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield '\n'.join(block)
+            block = []
+    if block:
+        yield '\n'.join(block)
+
+
+@lru_cache(maxsize=None)
+def get_codelin(encoding, multitask=True):
+    """
+    Return the shared Codelin instance for a configuration, building it on first use.
+    """
+    return Codelin(encoding, multitask=multitask)
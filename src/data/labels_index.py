@@ -0,0 +1,214 @@
+import os
+import random
+import struct
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Sidecar index of a .labels file: MAGIC, a fingerprint of the indexed file (size,
+# mtime in ns and a SHA-256 of its content), the number of sentences and an int64
+# array of (byte offset, byte length) pairs, one per block of non-empty lines.
+MAGIC = b'NNERLIDX'
+INDEX_SUFFIX = '.idx'
+HASH_BLOCK = 1 << 20
+HEADER = struct.Struct('<QQ32sQ')
+# Sentences read at once by LabelsReader.blocks
+CHUNK_SENTENCES = 1000
+
+
+class StaleIndexError(Exception):
+    pass
+
+
+def index_path(labels_file):
+    return labels_file + INDEX_SUFFIX
+
+
+def content_hash(labels_file):
+    """
+    SHA-256 of the whole content of a file.
+    """
+    sha = hashlib.sha256()
+    with open(labels_file, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            sha.update(block)
+    return sha.digest()
+
+
+def write_index(index_file, size, mtime_ns, digest, spans):
+    """
+    Write a sidecar index through a temporary file renamed over index_file, so
+    that readers never see a partial index.
+    """
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(index_file)), delete=False,
+                                      prefix=f'.{os.path.basename(index_file)}.', suffix='.tmp')
+    try:
+        with tmp:
+            tmp.write(MAGIC + HEADER.pack(size, mtime_ns, digest, len(spans)))
+            np.asarray(spans, dtype=np.int64).reshape(-1, 2).tofile(tmp)
+        os.replace(tmp.name, index_file)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
+def build_index(labels_file, index_file=None):
+    """
+    Index the sentences of a .labels file in one streaming pass and write the
+    sidecar index (labels_file + '.idx' by default).
+    """
+    index_file = index_file or index_path(labels_file)
+    spans = []
+    start = None
+    position = 0
+    block_end = 0
+    sha = hashlib.sha256()
+    stat = os.stat(labels_file)
+    with open(labels_file, 'rb') as f:
+        for line in f:
+            sha.update(line)
+            if line.strip():
+                if start is None:
+                    start = position
+                block_end = position + len(line.rstrip(b'\r\n'))
+            elif start is not None:
+                spans.append((start, block_end - start))
+                start = None
+            position += len(line)
+    if start is not None:
+        spans.append((start, block_end - start))
+
+    write_index(index_file, position, stat.st_mtime_ns, sha.digest(), spans)
+    return LabelsIndex(labels_file, index_file)
+
+
+class LabelsIndex:
+    """
+    Byte offsets and lengths of the sentences of a .labels file, read from its
+    sidecar index.
+    """
+    def __init__(self, labels_file, index_file=None):
+        self.labels_file = labels_file
+        self.index_file = index_file or index_path(labels_file)
+        with open(self.index_file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.index_file} is not a .labels index")
+            self.size, self.mtime_ns, self.digest, n_sentences = HEADER.unpack(f.read(HEADER.size))
+        spans = np.fromfile(self.index_file, dtype=np.int64, offset=len(MAGIC) + HEADER.size)
+        spans = spans.reshape(n_sentences, 2)
+        self.offsets, self.lengths = spans[:, 0], spans[:, 1]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def is_stale(self):
+        """
+        Whether the .labels file changed since it was indexed. The size and mtime
+        are compared first; if only the mtime changed, the hash of the whole
+        content decides, so same-size edits anywhere in the file are detected.
+        If the content did not change (e.g. the file was touched or copied), the
+        new mtime is written to the index, so the file is not hashed again.
+        """
+        if not os.path.exists(self.labels_file):
+            return True
+        stat = os.stat(self.labels_file)
+        if stat.st_size != self.size:
+            return True
+        if stat.st_mtime_ns == self.mtime_ns:
+            return False
+        if content_hash(self.labels_file) != self.digest:
+            return True
+        try:
+            write_index(self.index_file, self.size, stat.st_mtime_ns, self.digest,
+                        np.stack([self.offsets, self.lengths], axis=1))
+            self.mtime_ns = stat.st_mtime_ns
+        except OSError:
+            # e.g. a read-only directory: the index stays valid, only slower to check
+            pass
+        return False
+
+    @classmethod
+    def load(cls, labels_file, index_file=None, rebuild=True):
+        """
+        Load the index of a .labels file, building it if it is missing and
+        rebuilding it if it is stale (or raising StaleIndexError if rebuild is False).
+        """
+        index_file = index_file or index_path(labels_file)
+        if os.path.exists(index_file):
+            index = cls(labels_file, index_file)
+            if not index.is_stale():
+                return index
+            if not rebuild:
+                raise StaleIndexError(f"{index_file} is older than {labels_file}")
+        return build_index(labels_file, index_file)
+
+
+class LabelsReader:
+    """
+    Random access to the sentences of a .labels file through its index. Blocks
+    are returned as read_label_blocks returns them (lines joined with '\\n').
+    """
+    def __init__(self, labels_file, index_file=None, rebuild=True):
+        self.labels_file = labels_file
+        self.index = LabelsIndex.load(labels_file, index_file, rebuild)
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def _decode(data):
+        return data.decode('utf-8').replace('\r\n', '\n')
+
+    def __getitem__(self, i):
+        with open(self.labels_file, 'rb') as f:
+            f.seek(int(self.index.offsets[i]))
+            return self._decode(f.read(int(self.index.lengths[i])))
+
+    def blocks(self, start=0, end=None, chunk_size=CHUNK_SENTENCES):
+        """
+        Yield the sentences [start, end) with one seek and one contiguous read per
+        chunk of chunk_size sentences.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        offsets, lengths = self.index.offsets, self.index.lengths
+        with open(self.labels_file, 'rb') as f:
+            for chunk_start in range(start, end, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, end)
+                base = int(offsets[chunk_start])
+                f.seek(base)
+                data = f.read(int(offsets[chunk_end - 1] + lengths[chunk_end - 1]) - base)
+                for offset, length in zip(offsets[chunk_start:chunk_end].tolist(),
+                                          lengths[chunk_start:chunk_end].tolist()):
+                    yield self._decode(data[offset - base:offset - base + length])
+
+    def shard(self, shard_id, n_shards):
+        """
+        The sentences of one of n_shards contiguous shards of (almost) equal size.
+        """
+        start, end = shard_bounds(len(self), n_shards)[shard_id]
+        return self.blocks(start, end)
+
+    def sample(self, k, seed=0):
+        """
+        k sentences drawn without replacement, in file order.
+        """
+        indices = sorted(random.Random(seed).sample(range(len(self)), min(k, len(self))))
+        with open(self.labels_file, 'rb') as f:
+            for i in indices:
+                f.seek(int(self.index.offsets[i]))
+                yield self._decode(f.read(int(self.index.lengths[i])))
+
+
+def shard_bounds(n_sentences, n_shards):
+    """
+    (start, end) of n_shards contiguous ranges covering n_sentences sentences.
+    """
+    size, extra = divmod(n_sentences, n_shards)
+    bounds = []
+    start = 0
+    for shard_id in range(n_shards):
+        end = start + size + (shard_id < extra)
+        bounds.append((start, end))
+        start = end
+    return bounds
@@ -0,0 +1,297 @@
+import json
+import random
+import bisect
+import multiprocessing
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+from src.data.utils import read_data
+
+# Number of sentences generated with the same random state. Shards are seeded by
+# their index, so the output does not depend on the number of workers.
+SHARD_SIZE = 10000
+N_TOKENS = 5000
+# The number of children is conditioned on the length of the parent span, with
+# long spans sharing one bucket, and ANY_LENGTH for the whole depth
+MAX_LENGTH_BUCKET = 32
+ANY_LENGTH = '*'
+MAX_DRAWS = 10
+DEFAULT_SENTENCE_LENGTHS = {n: 1 for n in range(10, 41)}
+DEFAULT_ENTITY_LENGTHS = {1: 40, 2: 25, 3: 15, 4: 8, 5: 5, 6: 3, 8: 2, 10: 1, 14: 1}
+
+
+def fit_profile(data_files, n_tokens=N_TOKENS):
+    """
+    Fit a generation profile from NNER .data files. Entities are arranged in a
+    forest per sentence (each entity is the child of its closest enclosing one),
+    and the profile keeps, for every depth, the distribution of the number of
+    children given the length of the parent span, of the span lengths and of the
+    types, plus the sentence lengths and the n_tokens most frequent tokens.
+    Depth 0 is the sentence itself.
+    """
+    profile = {
+        "sentence_count": 0,
+        "sentence_lengths": Counter(),
+        "children": defaultdict(lambda: defaultdict(Counter)),
+        "lengths": defaultdict(Counter),
+        "types": defaultdict(Counter),
+        "tokens": Counter(),
+    }
+    for data_file in data_files:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            for tokens, entities in read_data(f):
+                profile["sentence_count"] += 1
+                profile["sentence_lengths"][len(tokens)] += 1
+                profile["tokens"].update(tokens)
+                _count_nesting(len(tokens), set(entities), profile)
+
+    profile["tokens"] = Counter(dict(profile["tokens"].most_common(n_tokens)))
+    return _to_json(profile)
+
+
+def length_bucket(length):
+    return str(min(length, MAX_LENGTH_BUCKET))
+
+
+def _count_nesting(n_tokens, entities, profile):
+    """
+    Add the children, length and type counts of the entities of one sentence.
+    Identical spans with different types are kept as one span with several types.
+    """
+    spans = defaultdict(list)
+    for entity_type, start, end in entities:
+        spans[(start, end)].append(entity_type)
+
+    n_children = Counter()
+    stack = []  # (end, depth, span) of the open spans
+    for start, end in sorted(spans, key=lambda x: (x[0], -x[1])):
+        while stack and stack[-1][0] < end:
+            stack.pop()
+        parent = stack[-1][2] if stack else None
+        depth = stack[-1][1] + 1 if stack else 1
+        n_children[parent] += 1
+        stack.append((end, depth, (start, end)))
+
+        n_children.setdefault((start, end), 0)
+        profile["lengths"][depth][end - start + 1] += 1
+        profile["types"][depth][tuple(sorted(spans[(start, end)]))] += 1
+        spans[(start, end)] = (spans[(start, end)], depth)
+
+    for bucket in (ANY_LENGTH, length_bucket(n_tokens)):
+        profile["children"][0][bucket][n_children[None]] += 1
+    for (start, end), (_, depth) in spans.items():
+        for bucket in (ANY_LENGTH, length_bucket(end - start + 1)):
+            profile["children"][depth][bucket][n_children[(start, end)]] += 1
+
+
+def _to_json(profile):
+    """
+    Turn the counters of a profile into JSON-serializable dictionaries with string keys.
+    """
+    def by_depth(section, key=str):
+        return {str(depth): {key(k): v for k, v in counts.items()} for depth, counts in sorted(section.items())}
+
+    return {
+        "sentence_count": profile["sentence_count"],
+        "sentence_lengths": {str(k): v for k, v in sorted(profile["sentence_lengths"].items())},
+        "children": {
+            str(depth): {str(length): {str(k): v for k, v in counts.items()} for length, counts in by_length.items()}
+            for depth, by_length in sorted(profile["children"].items())
+        },
+        "lengths": by_depth(profile["lengths"]),
+        "types": by_depth(profile["types"], key='|'.join),
+        "tokens": dict(profile["tokens"]),
+    }
+
+
+def profile_from_statistics(statistics, mean_length=3):
+    """
+    Build an approximate profile from the statistics of
+    scripts/entities_per_depth.py (entity counts per depth, entity types and
+    sentence count). The number of children of the entities at depth d is
+    Poisson-like with mean counts[d + 1] / counts[d], types have the same
+    distribution at every depth and the lengths of nested spans shrink with depth.
+    """
+    counts = {int(k): v for k, v in statistics["counts"].items() if k != "all"}
+    n_sentences = max(statistics["sentence_count"], 1)
+    max_depth = max(counts, default=0)
+    types = {name: count for name, count in statistics["entity_types"].items()}
+
+    profile = {
+        "sentence_count": n_sentences,
+        "sentence_lengths": {str(k): v for k, v in DEFAULT_SENTENCE_LENGTHS.items()},
+        "children": {},
+        "lengths": {},
+        "types": {},
+        "tokens": {},
+    }
+    parents = n_sentences
+    for depth in range(0, max_depth + 1):
+        mean = counts.get(depth + 1, 0) / parents if parents else 0
+        profile["children"][str(depth)] = {ANY_LENGTH: _poisson_counts(mean)}
+        parents = counts.get(depth + 1, 0)
+        if depth > 0:
+            scale = max(1, mean_length + max_depth - depth)
+            profile["lengths"][str(depth)] = {str(k): v for k, v in DEFAULT_ENTITY_LENGTHS.items() if k <= 2 * scale}
+            profile["types"][str(depth)] = dict(types)
+    return profile
+
+
+def _poisson_counts(mean, size=1000):
+    """
+    Expected counts of a Poisson distribution over `size` draws, as {str(k): count}.
+    """
+    counts = {}
+    probability = pow(2.718281828459045, -mean)
+    for k in range(0, 50):
+        if k:
+            probability *= mean / k
+        count = round(probability * size)
+        if count:
+            counts[str(k)] = count
+        if k > mean and not count:
+            break
+    return counts or {"0": 1}
+
+
+class Sampler:
+    """
+    Sample from a {value: count} distribution with cumulative weights.
+    """
+    def __init__(self, counts, key=int):
+        self.values = [key(value) for value in counts]
+        self.cum_weights = list(accumulate(counts.values()))
+
+    def __call__(self, rng):
+        return self.values[bisect.bisect(self.cum_weights, rng.random() * self.cum_weights[-1])]
+
+    def sample(self, rng, k):
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+
+class CorpusGenerator:
+    """
+    Generate well-nested NNER sentences following a profile (see fit_profile).
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.sentence_lengths = Sampler(profile["sentence_lengths"])
+        self.children = {
+            int(d): {length: Sampler(c) for length, c in by_length.items()}
+            for d, by_length in profile["children"].items()
+        }
+        self.lengths = {int(d): Sampler(c) for d, c in profile["lengths"].items()}
+        self.types = {int(d): Sampler(c, key=lambda t: t.split('|')) for d, c in profile["types"].items()}
+        self.max_depth = max(self.lengths, default=0)
+        tokens = profile["tokens"] or {f"w{i}": 1 for i in range(N_TOKENS)}
+        self.tokens = Sampler(tokens, key=str)
+
+    def _spans(self, rng, start, end, depth, spans):
+        """
+        Place the children of the span [start, end] (the whole sentence at depth 0)
+        without overlaps, then recurse into them.
+        """
+        if depth >= self.max_depth or depth not in self.children:
+            return
+        children = self.children[depth]
+        sampler = children.get(length_bucket(end - start + 1)) or children[ANY_LENGTH]
+        n_children = sampler(rng)
+        # Nested spans are strictly shorter than their parent
+        room = end - start + 1 if depth == 0 else end - start
+        lengths = []
+        for _ in range(n_children):
+            # Redraw lengths that do not fit in the rest of the parent a few times
+            for _ in range(MAX_DRAWS):
+                length = self.lengths[depth + 1](rng)
+                if sum(lengths) + length <= room:
+                    lengths.append(length)
+                    break
+        if not lengths:
+            return
+
+        # Random gaps between the children
+        free = end - start + 1 - sum(lengths)
+        cuts = sorted(rng.randint(0, free) for _ in lengths)
+        position, previous_cut = start, 0
+        for length, cut in zip(lengths, cuts):
+            position += cut - previous_cut
+            previous_cut = cut
+            spans.append((position, position + length - 1, depth + 1))
+            self._spans(rng, position, position + length - 1, depth + 1, spans)
+            position += length
+
+    def sentence(self, rng):
+        """
+        Return the tokens and the (type, start, end) entities of one sentence.
+        """
+        n_tokens = self.sentence_lengths(rng)
+        spans = []
+        self._spans(rng, 0, n_tokens - 1, 0, spans)
+        tokens = self.tokens.sample(rng, n_tokens)
+        entities = [
+            (entity_type, start, end)
+            for start, end, depth in sorted(spans, key=lambda x: (x[0], -x[1]))
+            for entity_type in self.types[depth](rng)
+        ]
+        return tokens, entities
+
+    def shard(self, seed, shard_id, n_sentences):
+        """
+        The text of n_sentences sentences in .data format, generated from the
+        random state of (seed, shard_id).
+        """
+        rng = random.Random(f"{seed}-{shard_id}")
+        lines = []
+        for _ in range(n_sentences):
+            tokens, entities = self.sentence(rng)
+            lines.append(' '.join(tokens))
+            lines.append('|'.join(f"{start},{end} {entity_type}" for entity_type, start, end in entities))
+            lines.append('')
+        return '\n'.join(lines) + '\n'
+
+
+_generator = None
+
+
+def _init_worker(profile):
+    global _generator
+    _generator = CorpusGenerator(profile)
+
+
+def _generate_shard(task):
+    seed, shard_id, n_sentences = task
+    return _generator.shard(seed, shard_id, n_sentences)
+
+
+def generate(profile, n_sentences, output_file, seed=0, workers=1, shard_size=SHARD_SIZE):
+    """
+    Stream n_sentences synthetic sentences to output_file, generating the shards
+    in workers processes if workers > 1. The output only depends on the profile,
+    seed and shard_size.
+    """
+    tasks = (
+        (seed, shard_id, min(shard_size, n_sentences - start))
+        for shard_id, start in enumerate(range(0, n_sentences, shard_size))
+    )
+    with open(output_file, 'w', encoding='utf-8') as f:
+        if workers <= 1:
+            _init_worker(profile)
+            for text in map(_generate_shard, tasks):
+                f.write(text)
+        else:
+            with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(profile,)) as pool:
+                for text in pool.imap(_generate_shard, tasks):
+                    f.write(text)
+    return output_file
+
+
+def load_profile(path):
+    """
+    Load a profile saved as JSON, either written by fit_profile or the statistics
+    saved by scripts/entities_per_depth.py --json_dir.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        profile = json.load(f)
+    if "counts" in profile:
+        return profile_from_statistics(profile)
+    return profile
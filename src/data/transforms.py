@@ -0,0 +1,115 @@
+import os
+import tempfile
+
+# Streaming transforms for .labels files. A transform takes an iterator of lines
+# (without their newline) and yields lines, so they can be chained and applied in
+# a single pass, e.g.
+#   pipeline('output.labels', [strip_comments, drop_column(1), add_bos_eos(3)])
+
+BOS = '-BOS-'
+EOS = '-EOS-'
+
+
+def add_bos_eos_block(block, n_columns=None):
+    """
+    Add -BOS- and -EOS- rows to one .labels sentence (its rows joined by newlines)
+    unless it already has them. By default, the rows have as many columns as the
+    first row of the sentence.
+    """
+    if block.startswith(BOS):
+        return block
+    if n_columns is None:
+        n_columns = max(block.split('\n', 1)[0].count('\t') + 1, 2)
+    return (f'{BOS}\t'*(n_columns-1) + f'{BOS}\n' +
+            block + '\n' +
+            f'{EOS}\t'*(n_columns-1) + EOS)
+
+
+def blocks(lines):
+    """
+    Group lines into sentences (lists of non-blank lines).
+    """
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def strip_comments(lines):
+    """
+    Drop the comment lines (starting with '#').
+    """
+    return (line for line in lines if not line.startswith('#'))
+
+
+def drop_bos_eos(lines):
+    """
+    Drop the -BOS- and -EOS- rows.
+    """
+    return (line for line in lines if BOS not in line and EOS not in line)
+
+
+def drop_column(index):
+    """
+    Transform removing the column at index from every non-blank line.
+    """
+    def transform(lines):
+        for line in lines:
+            if line.strip():
+                columns = line.split('\t')
+                del columns[index]
+                line = '\t'.join(columns)
+            yield line
+    return transform
+
+
+def add_bos_eos(n_columns=None):
+    """
+    Transform adding -BOS- and -EOS- rows to the sentences that do not have them,
+    with n_columns columns (by default, those of the first row of every sentence).
+    Sentences are separated by exactly one blank line in the output.
+    """
+    def transform(lines):
+        for block in blocks(lines):
+            yield from add_bos_eos_block('\n'.join(block), n_columns).split('\n')
+            yield ''
+    return transform
+
+
+def apply(lines, transforms):
+    for transform in transforms:
+        lines = transform(lines)
+    return lines
+
+
+def write_atomic(lines, output_file):
+    """
+    Write lines to a temporary file next to output_file and rename it over
+    output_file, so that an interrupted write never leaves a truncated file.
+    """
+    directory = os.path.dirname(os.path.abspath(output_file))
+    tmp = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False,
+                                      prefix=f'.{os.path.basename(output_file)}.', suffix='.tmp')
+    try:
+        with tmp:
+            for line in lines:
+                tmp.write(line + '\n')
+        os.replace(tmp.name, output_file)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return output_file
+
+
+def pipeline(input_file, transforms, output_file=None):
+    """
+    Apply transforms to the lines of input_file in one streaming pass and write
+    the result atomically to output_file (input_file itself by default).
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        return write_atomic(apply((line.rstrip('\n') for line in f), transforms), output_file or input_file)
@@ -1,44 +1,26 @@
 import os
+import re
 import json
-import nltk
+import multiprocessing
+from collections import Counter
+from src.data import transforms
+from src.data.codelin import get_codelin
+from src.data.transforms import add_bos_eos_block
 
 
-def add_bos_eos(labels_file):
+def add_bos_eos(labels_file, n_columns=None):
     """
     Add -BOS- and -EOS- markers to the selected files to allow CoDeLin to decode
-    MaChAmp files that do not use these markers.
-    """
-    with open(labels_file, 'r') as f:
-        text = f.read()
-    sentences = text.split('\n\n')
-    n_columns = len(text.split('\n')[0].split('\t'))
-    if n_columns == 1:
-        n_columns = 2 # chapuza
-    print('n_columns:', n_columns)
-
-    sentences = [
-        '-BOS-\t'*(n_columns-1)+'-BOS-\n' +
-        sentence + '\n'+
-        '-EOS-\t'*(n_columns-1)+'-EOS-\n' 
-        for sentence in sentences if sentence != ''
-    ]
-
-    with open(labels_file, 'w') as f:
-        f.writelines('\n'.join(sentences) + '\n')
-    
-    return labels_file
+    MaChAmp files that do not use these markers. Sentences that already have them
+    are left as they are.
+    """
+    return transforms.pipeline(labels_file, [transforms.add_bos_eos(n_columns)])
 
 def remove_comments(file):
     """
     Remove the comments from the .labels files
     """
-    with open(file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    output_lines = [line for line in lines if not line.startswith('#')]
-
-    with open(file, 'w', encoding='utf-8') as f:
-        f.writelines(output_lines)
+    return transforms.pipeline(file, [transforms.strip_comments])
 
 def parse_input(input_text):
     sentences = input_text.strip().split('\n\n')
@@ -77,16 +59,7 @@ def remove_features(file):
     """
     Remove the second column of a 3-column .labels file
     """
-    with open(file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    with open(file, 'w', encoding='utf-8') as f:
-        for line in lines:
-            if line == '\n':
-                f.write('\n')
-                continue
-            line = line.split('\t')
-            line = [line[0], line[2]]
-            f.write("\t".join(line))
+    return transforms.pipeline(file, [transforms.drop_column(1)])
             
 def format_output(parsed_data):
     formatted_output = []
@@ -105,86 +78,45 @@ def format_output(parsed_data):
     return '\n\n'.join(formatted_output)
 
 def nner_to_tree(text_str, entities_str):
-    tokens = text_str.split()
-    entities = entities_str.split('|')
-    starts = []
-    ends = []
-
-    if len(entities) > 1:
-        types = [entity.split(" ")[1] for entity in entities]
-        for entity in entities:
-            start, end = [int(n) for n in entity.split(" ")[0].split(',')]
-            starts.append(start)
-            ends.append(end)
-    else:
-        entities = []
-
-    # Stack and output initialization
-    stack = []
-    output = ''
-
-    # Start with the ROOT
-    stack.append("ROOT")
-    output += f'({stack[-1]}'
-
-    # Processing tokens with stack
-    for i, token in enumerate(tokens):
-        # Handle opening new entities
-        while i in starts:
-            index = starts.index(i)
-            entity_type = types[index]
-            stack.append(entity_type)
-            output += f' ({stack[-1]}'
-            starts[index] = -1  # Mark this start as processed
-
-        # Add the current token to the output
-        output += f' {token}'
+    """
+    Build the parenthesized tree of a sentence from its text and entity annotation strings.
+    """
+    return build_tree(text_str, parse_entities(entities_str))
 
-        # Handle closing entities
-        while i in ends:
-            index = ends.index(i)
-            output += ')'
-            stack.pop()  # Close the last opened entity
-            ends[index] = -1  # Mark this end as processed
+def record_to_tree(record):
+    """
+    Build the parenthesized tree of a (tokens, entities) record as returned by read_data.
+    """
+    tokens, entities = record
+    text_str = ' '.join(tokens).replace('(', '-LB-').replace(')', '-RB-')
+    entities = sorted(((start, end, entity_type) for entity_type, start, end in entities),
+                      key=lambda x: (x[0], -x[1]))
+    return build_tree(text_str, entities)
 
-    # Finalize the output by closing the ROOT
-    output += ')'
+def build_trees(records, workers=1, chunksize=1000):
+    """
+    Yield the parenthesized tree of every (tokens, entities) record, in order.
+    With workers > 1 the trees are built in a process pool.
+    """
+    if workers <= 1:
+        yield from map(record_to_tree, records)
+        return
 
-    return output
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(record_to_tree, records, chunksize=chunksize)
 
-def to_parenthesized(input_file_path, output_file_path):
+def to_parenthesized(input_file_path, output_file_path, workers=1):
+    # Written atomically: the .trees file of a dataset is shared by the encodings,
+    # which may be prepared concurrently
     with open(input_file_path, 'r', encoding='utf-8') as file:
-        content = file.read().strip().replace('\n\n\n', '\n\n').split('\n\n')
-
-    trees = []
-
-    for example in content:
-        text_str = example.split('\n')[0].replace('(', '-LB-').replace(')', '-RB-')
-        entities_str = example.split('\n')[1] if len(example.split('\n')) > 1 else ''
-        
-        # Parse entities
-        entities = parse_entities(entities_str)
-
-        # Create tree with nesting handled
-        tree = build_tree(text_str, entities)
-        trees.append(tree)
-
-    with open(output_file_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(trees))
-
-    return output_file_path
+        return transforms.write_atomic(build_trees(read_data(file), workers), output_file_path)
 
 def parse_entities(entities_str):
     """
     Parse the entity string into a list of tuples (start, end, entity_type).
     Example input: '0,5 ORG|4,5 GPE|12,12 GPE|14,15 ORG|14,19 GPE|22,22 FAC|22,29 GPE'
     """
-    entities = []
-    for entity in entities_str.split('|'):
-        if entity:
-            span, entity_type = entity.split()
-            start, end = map(int, span.split(','))
-            entities.append((start, end, entity_type))
+    entities = [(start, end, entity_type) for entity_type, start, end in parse_annotation(entities_str)]
     
     # Sort by start, then end (longest entities come first if they overlap)
     entities.sort(key=lambda x: (x[0], -x[1]))
@@ -194,39 +126,44 @@ def parse_entities(entities_str):
 def build_tree(text_str, entities):
     """
     Build a nested tree string from the text and entities, handling nesting properly.
+    Entities are (start, end, entity_type) tuples sorted by start, then by -end,
+    and are consumed in a single left-to-right pass.
     """
     words = text_str.split()
     result = []
-    stack = []  # Each element is (end_index, entity_type)
+    next_entity = 0
+    open_by_end = Counter()  # number of open entities ending at each index
+    n_open = 0
+    n_stale = 0  # open entities that ended before the word they started at
 
     for i, word in enumerate(words):
         # Close any entities that have ended before the current word
-        indices_to_close = []
-        for idx in reversed(range(len(stack))):
-            if stack[idx][0] < i:
-                _, entity_type = stack.pop(idx)
-                result.append(")")
-        
+        if n_stale:
+            result.extend(')' * n_stale)
+            n_open -= n_stale
+            n_stale = 0
+
         # Open any new entities starting at current word
-        while entities and entities[0][0] == i:
-            start, end, entity_type = entities.pop(0)
+        while next_entity < len(entities) and entities[next_entity][0] == i:
+            _, end, entity_type = entities[next_entity]
+            next_entity += 1
             result.append(f"({entity_type}")
-            stack.append((end, entity_type))
+            n_open += 1
+            if end < i:
+                n_stale += 1
+            else:
+                open_by_end[end] += 1
 
         # Add the word
         result.append(word)
 
         # Close any entities that end at current word
-        indices_to_close = []
-        for idx in reversed(range(len(stack))):
-            if stack[idx][0] == i:
-                _, entity_type = stack.pop(idx)
-                result.append(")")
+        n_closed = open_by_end.pop(i, 0)
+        result.extend(')' * n_closed)
+        n_open -= n_closed
 
     # Close any remaining entities
-    while stack:
-        _, entity_type = stack.pop()
-        result.append(")")
+    result.extend(')' * n_open)
 
     return f"(ROOT {' '.join(result).replace(' )', ')')})"
 
@@ -235,49 +172,30 @@ def remove_bos_eos(input_file):
     """
     Remove the -BOS- and -EOS- rows from the .labels files
     """
-    with open(input_file, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-    with open(input_file, 'w', encoding='utf-8') as file:
-        for line in lines:
-            if '-BOS-' not in line and '-EOS-' not in line:
-                file.write(line)
+    return transforms.pipeline(input_file, [transforms.drop_bos_eos])
 
 
-def encode(encoding, trees_file, labels_file, multitask=True):
+def encode(encoding, trees_file, labels_file, multitask=True, workers=1, transforms=()):
     """
-    Encodes the input data into a .labels format using CoDeLin
+    Encodes the input data into a .labels format using CoDeLin, sharded
+    across workers processes if workers > 1, applying the given
+    src.data.transforms to the output in the same pass
     """
-    if multitask:
-        mt = '--multitask --n_label_cols 3'
-    else:
-        mt = ''
-    codelin_script = f'python CoDeLin/main.py CONST ENC {encoding} {trees_file} {labels_file}  \
-        --sep [_] --ujoiner [+] {mt} --b_marker [b] --ignore_postag' #separator not present in labels
-    
-    os.system(codelin_script)
-    
-    return labels_file
+    return get_codelin(encoding, multitask).encode_file(trees_file, labels_file, workers, transforms)
 
-def decode(encoding, labels_file, trees_file, multitask=True):
+def decode(encoding, labels_file, trees_file, multitask=True, workers=1):
     """
-    Decodes the input data into a .trees format using CoDeLin
+    Decodes the input data into a .trees format using CoDeLin, sharded
+    across workers processes if workers > 1
     """
-    if multitask:
-        mt = '--multitask --n_label_cols 3'
-    else:
-        mt = ''
-
-    decoding_script =  f'python CoDeLin/main.py CONST DEC {encoding} {labels_file} {trees_file} \
-        --sep [_] --ujoiner [+] --b_marker [b] {mt}'
-
-    os.system(decoding_script)
-
-    return trees_file
+    return get_codelin(encoding, multitask).decode_file(labels_file, trees_file, workers)
 
 def extract_entities_from_tree(tree):
     """
-    Given a tree, it extract the text and the entities
+    Given an nltk tree, it extract the text and the entities
     """
+    import nltk
+
     def traverse_tree(subtree, position):
         text = []
         entities = []
@@ -306,87 +224,165 @@ def extract_entities_from_tree(tree):
     text, entities = traverse_tree(tree, 0)
     return text, entities
 
-def extract_entities_from_str(entities_str):
+TREE_TOKEN = re.compile(r'\(\s*([^\s()]*)|\)|[^\s()]+')
+
+def parse_tree(tree_str):
     """
-    Given the entity annotation in string format, returns a list of dicts 
-    with label, start, and end of the entity.
+    Given a parenthesized tree string, it extracts the tokens and the
+    (start, end, type) entities in a single left-to-right scan. Entities are
+    returned in pre-order, as in extract_entities_from_tree; the top node and
+    nodes labelled ROOT are not entities.
     """
-    entities = set([
-        (
-            entity.split(' ')[1],
-            int(span.split(',')[0]),
-            int(span.split(',')[1])
-        )
-        for entity in entities_str.split('|')
-        for span in [entity.split(' ')[0]]
-    ])
-    
-    return entities
+    tokens = []
+    entities = []
+    stack = []  # index in entities of every open node, None if it is not an entity
+    finished = False
+
+    for match in TREE_TOKEN.finditer(tree_str):
+        token = match.group()
+        if finished:
+            raise ValueError(f"Unexpected {token!r} after the end of the tree: {tree_str!r}")
+
+        if token[0] == '(':
+            label = match.group(1)
+            if stack and label != 'ROOT':
+                stack.append(len(entities))
+                entities.append([len(tokens), None, label])
+            else:
+                stack.append(None)
+        elif token == ')':
+            if not stack:
+                raise ValueError(f"Unbalanced ')' in tree: {tree_str!r}")
+            index = stack.pop()
+            if index is not None:
+                entities[index][1] = len(tokens) - 1
+            finished = not stack
+        else:
+            if not stack:
+                raise ValueError(f"Token {token!r} outside of the tree: {tree_str!r}")
+            tokens.append(token)
 
+    if not finished:
+        raise ValueError(f"Incomplete tree: {tree_str!r}")
 
-def find_entities(file_path):
+    return tokens, [tuple(entity) for entity in entities]
+
+def parse_annotation(entities_str):
     """
-    Given a NNER data file, it returns a list of lists of tuples with
-    start, end and entity type for every sentence.
+    Given the entity annotation in string format ('0,5 ORG|4,5 GPE'), returns a
+    list of (type, start, end) tuples in the order they appear.
     """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.read().replace('\n\n\n', '\n\n').split('\n\n')
-
-    entities_str_list = [line.split('\n')[1] if len(line.split('\n')) == 2 else '' for line in lines]
-    entities_list = []
+    entities = []
+    for entity in entities_str.split('|'):
+        span, _, entity_type = entity.strip().partition(' ')
+        if not entity_type:
+            continue
+        start, _, end = span.partition(',')
+        entities.append((entity_type.split(' ')[0], int(start), int(end)))
+    return entities
 
-    for entities_str in entities_str_list:
-        if entities_str != '':
-            entities = extract_entities_from_str(entities_str)
-        else:
-            entities = set()
+def read_data(f):
+    """
+    Given an iterable of lines from a NNER data file, yields (tokens, entities)
+    for every sentence, one at a time. Every sentence is a line of tokens followed
+    by its annotation line (empty if it has no entities); blank lines between
+    sentences are skipped.
+    """
+    tokens = None
+    for line in f:
+        if tokens is None:
+            if line.strip():
+                tokens = line.split()
+            continue
+        yield tokens, parse_annotation(line)
+        tokens = None
 
-        entities_list.append(entities)
+    if tokens is not None:
+        yield tokens, []
 
-    return entities_list
+def extract_entities_from_str(entities_str):
+    """
+    Given the entity annotation in string format, returns a set of tuples
+    with label, start, and end of the entity.
+    """
+    return set(parse_annotation(entities_str))
 
-def data_to_jsonlines(data_file, jsonlines_file): # we repeat code to test fast.
-    data_list = []
-    
-    with open(data_file, 'r', encoding='utf-8') as f:
-        lines = f.read().replace('\n\n\n', '\n\n').split('\n\n')
 
-    for line in lines:
-        tokens = line.split('\n')[0].split()
-        entities_str = line.split('\n')[1] if len(line.split('\n')) == 2 else ''
-        if tokens == []:
+def nesting_depths(entities):
+    """
+    Given the (type, start, end) entities of a sentence, returns a dict with the
+    nesting depth of every entity: 1 for outermost entities, and one more than the
+    deepest entity enclosing it (start <= its start and end >= its end) otherwise.
+    Crossing spans do not enclose each other, but each keeps counting for the
+    spans both enclose: with A=(0,6), B=(1,6), C=(2,9) and D=(3,4), D has depth 3
+    (inside B, inside A). Identical spans with different types get the same depth.
+
+    Spans are visited sorted by (start, -end), so the spans enclosing a span are
+    the ones visited before it whose end is not smaller; the deepest of them is
+    found with a max Fenwick tree over the ends, so this runs in O(n log n).
+    """
+    ends = sorted({end for _, _, end in entities}, reverse=True)
+    rank = {end: i + 1 for i, end in enumerate(ends)}  # ends >= end have rank <= rank[end]
+    tree = [0] * (len(ends) + 1)
+    depths = {}
+    previous_span, previous_depth = None, 0
+
+    for entity in sorted(entities, key=lambda x: (x[1], -x[2], x[0])):
+        _, start, end = entity
+        if (start, end) == previous_span:
+            depths[entity] = previous_depth
             continue
 
-        data = {}
+        depth = 0
+        i = rank[end]
+        while i > 0:
+            depth = max(depth, tree[i])
+            i -= i & -i
+        depth += 1
+        i = rank[end]
+        while i < len(tree):
+            tree[i] = max(tree[i], depth)
+            i += i & -i
 
-        data["tokens"] = tokens
-        #data["doc_id"] = ""
-        #data["sent_id"] = ""
-        data["entity_mentions"] = []
+        depths[entity] = depth
+        previous_span, previous_depth = (start, end), depth
 
-        for entity in entities_str.split('|'):
-            if len(entity.split(' ')) == 1:
-                continue
+    return depths
 
-            span = entity.split(' ')[0] 
-            entity_type = entity.split(' ')[1]
-            start = int(span.split(',')[0])
-            end = int(span.split(',')[1])
-            text = ' '.join(tokens[start:end])
-            
-            data["entity_mentions"].append({
-                "entity_type": entity_type,
-                "start": start,
-                "end": end,
-                "text": text
-            })
-        
-        
-        data_list.append(data)
-    
-    with open(jsonlines_file, 'w', encoding='utf-8') as json_file:
-        for entry in data_list:
-            json_file.write(json.dumps(entry) + '\n')
+def find_entities(file_path):
+    """
+    Given a NNER data file (or a corpus compiled with src.data.binary), it
+    returns a list of sets of tuples with entity type, start and end for every
+    sentence.
+    """
+    # Imported here: src.data.binary depends on this module
+    from src.data import binary
+    if binary.is_binary(file_path):
+        return binary.BinaryCorpus(file_path).entity_sets()
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [set(entities) for _, entities in read_data(f)]
+
+def data_to_jsonlines(data_file, jsonlines_file):
+    with open(data_file, 'r', encoding='utf-8') as f, \
+            open(jsonlines_file, 'w', encoding='utf-8') as json_file:
+        for tokens, entities in read_data(f):
+            data = {}
+
+            data["tokens"] = tokens
+            #data["doc_id"] = ""
+            #data["sent_id"] = ""
+            data["entity_mentions"] = [
+                {
+                    "entity_type": entity_type,
+                    "start": start,
+                    "end": end,
+                    "text": ' '.join(tokens[start:end])
+                }
+                for entity_type, start, end in entities
+            ]
+
+            json_file.write(json.dumps(data) + '\n')
 
     return jsonlines_file
 
@@ -395,19 +391,16 @@ def trees_to_data(trees_file, output_file):
     """
     Given a .trees file, returns .data file 
     """
-    output_data = ''
-    with open(trees_file, 'r') as f:
-        trees = [nltk.Tree.fromstring(sentence) for sentence in f.readlines()]
-    
-    for tree in trees:
-        text, entities = extract_entities_from_tree(tree)
-        text = text.replace('-LB-', '(').replace('-RB-', ')')
-        entities = sorted(entities, key=lambda x: ((x[0], x[1])))
-        entity_annotations = [f"{start},{end} {etype}" for start, end, etype in entities]
-        annotations = "|".join(entity_annotations)
-        output_data += f"{text}\n{annotations}\n\n"
-
-    with open(output_file, 'w') as f:
-        f.write(output_data)
-
-    return output_file
+    def lines(f):
+        for line in f:
+            tokens, entities = parse_tree(line)
+            text = ' '.join(tokens).replace('-LB-', '(').replace('-RB-', ')')
+            entities.sort(key=lambda x: ((x[0], x[1])))
+            yield text
+            yield "|".join(f"{start},{end} {etype}" for start, end, etype in entities)
+            yield ''
+
+    # Written atomically, as output_file may be trees_file itself; a malformed tree
+    # leaves neither a partial output nor a temporary file
+    with open(trees_file, 'r', encoding='utf-8') as f:
+        return transforms.write_atomic(lines(f), output_file)
@@ -0,0 +1,236 @@
+import math
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from src.data.utils import nesting_depths
+from src.evaluation.store import counts_to_metrics
+
+SECTIONS = ("overall", "by_label", "by_depth", "by_length")
+BREAKDOWNS = ('depth', 'length', 'label')
+
+
+class CountAccumulator:
+    """
+    Entity counts for the overall metrics and the depth, length and label
+    breakdowns, updated one sentence at a time. Accumulators of different shards
+    of a corpus can be serialized with to_dict, and merged in any order.
+    """
+    def __init__(self, breakdowns: Iterable[str] = BREAKDOWNS,
+                 depth_fn: Callable[[Set], Dict] = nesting_depths):
+        self.breakdowns = set(breakdowns)
+        self.depth_fn = depth_fn
+        self.overall = Counter()
+        self.depths, self.lengths, self.labels = set(), set(), set()
+        self.by_depth = {"n_pred": Counter(), "n_gold": Counter(), "n_correct": Counter(), "n_correct_recall": Counter()}
+        self.by_length = {"n_pred": Counter(), "n_gold": Counter(), "n_correct": Counter()}
+        self.by_label = {"n_pred": Counter(), "n_gold": Counter(), "n_correct": Counter()}
+
+    def update(self, gold: Set, pred: Optional[Set]) -> None:
+        """
+        Add the (type, start, end) entities of one sentence. A gold sentence without
+        prediction (pred is None) only contributes its length and label buckets.
+        """
+        # As in the separate breakdowns, length and label buckets come from every gold sentence
+        self.lengths.update(e[2] - e[1] + 1 for e in gold)
+        self.labels.update(e[0] for e in gold)
+        if pred is None:
+            return
+
+        correct = gold.intersection(pred)
+        self.overall["n_pred"] += len(pred)
+        self.overall["n_gold"] += len(gold)
+        self.overall["n_correct"] += len(correct)
+
+        if 'depth' in self.breakdowns:
+            gold_depths = self.depth_fn(gold)
+            pred_depths = self.depth_fn(pred)
+            self.depths.update(gold_depths.values())
+            self.by_depth["n_gold"].update(gold_depths.values())
+            self.by_depth["n_pred"].update(pred_depths.values())
+            for e in correct:
+                self.by_depth["n_correct_recall"][gold_depths[e]] += 1
+                if gold_depths[e] == pred_depths[e]:
+                    self.by_depth["n_correct"][gold_depths[e]] += 1
+
+        # Length buckets count entities with end - start equal to the bucket
+        for name, entities in (("n_gold", gold), ("n_pred", pred), ("n_correct", correct)):
+            self.by_length[name].update(e[2] - e[1] for e in entities)
+            self.by_label[name].update(e[0] for e in entities)
+
+    def merge(self, other: 'CountAccumulator') -> 'CountAccumulator':
+        """
+        Add the counts of other into this accumulator and return it.
+        """
+        self.breakdowns |= other.breakdowns
+        self.overall.update(other.overall)
+        self.depths |= other.depths
+        self.lengths |= other.lengths
+        self.labels |= other.labels
+        for mine, theirs in ((self.by_depth, other.by_depth), (self.by_length, other.by_length),
+                             (self.by_label, other.by_label)):
+            for name, counts in theirs.items():
+                mine[name].update(counts)
+        return self
+
+    def results(self) -> Dict[str, Dict]:
+        """
+        Metrics in the format of Evaluator.evaluate_all.
+        """
+        results = {"overall": counts_to_metrics(
+            self.overall["n_pred"], self.overall["n_gold"], self.overall["n_correct"]
+        )}
+        if 'depth' in self.breakdowns:
+            results["by_depth"] = {}
+            for depth in sorted(self.depths):
+                counts = {name: self.by_depth[name][depth] for name in self.by_depth}
+                results["by_depth"][depth] = counts_to_metrics(
+                    counts["n_pred"], counts["n_gold"], counts["n_correct"], f1=False
+                )
+                results["by_depth"][depth]["recall"] = (
+                    0 if counts["n_gold"] == 0 else counts["n_correct_recall"] / counts["n_gold"]
+                )
+        if 'length' in self.breakdowns:
+            results["by_length"] = {
+                length: counts_to_metrics(*(self.by_length[name][length] for name in ("n_pred", "n_gold", "n_correct")))
+                for length in sorted(self.lengths)
+            }
+        if 'label' in self.breakdowns:
+            results["by_label"] = {
+                label: counts_to_metrics(*(self.by_label[name][label] for name in ("n_pred", "n_gold", "n_correct")))
+                for label in sorted(self.labels)
+            }
+        return results
+
+    def to_dict(self) -> Dict:
+        """
+        JSON-serializable state. Counters are stored as [key, count] pairs so that
+        integer buckets survive the round trip.
+        """
+        def pairs(counter):
+            return [[key, count] for key, count in counter.items()]
+
+        return {
+            "breakdowns": sorted(self.breakdowns),
+            "overall": dict(self.overall),
+            "depths": sorted(self.depths),
+            "lengths": sorted(self.lengths),
+            "labels": sorted(self.labels),
+            "by_depth": {name: pairs(counts) for name, counts in self.by_depth.items()},
+            "by_length": {name: pairs(counts) for name, counts in self.by_length.items()},
+            "by_label": {name: pairs(counts) for name, counts in self.by_label.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict, depth_fn: Callable[[Set], Dict] = nesting_depths) -> 'CountAccumulator':
+        accumulator = cls(state["breakdowns"], depth_fn)
+        accumulator.overall.update(state["overall"])
+        accumulator.depths.update(state["depths"])
+        accumulator.lengths.update(state["lengths"])
+        accumulator.labels.update(state["labels"])
+        for section in ("by_depth", "by_length", "by_label"):
+            for name, pairs in state[section].items():
+                getattr(accumulator, section)[name].update({key: count for key, count in pairs})
+        return accumulator
+
+
+class Moments:
+    """
+    Running count, mean and sum of squared deviations (Welford), mergeable with
+    the parallel formula of Chan et al.
+    """
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other: 'Moments') -> 'Moments':
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+            self.count = count
+        return self
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation"""
+        return 0.0 if self.count == 0 else math.sqrt(max(0.0, self.m2 / self.count))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, float]) -> 'Moments':
+        return cls(state["count"], state["mean"], state["m2"])
+
+
+class ResultsAccumulator:
+    """
+    Mean and standard deviation of every metric of a set of result dictionaries
+    (e.g. one per seed), as returned by Evaluator.evaluate_all.
+    """
+    def __init__(self):
+        self.moments = {
+            "overall": defaultdict(Moments),
+            "by_label": defaultdict(lambda: defaultdict(Moments)),
+            "by_depth": defaultdict(lambda: defaultdict(Moments)),
+            "by_length": defaultdict(lambda: defaultdict(Moments)),
+        }
+
+    def update(self, data: Dict) -> None:
+        for metric, value in data.get("overall", {}).items():
+            self.moments["overall"][metric].update(value)
+        for section in SECTIONS[1:]:
+            for bucket, metrics in data.get(section, {}).items():
+                for metric, value in metrics.items():
+                    self.moments[section][bucket][metric].update(value)
+
+    def merge(self, other: 'ResultsAccumulator') -> 'ResultsAccumulator':
+        for metric, moments in other.moments["overall"].items():
+            self.moments["overall"][metric].merge(moments)
+        for section in SECTIONS[1:]:
+            for bucket, metrics in other.moments[section].items():
+                for metric, moments in metrics.items():
+                    self.moments[section][bucket][metric].merge(moments)
+        return self
+
+    def results(self) -> Dict[str, Dict]:
+        def summary(moments):
+            return {"mean": moments.mean, "std": moments.std}
+
+        results = {"overall": {metric: summary(m) for metric, m in self.moments["overall"].items()}}
+        for section in SECTIONS[1:]:
+            results[section] = {
+                bucket: {metric: summary(m) for metric, m in metrics.items()}
+                for bucket, metrics in self.moments[section].items()
+            }
+        return results
+
+    def to_dict(self) -> Dict:
+        state = {"overall": {metric: m.to_dict() for metric, m in self.moments["overall"].items()}}
+        for section in SECTIONS[1:]:
+            state[section] = [
+                [bucket, {metric: m.to_dict() for metric, m in metrics.items()}]
+                for bucket, metrics in self.moments[section].items()
+            ]
+        return state
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'ResultsAccumulator':
+        accumulator = cls()
+        for metric, moments in state["overall"].items():
+            accumulator.moments["overall"][metric] = Moments.from_dict(moments)
+        for section in SECTIONS[1:]:
+            for bucket, metrics in state[section]:
+                for metric, moments in metrics.items():
+                    accumulator.moments[section][bucket][metric] = Moments.from_dict(moments)
+        return accumulator
@@ -1,7 +1,15 @@
 import os
 import subprocess
-from typing import Set, Optional, Dict, List
-from src.data.utils import find_entities
+from typing import Set, Optional, Dict, List, Iterable
+from src.data.utils import find_entities, nesting_depths
+from src.data.binary import BinaryCorpus, is_binary
+from src.evaluation import store, significance
+from src.evaluation.accumulators import CountAccumulator, BREAKDOWNS
+from src.evaluation.tracing import Tracer, span
+from src.machamp.predictor import PredictionClient, predict_sharded
+
+
+BACKENDS = ('python', 'columnar')
 
 
 class Evaluator:
@@ -9,13 +17,31 @@ class Evaluator:
                  encoder: Optional[str] = None,
                  dataset: Optional[str] = None,
                  encoding: Optional[str] = None,
-                 device: Optional[int] = None):
+                 device: Optional[int] = None,
+                 backend: str = 'python',
+                 server: Optional[str] = None,
+                 tracer: Optional[Tracer] = None,
+                 model_file: str = 'model.pt',
+                 predict_workers: int = 1,
+                 threads_per_worker: int = 1):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
         self.reset()
         # Model specific attributes
         self.encoder = encoder
         self.dataset = dataset
         self.encoding = encoding
         self.device = device
+        self.backend = backend
+        # URL of a running src.machamp.predictor.PredictionServer, used instead of machamp/predict.py
+        self.server = server
+        # Optional src.evaluation.tracing.Tracer recording the stages of evaluate_all
+        self.tracer = tracer
+        # Model file of every seed directory, e.g. model.int8.pt for the quantized export
+        self.model_file = model_file
+        # Sharded CPU prediction (src.machamp.predictor.predict_sharded) if predict_workers > 1
+        self.predict_workers = predict_workers
+        self.threads_per_worker = threads_per_worker
         
         if encoder and dataset:
             self.model_dirs = f'logs/machamp/{dataset}/{encoder}/{encoding}/'
@@ -26,7 +52,6 @@ class Evaluator:
         self.n_correct = 0
         self.n_gold = 0
         self.n_pred = 0
-        self.decoder_timing = 0
 
     def __call__(self, gold: Set, pred: Set) -> None:
         self.n_correct += len(gold.intersection(pred))
@@ -45,13 +70,27 @@ class Evaluator:
         return 0 if prec + rec == 0 else 2 * prec * rec / (prec + rec)
 
     def write(self, ostream, dataset_name: str) -> None:
+        decoder_timing = self.tracer.total_seconds('decode') if self.tracer else 0
         ostream.write(f"Eval on {dataset_name} with {getattr(self, 'algorithm', 'default')}:\t"
                      f"prec={100 * self.precision():.2f}\t"
                      f"rec={100 * self.recall():.2f}\t"
                      f"f1={100 * self.f1():.2f}\t"
-                     f"timing={self.decoder_timing}")
+                     f"timing={decoder_timing}")
+
+    def load_stores(self, gold_data: str, predicted_data: str, depths: bool = False):
+        """
+        Parse both files into columnar entity stores with a shared type vocabulary.
+        Compiled corpora (src.data.binary) are loaded from their arrays directly.
+        """
+        depth_fn = self.calculate_nesting_depth if depths else None
+        gold, pred = (BinaryCorpus(path) if is_binary(path) else find_entities(path)
+                      for path in (gold_data, predicted_data))
+        return store.load_stores(gold, pred, depth_fn)
 
     def calculate_metrics(self, gold_data: List, predicted_data: List) -> Dict[str, float]:        
+        if self.backend == 'columnar':
+            return store.metrics(*self.load_stores(gold_data, predicted_data))
+
         gold_entities = find_entities(gold_data)
         predicted_entities = find_entities(predicted_data)
         
@@ -72,6 +111,9 @@ class Evaluator:
         return results
     
     def calculate_metrics_by_length(self, gold_data, predicted_data):
+        if self.backend == 'columnar':
+            return store.metrics_by_length(*self.load_stores(gold_data, predicted_data))
+
         gold_entities = find_entities(gold_data)
         predicted_entities = find_entities(predicted_data)
         lengths = set()
@@ -100,6 +142,9 @@ class Evaluator:
         return results
 
     def calculate_metrics_by_depth(self, gold_data, predicted_data):
+        if self.backend == 'columnar':
+            return store.metrics_by_depth(*self.load_stores(gold_data, predicted_data, depths=True))
+
         gold_entities = find_entities(gold_data)
         predicted_entities = find_entities(predicted_data)
 
@@ -157,26 +202,13 @@ class Evaluator:
         return results
         
     def calculate_nesting_depth(self, entities):
-        """Sort entities by start position and then by end position (descending)"""
-        sorted_entities = sorted(entities, key=lambda x: (x[1], -x[2]))
-        depths = {}
-        
-        for entity in sorted_entities:
-            depth = 1
-
-            for other in sorted_entities:
-                if entity == other:
-                    continue
-                if other[1] <= entity[1] and entity[2] <= other[2]:
-                    if other in depths:
-                        depth = max(depth, depths[other] + 1)
-                    else:
-                        depth = max(depth, 2)
-
-            depths[entity] = depth
-        return depths
+        """Nesting depth of every entity of a sentence, see nesting_depths"""
+        return nesting_depths(entities)
     
     def calculate_metrics_by_label(self, gold_data: List, predicted_data: List) -> Dict[str, Dict[str, float]]:
+        if self.backend == 'columnar':
+            return store.metrics_by_label(*self.load_stores(gold_data, predicted_data))
+
         gold_entities = find_entities(gold_data)
         predicted_entities = find_entities(predicted_data)
 
@@ -205,17 +237,130 @@ class Evaluator:
 
         return results
 
-    def predict(self, seed: str) -> str:
+    def evaluate_all(self, gold_data: str, predicted_data: str,
+                     breakdowns: Iterable[str] = BREAKDOWNS) -> Dict[str, Dict]:
+        """
+        Compute the overall metrics and the requested breakdowns ('depth', 'length',
+        'label') parsing both files once and walking the sentences once. Returns the
+        same results as calculate_metrics and calculate_metrics_by_*, under the keys
+        'overall' and 'by_depth', 'by_length', 'by_label'.
+        """
+        breakdowns = set(breakdowns)
+        unknown = breakdowns.difference(BREAKDOWNS)
+        if unknown:
+            raise ValueError(f"Unknown breakdowns {sorted(unknown)}, expected some of {BREAKDOWNS}")
+
+        if self.backend == 'columnar':
+            with span(self.tracer, 'load_entities'):
+                gold, pred = self.load_stores(gold_data, predicted_data, depths='depth' in breakdowns)
+            with span(self.tracer, 'metrics/overall'):
+                results = {"overall": store.metrics(gold, pred)}
+            for breakdown, metrics in (('depth', store.metrics_by_depth), ('length', store.metrics_by_length),
+                                       ('label', store.metrics_by_label)):
+                if breakdown in breakdowns:
+                    with span(self.tracer, f'metrics/{breakdown}'):
+                        results[f"by_{breakdown}"] = metrics(gold, pred)
+            return results
+
+        with span(self.tracer, 'load_entities'):
+            gold_entities = find_entities(gold_data)
+            predicted_entities = find_entities(predicted_data)
+
+        # The Python backend computes every breakdown in the same pass
+        with span(self.tracer, 'metrics/all', breakdowns=sorted(breakdowns)):
+            accumulator = CountAccumulator(breakdowns, self.calculate_nesting_depth)
+            for i, gold in enumerate(gold_entities):
+                accumulator.update(gold, predicted_entities[i] if i < len(predicted_entities) else None)
+            return accumulator.results()
+
+    def _sentence_counts(self, stores, breakdowns: Iterable[str]):
+        """
+        Sentence-level count vectors of every prediction store against stores[0],
+        for the overall metrics and every breakdown ('label', 'depth').
+        """
+        gold, predictions = stores[0], stores[1:]
+        counts = {}
+        for breakdown in ['overall'] + [b for b in ('label', 'depth') if b in breakdowns]:
+            per_prediction = [significance.sentence_counts(gold, pred, breakdown) for pred in predictions]
+            counts[breakdown] = (per_prediction[0][0], [c for _, c in per_prediction])
+        return counts
+
+    @staticmethod
+    def _by_bucket(names, values: Dict[str, Dict]) -> Dict:
+        """Turn {metric: {stat: array}} into {bucket: {metric: {stat: float}}}"""
+        return {
+            name: {metric: {stat: float(array[i]) for stat, array in stats.items()} for metric, stats in values.items()}
+            for i, name in enumerate(names)
+        }
+
+    def bootstrap(self, gold_data: str, predicted_data: str, breakdowns: Iterable[str] = ('label', 'depth'),
+                  n_resamples: int = 10000, confidence: float = 0.95, seed: int = 0) -> Dict[str, Dict]:
+        """
+        Bootstrap confidence intervals (over sentences) of the precision, recall and
+        F1 of a prediction file, overall and by label and/or depth.
+        """
+        depth_fn = self.calculate_nesting_depth if 'depth' in breakdowns else None
+        stores = significance.build_stores(find_entities(gold_data), find_entities(predicted_data), depth_fn=depth_fn)
+
+        results = {}
+        for breakdown, (names, (counts,)) in self._sentence_counts(stores, breakdowns).items():
+            intervals = significance.bootstrap(counts, n_resamples, confidence, seed)
+            by_bucket = self._by_bucket(names, intervals)
+            results["overall" if breakdown == 'overall' else f"by_{breakdown}"] = (
+                by_bucket['overall'] if breakdown == 'overall' else by_bucket
+            )
+        return results
+
+    def paired_test(self, gold_data: str, predicted_a: str, predicted_b: str,
+                    breakdowns: Iterable[str] = ('label', 'depth'),
+                    n_resamples: int = 10000, seed: int = 0) -> Dict[str, Dict]:
+        """
+        Paired approximate randomization test between two prediction files of the
+        same gold data: difference (a - b) of precision, recall and F1 and its
+        p-value, overall and by label and/or depth.
+        """
+        depth_fn = self.calculate_nesting_depth if 'depth' in breakdowns else None
+        stores = significance.build_stores(
+            find_entities(gold_data), find_entities(predicted_a), find_entities(predicted_b), depth_fn=depth_fn
+        )
+
+        results = {}
+        for breakdown, (names, (counts_a, counts_b)) in self._sentence_counts(stores, breakdowns).items():
+            tests = significance.paired_randomization(counts_a, counts_b, n_resamples, seed)
+            by_bucket = self._by_bucket(names, tests)
+            results["overall" if breakdown == 'overall' else f"by_{breakdown}"] = (
+                by_bucket['overall'] if breakdown == 'overall' else by_bucket
+            )
+        return results
+
+    def predict(self, seed: str, model_file: Optional[str] = None, output_file: Optional[str] = None) -> str:
+        """
+        Tag the test set with the model of a seed (self.model_file unless model_file
+        is given) and return the predicted .labels file (output.labels in the seed
+        directory unless output_file is given).
+        """
         if not all([self.encoder, self.dataset, self.encoding]):
             raise ValueError("Model parameters not configured for prediction")
             
         model_dir = f"{self.model_dirs}seed_{seed}"
+        model_file = model_file or self.model_file
         input_file = f'data/{self.dataset}/{self.encoding}/test.labels'    
-        output_file = f'{model_dir}/output.labels'
+        output_file = output_file or f'{model_dir}/output.labels'
+
+        if self.server:
+            return PredictionClient(self.server).predict_file(
+                f'{model_dir}/{model_file}', input_file, output_file, self.dataset
+            )
+
+        if self.predict_workers > 1:
+            return predict_sharded(
+                f'{model_dir}/{model_file}', input_file, output_file, self.dataset,
+                self.predict_workers, self.threads_per_worker
+            )
         
         subprocess.run([
             'python', 'machamp/predict.py',
-            f'{model_dir}/model.pt', input_file, output_file,
+            f'{model_dir}/{model_file}', input_file, output_file,
             '--device', str(self.device),
             '--dataset', self.dataset
         ], check=True)
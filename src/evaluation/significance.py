@@ -0,0 +1,147 @@
+import numpy as np
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from src.evaluation.store import EntityStore
+
+# Columns of the sentence-level count vectors. Correct entities are counted twice
+# because, by depth, precision and recall do not use the same notion of correct.
+TP_PRECISION, TP_RECALL, N_PRED, N_GOLD = range(4)
+
+
+def build_stores(gold_entities: List[Set], *predicted_entities: List[Set],
+                 depth_fn: Optional[Callable[[Set], Dict]] = None) -> List[EntityStore]:
+    """
+    Build the gold store and one store per prediction with a shared type vocabulary,
+    keeping only the sentences present in all of them.
+    """
+    n = min(len(gold_entities), *(len(pred) for pred in predicted_entities))
+    types = {}
+    return [EntityStore.from_entities(entities[:n], types, depth_fn)
+            for entities in (gold_entities,) + predicted_entities]
+
+
+def sentence_counts(gold: EntityStore, pred: EntityStore, breakdown: str = 'overall') -> Tuple[List, np.ndarray]:
+    """
+    Per-sentence counts for every bucket of a breakdown ('overall', 'label' or
+    'depth'). Returns the bucket names (the ones present in the gold data) and
+    an array of shape (n_sentences, n_buckets, 4) with TP_PRECISION, TP_RECALL,
+    N_PRED and N_GOLD.
+    """
+    correct_recall = np.isin(gold.keys, pred.keys, assume_unique=True)
+    if breakdown == 'overall':
+        gold_buckets = np.zeros(len(gold), dtype=np.int64)
+        pred_buckets = np.zeros(len(pred), dtype=np.int64)
+        correct_precision = np.isin(pred.keys, gold.keys, assume_unique=True)
+        names, ids = ['overall'], [0]
+    elif breakdown == 'label':
+        gold_buckets, pred_buckets = gold.type_ids, pred.type_ids
+        correct_precision = np.isin(pred.keys, gold.keys, assume_unique=True)
+        type_names = gold.type_names()
+        ids = list(np.unique(gold.type_ids))
+        names = [type_names[t] for t in ids]
+    elif breakdown == 'depth':
+        if gold.depths is None or pred.depths is None:
+            raise ValueError("Both stores must be built with a depth_fn to count by depth")
+        gold_buckets, pred_buckets = gold.depths, pred.depths
+        index = np.minimum(np.searchsorted(gold.keys, pred.keys), max(len(gold) - 1, 0))
+        if len(gold):
+            correct_precision = (gold.keys[index] == pred.keys) & (gold.depths[index] == pred.depths)
+        else:
+            correct_precision = np.zeros(len(pred), dtype=bool)
+        ids = list(np.unique(gold.depths))
+        names = [int(d) for d in ids]
+    else:
+        raise ValueError(f"Unknown breakdown {breakdown}")
+
+    n_sentences = gold.n_sentences
+    n_buckets = int(max(gold_buckets.max(initial=0), pred_buckets.max(initial=0))) + 1
+    gold_sentences, pred_sentences = gold.sentence_ids(), pred.sentence_ids()
+
+    flat = np.concatenate([
+        (pred_sentences[correct_precision] * n_buckets + pred_buckets[correct_precision]) * 4 + TP_PRECISION,
+        (gold_sentences[correct_recall] * n_buckets + gold_buckets[correct_recall]) * 4 + TP_RECALL,
+        (pred_sentences * n_buckets + pred_buckets) * 4 + N_PRED,
+        (gold_sentences * n_buckets + gold_buckets) * 4 + N_GOLD,
+    ]).astype(np.int64)
+    counts = np.bincount(flat, minlength=n_sentences * n_buckets * 4).reshape(n_sentences, n_buckets, 4)
+    return names, counts[:, ids, :]
+
+
+def scores(sums: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Precision, recall and F1 from summed counts of shape (..., 4).
+    """
+    tp_precision, tp_recall, n_pred, n_gold = (sums[..., i].astype(np.float64) for i in range(4))
+    precision = np.divide(tp_precision, n_pred, out=np.zeros_like(tp_precision), where=n_pred > 0)
+    recall = np.divide(tp_recall, n_gold, out=np.zeros_like(tp_recall), where=n_gold > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall,
+                   out=np.zeros_like(precision), where=precision + recall > 0)
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def bootstrap(counts: np.ndarray, n_resamples: int = 10000, confidence: float = 0.95,
+              seed: int = 0, batch_size: int = 500) -> Dict[str, np.ndarray]:
+    """
+    Bootstrap confidence intervals over sentences. Every resample is a row of
+    sentence weights (the times each sentence was drawn), so its counts are one
+    matrix product with the (n_sentences, n_buckets * 4) count matrix. Returns,
+    for every metric, arrays of shape (n_buckets,) with the point estimate, and
+    lower and upper bounds.
+    """
+    rng = np.random.default_rng(seed)
+    n_sentences, n_buckets, _ = counts.shape
+    matrix = counts.reshape(n_sentences, -1).astype(np.float64)
+
+    samples = {metric: [] for metric in ("precision", "recall", "f1")}
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        # Sentence indices drawn with replacement, turned into per-sentence weights
+        indices = rng.integers(0, n_sentences, size=(size, n_sentences))
+        indices += np.arange(size)[:, None] * n_sentences
+        weights = np.bincount(indices.ravel(), minlength=size * n_sentences).reshape(size, n_sentences)
+        sums = (weights @ matrix).reshape(-1, n_buckets, 4)
+        for metric, values in scores(sums).items():
+            samples[metric].append(values)
+
+    alpha = (1 - confidence) / 2
+    point = scores(counts.sum(axis=0))
+    results = {}
+    for metric, values in samples.items():
+        values = np.concatenate(values)
+        results[metric] = {
+            "value": point[metric],
+            "low": np.quantile(values, alpha, axis=0),
+            "high": np.quantile(values, 1 - alpha, axis=0),
+        }
+    return results
+
+
+def paired_randomization(counts_a: np.ndarray, counts_b: np.ndarray, n_resamples: int = 10000,
+                         seed: int = 0, batch_size: int = 500) -> Dict[str, np.ndarray]:
+    """
+    Paired approximate randomization test between two systems on the same gold
+    data. Every resample swaps the predictions of a random half of the sentences,
+    which is one matrix product of a 0/1 swap matrix with the count differences.
+    Returns, for every metric, arrays of shape (n_buckets,) with the observed
+    difference (a - b) and its two-sided p-value.
+    """
+    rng = np.random.default_rng(seed)
+    n_sentences, n_buckets, _ = counts_a.shape
+    diff = (counts_b - counts_a).reshape(n_sentences, -1).astype(np.float64)
+    sums_a = counts_a.sum(axis=0).astype(np.float64)
+    sums_b = counts_b.sum(axis=0).astype(np.float64)
+
+    observed = {metric: scores(sums_a)[metric] - scores(sums_b)[metric] for metric in ("precision", "recall", "f1")}
+    extreme = {metric: np.zeros(n_buckets, dtype=np.int64) for metric in observed}
+    for start in range(0, n_resamples, batch_size):
+        swaps = rng.integers(0, 2, size=(min(batch_size, n_resamples - start), n_sentences)).astype(np.float64)
+        shift = (swaps @ diff).reshape(-1, n_buckets, 4)
+        scores_a, scores_b = scores(sums_a + shift), scores(sums_b - shift)
+        for metric in observed:
+            delta = scores_a[metric] - scores_b[metric]
+            extreme[metric] += (np.abs(delta) >= np.abs(observed[metric]) - 1e-12).sum(axis=0)
+
+    return {
+        metric: {"delta": observed[metric], "p_value": (extreme[metric] + 1) / (n_resamples + 1)}
+        for metric in observed
+    }
@@ -0,0 +1,237 @@
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+from src.data.binary import BinaryCorpus
+
+# Layout of a packed entity key: | sentence (29 bits) | start (12) | end (12) | type (10) |
+TYPE_BITS = 10
+POSITION_BITS = 12
+END_SHIFT = TYPE_BITS
+START_SHIFT = END_SHIFT + POSITION_BITS
+SENTENCE_SHIFT = START_SHIFT + POSITION_BITS
+MAX_TYPES = 1 << TYPE_BITS
+MAX_POSITION = 1 << POSITION_BITS
+MAX_SENTENCES = 1 << (63 - SENTENCE_SHIFT)
+
+
+class EntityStore:
+    """
+    Columnar representation of the entities of a whole corpus: sentence offsets,
+    start/end arrays, interned type ids and one packed int64 key per span. Within
+    a sentence entities are unique and sorted by key, so the keys of the whole
+    corpus are sorted as well.
+    """
+    def __init__(self, offsets: np.ndarray, keys: np.ndarray, types: Dict[str, int],
+                 depths: Optional[np.ndarray] = None):
+        self.offsets = offsets
+        self.keys = keys
+        self.types = types
+        self.starts = ((keys >> START_SHIFT) & (MAX_POSITION - 1)).astype(np.int32)
+        self.ends = ((keys >> END_SHIFT) & (MAX_POSITION - 1)).astype(np.int32)
+        self.type_ids = (keys & (MAX_TYPES - 1)).astype(np.int32)
+        self.depths = depths
+
+    @classmethod
+    def from_entities(cls, entities_list: Iterable[Set], types: Optional[Dict[str, int]] = None,
+                      depth_fn: Optional[Callable[[Set], Dict]] = None) -> 'EntityStore':
+        """
+        Build the store from a list of sets of (type, start, end) tuples, one set per
+        sentence. The type vocabulary is shared (and extended) when given, so that
+        gold and predicted stores use the same ids. If depth_fn is given, the nesting
+        depth of every entity is computed sentence by sentence and stored as well.
+        """
+        types = {} if types is None else types
+        counts = []
+        keys = []
+        depths = []
+        for sentence_id, entities in enumerate(entities_list):
+            counts.append(len(entities))
+            sentence_depths = depth_fn(entities) if depth_fn is not None else None
+            for entity in entities:
+                entity_type, start, end = entity
+                type_id = types.setdefault(entity_type, len(types))
+                keys.append((sentence_id, start, end, type_id))
+                if sentence_depths is not None:
+                    depths.append(sentence_depths[entity])
+
+        if len(counts) >= MAX_SENTENCES or len(types) > MAX_TYPES:
+            raise ValueError(f"Corpus too large to pack: {len(counts)} sentences, {len(types)} types")
+
+        columns = np.array(keys, dtype=np.int64).reshape(-1, 4)
+        if columns.size and (columns[:, 1:3].min() < 0 or columns[:, 1:3].max() >= MAX_POSITION):
+            raise ValueError(f"Entity positions must be in [0, {MAX_POSITION})")
+
+        packed = ((columns[:, 0] << SENTENCE_SHIFT) | (columns[:, 1] << START_SHIFT)
+                  | (columns[:, 2] << END_SHIFT) | columns[:, 3])
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        order = np.argsort(packed, kind='stable')
+        depths = np.array(depths, dtype=np.int32)[order] if depth_fn is not None else None
+        return cls(offsets, packed[order], types, depths)
+
+    @classmethod
+    def from_binary(cls, corpus: BinaryCorpus, types: Optional[Dict[str, int]] = None,
+                    depth_fn: Optional[Callable[[Set], Dict]] = None,
+                    n_sentences: Optional[int] = None) -> 'EntityStore':
+        """
+        Build the store of the first n_sentences sentences (all by default) of a
+        compiled corpus directly from its arrays, without going through Python sets
+        (except to compute depths, if depth_fn is given).
+        """
+        types = {} if types is None else types
+        n_sentences = len(corpus) if n_sentences is None else n_sentences
+        remap = np.array([types.setdefault(name, len(types)) for name in corpus.type_vocab], dtype=np.int64)
+        if n_sentences >= MAX_SENTENCES or len(types) > MAX_TYPES:
+            raise ValueError(f"Corpus too large to pack: {n_sentences} sentences, {len(types)} types")
+
+        offsets = np.array(corpus.entity_offsets[:n_sentences + 1], dtype=np.int64)
+        entities = np.asarray(corpus.entities[:offsets[-1]], dtype=np.int64).reshape(-1, 3)
+        if entities.size and entities[:, :2].max() >= MAX_POSITION:
+            raise ValueError(f"Entity positions must be in [0, {MAX_POSITION})")
+        sentences = np.repeat(np.arange(n_sentences, dtype=np.int64), np.diff(offsets))
+        type_ids = remap[entities[:, 2]] if entities.size else np.zeros(0, dtype=np.int64)
+        packed = ((sentences << SENTENCE_SHIFT) | (entities[:, 0] << START_SHIFT)
+                  | (entities[:, 1] << END_SHIFT) | type_ids)
+
+        depths = None
+        if depth_fn is not None:
+            depths = []
+            rows, bounds, names = entities.tolist(), offsets.tolist(), corpus.type_vocab
+            for i in range(n_sentences):
+                sentence = [(names[t], s, e) for s, e, t in rows[bounds[i]:bounds[i + 1]]]
+                sentence_depths = depth_fn(set(sentence))
+                depths.extend(sentence_depths[entity] for entity in sentence)
+            depths = np.array(depths, dtype=np.int32)
+
+        order = np.argsort(packed, kind='stable')
+        return cls(offsets - offsets[0], packed[order], types, depths[order] if depths is not None else None)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def n_sentences(self) -> int:
+        return len(self.offsets) - 1
+
+    def sentence_ids(self) -> np.ndarray:
+        return self.keys >> SENTENCE_SHIFT
+
+    def type_names(self) -> List[str]:
+        names = [None] * len(self.types)
+        for name, type_id in self.types.items():
+            names[type_id] = name
+        return names
+
+    def sentence(self, i: int) -> Set:
+        """
+        Return the entities of sentence i as a set of (type, start, end) tuples.
+        """
+        names = self.type_names()
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return {
+            (names[t], int(s), int(e))
+            for t, s, e in zip(self.type_ids[lo:hi], self.starts[lo:hi], self.ends[lo:hi])
+        }
+
+
+def load_stores(gold_entities: Union[List[Set], BinaryCorpus], predicted_entities: Union[List[Set], BinaryCorpus],
+                depth_fn: Optional[Callable[[Set], Dict]] = None):
+    """
+    Build gold and predicted stores with a shared type vocabulary, from lists of
+    entity sets or compiled corpora. As with zip(), only the sentences present in
+    both corpora are kept.
+    """
+    n = min(len(gold_entities), len(predicted_entities))
+    types = {}
+
+    def build(entities):
+        if isinstance(entities, BinaryCorpus):
+            return EntityStore.from_binary(entities, types, depth_fn, n)
+        return EntityStore.from_entities(entities[:n], types, depth_fn)
+
+    return build(gold_entities), build(predicted_entities)
+
+
+def counts_to_metrics(n_pred: int, n_gold: int, n_correct: int, f1: bool = True) -> Dict[str, float]:
+    precision = 0 if n_pred == 0 else n_correct / n_pred
+    recall = 0 if n_gold == 0 else n_correct / n_gold
+    results = {"precision": precision, "recall": recall}
+    if f1:
+        results["f1"] = 0 if precision + recall == 0 else 2 * precision * recall / (precision + recall)
+    results["n_pred"] = n_pred
+    results["n_gold"] = n_gold
+    results["n_correct"] = n_correct
+    results["fp"] = n_pred - n_correct
+    results["fn"] = n_gold - n_correct
+    return results
+
+
+def _bucket_counts(values: np.ndarray, minlength: int) -> np.ndarray:
+    return np.bincount(values, minlength=minlength) if len(values) else np.zeros(minlength, dtype=np.int64)
+
+
+def metrics(gold: EntityStore, pred: EntityStore) -> Dict[str, float]:
+    n_correct = len(np.intersect1d(gold.keys, pred.keys, assume_unique=True))
+    return counts_to_metrics(len(pred), len(gold), n_correct)
+
+
+def metrics_by_label(gold: EntityStore, pred: EntityStore) -> Dict[str, Dict[str, float]]:
+    n_types = len(gold.types)
+    correct = np.isin(pred.keys, gold.keys, assume_unique=True)
+    n_gold = _bucket_counts(gold.type_ids, n_types)
+    n_pred = _bucket_counts(pred.type_ids, n_types)
+    n_correct = _bucket_counts(pred.type_ids[correct], n_types)
+
+    names = gold.type_names()
+    return {
+        names[t]: counts_to_metrics(int(n_pred[t]), int(n_gold[t]), int(n_correct[t]))
+        for t in np.unique(gold.type_ids)
+    }
+
+
+def metrics_by_length(gold: EntityStore, pred: EntityStore) -> Dict[int, Dict[str, float]]:
+    # Same buckets as Evaluator.calculate_metrics_by_length: the bucket names are
+    # end - start + 1 of the gold entities, the entities counted in them have end - start == bucket.
+    gold_spans = gold.ends - gold.starts
+    pred_spans = pred.ends - pred.starts
+    lengths = np.unique(gold_spans + 1)
+    size = int(max(lengths.max(initial=0), gold_spans.max(initial=0), pred_spans.max(initial=0))) + 1
+
+    correct = np.isin(pred.keys, gold.keys, assume_unique=True)
+    n_gold = _bucket_counts(gold_spans, size)
+    n_pred = _bucket_counts(pred_spans, size)
+    n_correct = _bucket_counts(pred_spans[correct], size)
+
+    return {
+        int(length): counts_to_metrics(int(n_pred[length]), int(n_gold[length]), int(n_correct[length]))
+        for length in lengths
+    }
+
+
+def metrics_by_depth(gold: EntityStore, pred: EntityStore) -> Dict[int, Dict[str, float]]:
+    if gold.depths is None or pred.depths is None:
+        raise ValueError("Both stores must be built with a depth_fn to compute metrics by depth")
+    gold_depths = gold.depths
+    pred_depths = pred.depths
+    size = int(max(gold_depths.max(initial=0), pred_depths.max(initial=0))) + 1
+
+    # For precision an entity is correct if it is in the gold data at the same depth,
+    # for recall if it is predicted at any depth.
+    index = np.searchsorted(gold.keys, pred.keys)
+    index = np.minimum(index, max(len(gold) - 1, 0))
+    found = (gold.keys[index] == pred.keys) if len(gold) else np.zeros(len(pred), dtype=bool)
+    correct_precision = found & (gold_depths[index] == pred_depths) if len(gold) else found
+    correct_recall = np.isin(gold.keys, pred.keys, assume_unique=True)
+
+    n_gold = _bucket_counts(gold_depths, size)
+    n_pred = _bucket_counts(pred_depths, size)
+    n_correct_precision = _bucket_counts(pred_depths[correct_precision], size)
+    n_correct_recall = _bucket_counts(gold_depths[correct_recall], size)
+
+    results = {}
+    for depth in np.unique(gold_depths):
+        results[int(depth)] = counts_to_metrics(
+            int(n_pred[depth]), int(n_gold[depth]), int(n_correct_precision[depth]), f1=False
+        )
+        results[int(depth)]["recall"] = 0 if n_gold[depth] == 0 else int(n_correct_recall[depth]) / int(n_gold[depth])
+    return results
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+PAGE_SIZE = resource.getpagesize()
+
+
+def peak_rss_mb() -> float:
+    """
+    High-water mark of the resident set size of this process since it started, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 2 ** 20
+
+
+def hwm_rss_mb() -> Optional[float]:
+    """
+    High-water mark of the resident set size of this process since it started or
+    since the last reset_peak_rss (VmHWM), in MB, or None where /proc is not
+    available.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the high-water mark of the resident set size to the current RSS (Linux
+    only). Returns whether it was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# The high-water mark is per process: before a span resets it, its value so far
+# is folded into the peak of the spans still open, so nested spans keep theirs
+_open_peaks = []
+_peaks_lock = threading.Lock()
+
+
+def current_rss_mb() -> Optional[float]:
+    """
+    Current resident set size of this process in MB, or None where /proc is not
+    available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Tracer:
+    """
+    Collects timed spans (perf_counter_ns) and per-item latencies. Spans are kept
+    as Chrome trace events, so the spans of several processes can be merged and
+    opened in chrome://tracing or Perfetto. Each span also records the peak
+    resident set size of its process during the span (peak_rss_mb; the high-water
+    mark is reset when the span starts), the RSS when it ends (rss_mb) and its
+    change over the span (rss_delta_mb). Where the high-water mark cannot be reset
+    (no /proc), only the peak of the process since it started is recorded
+    (process_peak_rss_mb).
+    """
+    def __init__(self):
+        self.events = []
+        self.latencies = defaultdict(list)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        peak = [0.0]
+        with _peaks_lock:
+            hwm = hwm_rss_mb()
+            if hwm is not None:
+                for open_peak in _open_peaks:
+                    open_peak[0] = max(open_peak[0], hwm)
+            reset = hwm is not None and reset_peak_rss()
+            if reset:
+                _open_peaks.append(peak)
+        start_rss = current_rss_mb()
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            memory = {}
+            if reset:
+                with _peaks_lock:
+                    memory["peak_rss_mb"] = round(max(peak[0], hwm_rss_mb() or 0.0), 2)
+                    _open_peaks.remove(peak)
+            else:
+                memory["process_peak_rss_mb"] = round(peak_rss_mb(), 2)
+            end_rss = current_rss_mb()
+            if start_rss is not None and end_rss is not None:
+                memory["rss_mb"] = round(end_rss, 2)
+                memory["rss_delta_mb"] = round(end_rss - start_rss, 2)
+            self.events.append({
+                "name": name, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+                "pid": os.getpid(), "tid": threading.get_ident(),
+                "args": dict(args, **memory),
+            })
+
+    def trace(self, name: Optional[str] = None):
+        """
+        Decorator recording a span for every call of the decorated function.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_latencies(self, name: str, latencies_ns: Iterable[int]) -> None:
+        self.latencies[name].extend(latencies_ns)
+
+    def merge(self, other: 'Tracer') -> 'Tracer':
+        self.events.extend(other.events)
+        for name, values in other.latencies.items():
+            self.latencies[name].extend(values)
+        return self
+
+    def total_seconds(self, name: str) -> float:
+        return sum(event["dur"] for event in self.events if event["name"] == name) / 1e6
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Count, total and mean time of every stage, its peak RSS (the largest
+        peak_rss_mb of its spans, or the process high-water mark when it last ended
+        where the peak cannot be measured per span) and the largest RSS growth over
+        one of its spans, and the p50/p95/p99 of every latency series, in
+        milliseconds.
+        """
+        stages = defaultdict(lambda: {"count": 0, "total_s": 0.0})
+        for event in self.events:
+            stage = stages[event["name"]]
+            stage["count"] += 1
+            stage["total_s"] += event["dur"] / 1e6
+            for key in ("peak_rss_mb", "process_peak_rss_mb", "rss_delta_mb"):
+                if key in event["args"]:
+                    summary_key = "max_rss_delta_mb" if key == "rss_delta_mb" else key
+                    stage[summary_key] = max(stage.get(summary_key, float('-inf')), event["args"][key])
+        for stage in stages.values():
+            stage["mean_s"] = stage["total_s"] / stage["count"]
+
+        latencies = {}
+        for name, values in self.latencies.items():
+            if not values:
+                continue
+            values = np.asarray(values, dtype=np.float64) / 1e6
+            latencies[name] = {f"p{p}_ms": float(np.percentile(values, p)) for p in PERCENTILES}
+            latencies[name]["mean_ms"] = float(values.mean())
+            latencies[name]["count"] = len(values)
+        return {"stages": dict(stages), "latency": latencies}
+
+    def to_dict(self) -> Dict:
+        return {"events": self.events, "latencies": dict(self.latencies)}
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'Tracer':
+        tracer = cls()
+        tracer.events.extend(state["events"])
+        for name, values in state["latencies"].items():
+            tracer.latencies[name].extend(values)
+        return tracer
+
+    def write_chrome_trace(self, path: str) -> str:
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+def span(tracer: Optional[Tracer], name: str, **args):
+    """
+    tracer.span(name), or a no-op context if there is no tracer.
+    """
+    return tracer.span(name, **args) if tracer is not None else nullcontext()
@@ -0,0 +1,370 @@
+import os
+import re
+import json
+import random
+import tempfile
+import warnings
+
+import numpy as np
+
+# Checkpoints are written to <model_dir>/checkpoints/epoch_<N>.pt, where N is the
+# number of finished epochs, and hold the model, optimizer and learning rate
+# scheduler states, the number of epochs of the run and the python, numpy and
+# torch random generator states.
+CHECKPOINT_DIR = 'checkpoints'
+CHECKPOINT_PATTERN = re.compile(r'^epoch_(\d+)\.pt$')
+# The weights of the epoch with the best dev score so far, which the rotation
+# keeps, so that a resumed run can still end with them
+BEST_CHECKPOINT = 'best.pt'
+# Dev metrics MaChAmp writes to the model directory after every epoch
+METRICS_FILE = 'metrics_epoch_{epoch}.json'
+DEV_METRIC = 'dev_sum'
+
+
+def read_dev_score(model_dir, epoch, metric=DEV_METRIC):
+    """
+    Dev score of an epoch (numbered as in MaChAmp) from its metrics file, or None
+    if it is not there.
+    """
+    try:
+        with open(os.path.join(model_dir, METRICS_FILE.format(epoch=epoch)), 'r') as f:
+            return float(json.load(f)[metric])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_atomic(obj, output_file):
+    """
+    torch.save obj to a temporary file renamed over output_file, so that an
+    interrupted write never leaves a truncated file.
+    """
+    import torch
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(output_file), delete=False,
+                                      prefix=f'.{os.path.basename(output_file)}.', suffix='.tmp')
+    try:
+        with tmp:
+            torch.save(obj, tmp)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp.name, output_file)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return output_file
+
+
+def capture_rng():
+    import torch
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng(state):
+    import torch
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class CheckpointManager:
+    """
+    Per-epoch training checkpoints of a model directory. Checkpoints are written
+    atomically (to a temporary file renamed over the checkpoint), so a preempted
+    job never leaves a truncated one, and only the keep most recent are kept.
+    """
+    def __init__(self, model_dir, keep=2):
+        self.directory = os.path.join(model_dir, CHECKPOINT_DIR)
+        self.keep = keep
+
+    def path(self, epoch):
+        return os.path.join(self.directory, f'epoch_{epoch:03d}.pt')
+
+    def epochs(self):
+        """
+        Epochs with a checkpoint, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (CHECKPOINT_PATTERN.match(name) for name in os.listdir(self.directory))
+        return sorted((int(match.group(1)) for match in matches if match), reverse=True)
+
+    def save(self, epoch, model, optimizer=None, scheduler=None, num_epochs=None, best=None):
+        os.makedirs(self.directory, exist_ok=True)
+        state = {
+            'epoch': epoch,
+            'num_epochs': num_epochs,
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict() if optimizer is not None else None,
+            'scheduler': scheduler.state_dict() if scheduler is not None else None,
+            'rng': capture_rng(),
+            # Epoch and dev score of the best checkpoint so far
+            'best': best,
+        }
+        output_file = save_atomic(state, self.path(epoch))
+        self.rotate()
+        return output_file
+
+    def save_best(self, epoch, score, model):
+        os.makedirs(self.directory, exist_ok=True)
+        return save_atomic({'epoch': epoch, 'score': score, 'model': model.state_dict()},
+                           os.path.join(self.directory, BEST_CHECKPOINT))
+
+    def load_best(self):
+        """
+        The best checkpoint, or None if there is none or it cannot be loaded.
+        """
+        import torch
+        path = os.path.join(self.directory, BEST_CHECKPOINT)
+        if not os.path.exists(path):
+            return None
+        try:
+            return torch.load(path, map_location='cpu', weights_only=False)
+        except Exception as e:
+            warnings.warn(f"Cannot load the best checkpoint {path}: {e}")
+            return None
+
+    def rotate(self):
+        for epoch in self.epochs()[self.keep:]:
+            os.remove(self.path(epoch))
+
+    def latest(self):
+        """
+        The newest checkpoint that can be loaded, or None. Unreadable checkpoints
+        (e.g. written by an older, non-atomic version) are skipped.
+        """
+        import torch
+        for epoch in self.epochs():
+            try:
+                state = torch.load(self.path(epoch), map_location='cpu', weights_only=False)
+            except Exception as e:
+                warnings.warn(f"Skipping unreadable checkpoint {self.path(epoch)}: {e}")
+                continue
+            if isinstance(state, dict) and state.get('epoch') == epoch and 'model' in state:
+                return state
+        return None
+
+    def restore(self, state, model, optimizer=None, scheduler=None):
+        """
+        Load a checkpoint into the model, optimizer and scheduler and restore the
+        random generators. Returns the number of finished epochs.
+        """
+        model.load_state_dict(state['model'])
+        if optimizer is not None and state['optimizer'] is not None:
+            optimizer.load_state_dict(state['optimizer'])
+        if scheduler is not None and state['scheduler'] is not None:
+            scheduler.load_state_dict(state['scheduler'])
+        restore_rng(state['rng'])
+        return state['epoch']
+
+    def clear(self):
+        for epoch in self.epochs():
+            os.remove(self.path(epoch))
+        if os.path.exists(os.path.join(self.directory, BEST_CHECKPOINT)):
+            os.remove(os.path.join(self.directory, BEST_CHECKPOINT))
+        if os.path.isdir(self.directory) and not os.listdir(self.directory):
+            os.rmdir(self.directory)
+
+
+class EpochCheckpointing:
+    """
+    Checkpoint a training loop that is not ours (the MaChAmp trainer) at epoch
+    boundaries. The loop is observed through torch, patched by install() until
+    uninstall(): the optimizer is the first one created, the model is the module
+    whose parameters it optimizes, and a new epoch starts every time the model goes
+    back to training mode after the evaluation on the dev set. The learning rate
+    scheduler is the torch LRScheduler holding a reference to the optimizer, or
+    failing that (e.g. the AllenNLP-style schedulers of MaChAmp) any object holding
+    one with step, state_dict and load_state_dict methods.
+
+    A checkpoint without the scheduler state cannot be resumed exactly, so nothing
+    is checkpointed if no scheduler is found, and resuming without one is an error.
+
+    When training starts and a checkpoint exists, its state is restored before the
+    first epoch; the caller is responsible for running only the remaining epochs
+    (num_epochs - state['epoch']). The restored scheduler state must then span the
+    num_epochs of the whole run: this is checked when the scheduler exposes its
+    number of epochs, and a mismatch is reported with a warning.
+
+    The resumed trainer only chooses its best model among the remaining epochs.
+    With dev_score (the dev score of an epoch, numbered from 1 in every run of the
+    trainer, or None), the weights of the best epoch so far are kept in the
+    checkpoints, and keep_best puts them back in the final model if that epoch
+    came before the resume and no later one beat it.
+    """
+    def __init__(self, manager, state=None, num_epochs=None, dev_score=None):
+        if state is not None and state.get('scheduler') is None:
+            raise ValueError(f"The checkpoint of epoch {state['epoch']} has no scheduler state and cannot be resumed")
+        self.manager = manager
+        self.state = state
+        self.num_epochs = num_epochs
+        self.dev_score = dev_score
+        self.optimizer = None
+        self.scheduler = None
+        self.model = None
+        self.epoch = state['epoch'] if state is not None else 0
+        self.start_epoch = self.epoch
+        self.best = state.get('best') if state is not None else None
+        self.resumed_best = self.best
+        self.started = False
+        self.enabled = True
+        self._in_train = False
+        self._patched = None
+        self._warned_score = False
+
+    def install(self):
+        import torch
+        checkpointing = self
+        optimizer_init = torch.optim.Optimizer.__init__
+        module_train = torch.nn.Module.train
+
+        def init(optimizer, *args, **kwargs):
+            optimizer_init(optimizer, *args, **kwargs)
+            if checkpointing.optimizer is None:
+                checkpointing.optimizer = optimizer
+
+        def train(module, mode=True):
+            outer = not checkpointing._in_train
+            was_training = module.training
+            checkpointing._in_train = True
+            try:
+                result = module_train(module, mode)
+            finally:
+                if outer:
+                    checkpointing._in_train = False
+            if outer and mode:
+                checkpointing._on_train(module, was_training)
+            return result
+
+        self._patched = (torch, optimizer_init, module_train)
+        torch.optim.Optimizer.__init__ = init
+        torch.nn.Module.train = train
+
+    def uninstall(self):
+        if self._patched is not None:
+            torch, optimizer_init, module_train = self._patched
+            torch.optim.Optimizer.__init__ = optimizer_init
+            torch.nn.Module.train = module_train
+            self._patched = None
+
+    def check(self):
+        """
+        Called when training is over: fails if the checkpoint to resume from was
+        never restored (the model was trained from scratch on the remaining epochs
+        only), and warns if no checkpoint could be written.
+        """
+        if self.state is not None:
+            raise RuntimeError(f"The checkpoint of epoch {self.epoch} was not restored: no optimizer or model "
+                               f"was found in the training loop")
+        if self.model is None:
+            warnings.warn("No optimizer and model were found in the training loop: no checkpoints were written")
+
+    def _scheduler(self):
+        import gc
+        import torch
+        lr_scheduler = getattr(torch.optim, 'lr_scheduler', None)
+        base = getattr(lr_scheduler, 'LRScheduler', None) or getattr(lr_scheduler, '_LRScheduler', None)
+        candidates = []
+        for referrer in gc.get_referrers(self.optimizer):
+            # The scheduler refers to the optimizer directly or through its __dict__
+            objects = gc.get_referrers(referrer) if isinstance(referrer, dict) else [referrer]
+            for obj in objects:
+                if obj is not self and getattr(obj, 'optimizer', None) is self.optimizer:
+                    if base is not None and isinstance(obj, base):
+                        return obj
+                    if all(hasattr(obj, method) for method in ('step', 'state_dict', 'load_state_dict')):
+                        candidates.append(obj)
+        return candidates[0] if candidates else None
+
+    def _is_model(self, module):
+        if self.optimizer is None:
+            return False
+        optimized = {id(p) for group in self.optimizer.param_groups for p in group['params']}
+        return any(id(p) in optimized for p in module.parameters())
+
+    def _on_train(self, module, was_training):
+        if self.model is None:
+            if not self._is_model(module):
+                return
+            self.model = module
+        elif module is not self.model:
+            return
+
+        if not self.started:
+            # First epoch of this run: the scheduler exists by now
+            self.started = True
+            self.scheduler = self._scheduler()
+            if self.scheduler is None:
+                if self.state is not None:
+                    raise RuntimeError(f"Cannot resume from the checkpoint of epoch {self.epoch}: no learning rate "
+                                       f"scheduler was found to restore its state into")
+                warnings.warn("No learning rate scheduler was found for the optimizer: training will not be "
+                              "checkpointed, since it could not be resumed exactly")
+                self.enabled = False
+                return
+            if self.state is not None:
+                self.manager.restore(self.state, self.model, self.optimizer, self.scheduler)
+                self._check_horizon()
+                print(f"Resumed from the checkpoint of epoch {self.epoch}")
+                self.state = None
+            return
+        if was_training or not self.enabled:
+            # Not an epoch boundary (e.g. train() called again within an epoch)
+            return
+        self.epoch += 1
+        self._update_best()
+        self.manager.save(self.epoch, self.model, self.optimizer, self.scheduler, self.num_epochs, self.best)
+
+    def _score(self, epoch):
+        # The trainer numbers the epochs of every run from 1
+        score = self.dev_score(epoch - self.start_epoch) if self.dev_score is not None else None
+        if score is None and self.dev_score is not None and not self._warned_score:
+            warnings.warn(f"No dev score found for epoch {epoch}: the best epoch is not kept across resumes")
+            self._warned_score = True
+        return score
+
+    def _update_best(self):
+        score = self._score(self.epoch)
+        if score is not None and (self.best is None or score > self.best['score']):
+            # Written before the epoch checkpoint that refers to it
+            self.manager.save_best(self.epoch, score, self.model)
+            self.best = {'epoch': self.epoch, 'score': score}
+
+    def keep_best(self, model_file):
+        """
+        After a resumed run, replace the weights of model_file (chosen by the
+        trainer among the epochs after the resume) by those of the best epoch
+        before the resume if its dev score is higher than that of every later
+        epoch. Returns whether they were replaced.
+        """
+        if self.resumed_best is None or self.num_epochs is None or not os.path.exists(model_file):
+            return False
+        scores = [self._score(epoch) for epoch in range(self.start_epoch + 1, self.num_epochs + 1)]
+        if None in scores or max(scores, default=float('-inf')) >= self.resumed_best['score']:
+            return False
+        best = self.manager.load_best()
+        if best is None or best['epoch'] != self.resumed_best['epoch']:
+            warnings.warn(f"The weights of the best epoch {self.resumed_best['epoch']} are missing: "
+                          f"{model_file} keeps the best epoch after the resume")
+            return False
+        import torch
+        model = torch.load(model_file, map_location='cpu', weights_only=False)
+        model.load_state_dict(best['model'])
+        save_atomic(model, model_file)
+        print(f"Kept the weights of epoch {best['epoch']} (dev score {best['score']:.4f}), "
+              f"better than every epoch after the resume")
+        return True
+
+    def _check_horizon(self):
+        expected = self.state.get('num_epochs') or self.num_epochs
+        horizon = getattr(self.scheduler, 'num_epochs', None)
+        if expected is not None and horizon is not None and horizon != expected:
+            warnings.warn(f"The restored learning rate scheduler spans {horizon} epochs instead of the {expected} "
+                          f"of the interrupted run: the resumed run will not follow the same schedule")
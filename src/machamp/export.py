@@ -0,0 +1,97 @@
+import os
+import time
+import tempfile
+
+from src.data.codelin import read_label_blocks
+from src.machamp.predictor import ModelCache, _import_machamp
+
+QUANTIZED_MODEL = 'model.int8.pt'
+
+
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of the linear layers (transformer and decoders) of
+    a MaChAmp model, for CPU inference. Weights are stored in int8 and activations
+    are quantized on the fly, so no calibration data is needed.
+    """
+    torch, _ = _import_machamp()
+    model = model.to('cpu')
+    model.device = 'cpu'
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_quantized(model_dir, output_file=None):
+    """
+    Quantize model_dir/model.pt and save it next to it (model.int8.pt by default).
+    The exported model is loaded and used for prediction like model.pt.
+    """
+    torch, _ = _import_machamp()
+    model = torch.load(os.path.join(model_dir, 'model.pt'), map_location='cpu')
+    output_file = output_file or os.path.join(model_dir, QUANTIZED_MODEL)
+    torch.save(quantize_model(model), output_file)
+    return output_file
+
+
+def label_agreement(labels_a, labels_b):
+    """
+    Fraction of tokens with the same label in both .labels files, for every label
+    column (the first column, the word, is skipped).
+    """
+    agree, total = {}, 0
+    with open(labels_a, 'r', encoding='utf-8') as fa, open(labels_b, 'r', encoding='utf-8') as fb:
+        for block_a, block_b in zip(read_label_blocks(fa), read_label_blocks(fb)):
+            for row_a, row_b in zip(block_a.split('\n'), block_b.split('\n')):
+                columns_a, columns_b = row_a.split('\t'), row_b.split('\t')
+                total += 1
+                for column in range(1, min(len(columns_a), len(columns_b))):
+                    agree[column] = agree.get(column, 0) + (columns_a[column] == columns_b[column])
+    return {column: 0 if total == 0 else count / total for column, count in sorted(agree.items())}
+
+
+def compare_predictions(fp32_labels, int8_labels, fp32_seconds, int8_seconds, gold_data=None, encoding=None):
+    """
+    Compare the .labels files predicted by the fp32 and the quantized model:
+    prediction time, speedup, label agreement per column and, if gold_data and
+    encoding are given, the entity F1 of both models and its delta.
+    """
+    # Imported here to keep the export usable without the evaluation dependencies
+    from src.evaluation.evaluator import Evaluator
+    from src.tagger import labels_to_data
+
+    report = {
+        'fp32_seconds': fp32_seconds,
+        'int8_seconds': int8_seconds,
+        'speedup': fp32_seconds / int8_seconds if int8_seconds else 0.0,
+        'label_agreement': label_agreement(fp32_labels, int8_labels),
+    }
+    if gold_data and encoding:
+        evaluator = Evaluator(backend='columnar')
+        for name, labels_file in (('fp32', fp32_labels), ('int8', int8_labels)):
+            pred_data = labels_to_data(encoding, labels_file, labels_file.replace('.labels', '.data'))
+            report[f'{name}_metrics'] = evaluator.calculate_metrics(gold_data, pred_data)
+        report['f1_delta'] = report['int8_metrics']['f1'] - report['fp32_metrics']['f1']
+    return report
+
+
+def accuracy_report(model_dir, input_file, gold_data=None, encoding=None, dataset=None,
+                    batch_size=32, quantized_file=None):
+    """
+    Tag input_file with the fp32 and the quantized model on CPU and compare them
+    (see compare_predictions), with the size of both models.
+    """
+    quantized_file = quantized_file or os.path.join(model_dir, QUANTIZED_MODEL)
+    models = ModelCache('cpu', max_models=2, batch_size=batch_size)
+    outputs, seconds, sizes = {}, {}, {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, model_path in (('fp32', os.path.join(model_dir, 'model.pt')), ('int8', quantized_file)):
+            models.get(model_path)
+            outputs[name] = os.path.join(tmp_dir, f'{name}.labels')
+            start = time.perf_counter()
+            models.predict_file(model_path, input_file, outputs[name], dataset)
+            seconds[name] = time.perf_counter() - start
+            sizes[f'{name}_size_mb'] = os.path.getsize(model_path) / 2 ** 20
+        report = compare_predictions(outputs['fp32'], outputs['int8'], seconds['fp32'], seconds['int8'],
+                                     gold_data, encoding)
+    report.update(sizes)
+    return report
@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.data.transforms import write_atomic
+from src.machamp.scheduler import Scheduler, DONE, FAILED, prepare_job, train_job
+
+# Incremental build of the pipeline .data -> .labels -> model.pt -> results. Every
+# node is a scheduler job with the files it reads (inputs) and writes (outputs),
+# and the settings its outputs depend on (params). The manifest records, for every
+# node that finished, a key hashing its params and the content of its inputs, and the hashes of its outputs; a node is rebuilt
+# only if its key changed or one of its outputs changed or is missing. The key of
+# a node is computed once the nodes it depends on have finished, so a rebuilt node
+# that writes the same files as before does not rebuild the nodes after it.
+EVALUATE_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'scripts', 'evaluate.py'))
+SPLITS = ['test', 'dev', 'train']
+HASH_BLOCK = 1 << 20
+
+
+def prepare_node(dataset: str, encoding: str, workers: int = 1) -> Dict:
+    # The .trees files are shared by the encodings of a dataset and are not outputs
+    node = prepare_job(dataset, encoding, workers)
+    node["inputs"] = [f"data/{dataset}/{split}.data" for split in SPLITS]
+    node["outputs"] = [f"data/{dataset}/{encoding}/{split}.labels" for split in SPLITS]
+    # Not workers: the .labels files do not depend on the number of processes
+    node["params"] = {"stage": "prepare", "dataset": dataset, "encoding": encoding}
+    return node
+
+
+def train_node(dataset: str, encoder: str, encoding: str, seed: int, num_epochs: int = 30) -> Dict:
+    node = train_job(dataset, encoder, encoding, seed, num_epochs)
+    node["inputs"] = [f"data/{dataset}/{encoding}/{split}.labels" for split in ('train', 'dev')] + \
+                     ['parameter_configs/bert.json']
+    node["outputs"] = [node["output"]]
+    node["params"] = {"stage": "train", "dataset": dataset, "encoder": encoder, "encoding": encoding,
+                      "seed": seed, "num_epochs": num_epochs}
+    # Checkpoints of a run with other inputs must not be resumed
+    node["clean"] = [os.path.join(os.path.dirname(node["output"]), 'checkpoints')]
+    return node
+
+
+def evaluate_node(dataset: str, encoder: str, encoding: str, seeds: Iterable[int]) -> Dict:
+    encoder_name = encoder.split('/')[-1]
+    model_dirs = f"logs/machamp/{dataset}/{encoder_name}/{encoding}"
+    seeds = list(seeds)
+    return {
+        "id": f"evaluate/{dataset}/{encoder_name}/{encoding}",
+        "command": [sys.executable, EVALUATE_SCRIPT, '--dataset', dataset, '--encoder', encoder_name,
+                    '--encoding', encoding, '--seeds'] + [str(seed) for seed in seeds],
+        "depends": [f"train/{dataset}/{encoder_name}/{encoding}/seed_{seed}" for seed in seeds],
+        "inputs": [f"{model_dirs}/seed_{seed}/model.pt" for seed in seeds] +
+                  [f"data/{dataset}/{encoding}/test.labels", f"data/{dataset}/test.data"],
+        "outputs": [f"{model_dirs}/seed_{seed}/results.json" for seed in seeds] + [f"{model_dirs}/avg_results.json"],
+        "output": f"{model_dirs}/avg_results.json",
+        "uses_device": True,
+        "params": {"stage": "evaluate", "dataset": dataset, "encoder": encoder, "encoding": encoding,
+                   "seeds": seeds},
+    }
+
+
+def pipeline_nodes(datasets: Iterable[str], encoders: Iterable[str], encodings: Iterable[str],
+                   seeds: Iterable[int], num_epochs: int = 30, workers: int = 1) -> List[Dict]:
+    """
+    Prepare, train and evaluate nodes of every combination of dataset, encoder,
+    encoding and seed.
+    """
+    seeds = list(seeds)
+    nodes = []
+    for dataset in datasets:
+        for encoding in encodings:
+            nodes.append(prepare_node(dataset, encoding, workers))
+            for encoder in encoders:
+                nodes.extend(train_node(dataset, encoder, encoding, seed, num_epochs) for seed in seeds)
+                nodes.append(evaluate_node(dataset, encoder, encoding, seeds))
+    return nodes
+
+
+class Manifest:
+    """
+    Persistent record of the finished nodes and of the file hashes. Hashes are
+    cached by (size, mtime), so unchanged files are not read again.
+    """
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self.nodes, self.started, self.files = {}, {}, {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+            self.nodes, self.started, self.files = manifest["nodes"], manifest["started"], manifest["files"]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_file)), exist_ok=True)
+        manifest = {"nodes": self.nodes, "started": self.started, "files": self.files}
+        write_atomic([json.dumps(manifest, indent=2)], self.manifest_file)
+
+    def file_hash(self, path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                sha.update(block)
+        self.files[path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def key(self, node: Dict) -> str:
+        """
+        Hash of the params of a node and of the content of its inputs. Nodes
+        without params hash their command (without the interpreter) instead.
+        """
+        inputs = {path: self.file_hash(path) for path in node["inputs"]}
+        missing = [path for path, digest in inputs.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"Inputs of {node['id']} not found: {', '.join(missing)}")
+        params = node["params"] if "params" in node else node["command"][1:]
+        return hashlib.sha256(json.dumps([params, inputs], sort_keys=True).encode()).hexdigest()
+
+    def is_current(self, node: Dict) -> bool:
+        record = self.nodes.get(node["id"])
+        if record is None or record["key"] != self.key(node):
+            return False
+        return all(self.file_hash(path) == digest for path, digest in record["outputs"].items())
+
+    def record(self, node: Dict) -> None:
+        self.nodes[node["id"]] = {
+            "key": self.key(node),
+            "outputs": {path: self.file_hash(path) for path in node["outputs"]},
+        }
+        self.started.pop(node["id"], None)
+
+
+class Build:
+    """
+    Run the stale nodes of a pipeline with a Scheduler (independent nodes run in
+    parallel on the device slots) and record the finished ones in the manifest.
+
+    Whether a node is stale is decided when all its dependencies have finished, from
+    the inputs they actually produced (early cutoff): if a rebuilt node writes the
+    same files as before, the nodes that read them are not rebuilt. For example,
+    editing test.data rebuilds the .labels files and the evaluation, but not the
+    models, whose train and dev .labels files did not change.
+
+    The outputs of a stale node are removed before it runs, so that the scripts,
+    which skip existing outputs, rebuild them. A node interrupted in a previous
+    build with the same key is not cleaned, so that training resumes from its
+    checkpoints.
+    """
+    def __init__(self, nodes: List[Dict], manifest_file: str, devices: List[str], per_device: int = 1,
+                 retries: int = 1, poll_interval: float = 5.0, host_slots: int = 1):
+        self.nodes = {node["id"]: node for node in nodes}
+        self.manifest = Manifest(manifest_file)
+        self.queue_file = os.path.join(os.path.dirname(os.path.abspath(manifest_file)), 'build_queue.json')
+        self.devices, self.per_device = devices, per_device
+        self.retries, self.poll_interval = retries, poll_interval
+        self.host_slots = host_slots
+        self.dependents = {node_id: [] for node_id in self.nodes}
+        for node in nodes:
+            for dependency in node["depends"]:
+                if dependency in self.nodes:
+                    self.dependents[dependency].append(node["id"])
+        self.force = ()
+        self.status = {}
+        self.scheduler = None
+
+    def _order(self) -> List[Dict]:
+        order, visiting, visited = [], set(), set()
+
+        def visit(node_id):
+            if node_id in visited or node_id not in self.nodes:
+                return
+            if node_id in visiting:
+                raise ValueError(f"Dependency cycle through {node_id}")
+            visiting.add(node_id)
+            for dependency in self.nodes[node_id]["depends"]:
+                visit(dependency)
+            visiting.discard(node_id)
+            visited.add(node_id)
+            order.append(self.nodes[node_id])
+
+        for node_id in self.nodes:
+            visit(node_id)
+        return order
+
+    def _is_stale(self, node: Dict) -> bool:
+        if self.force and node["id"].startswith(self.force):
+            return True
+        return not self.manifest.is_current(node)
+
+    def stale(self, force: Iterable[str] = ()) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Nodes to rebuild given the files as they are now, and the nodes depending
+        on them, which are rebuilt only if their inputs change; both in dependency
+        order. Nodes whose id starts with one of the force prefixes are rebuilt in
+        any case.
+        """
+        self.force = tuple(force)
+        stale, downstream = [], []
+        waiting = set()
+        for node in self._order():
+            if any(dependency in waiting for dependency in node["depends"]):
+                downstream.append(node)
+            elif self._is_stale(node):
+                stale.append(node)
+            else:
+                continue
+            waiting.add(node["id"])
+        self.manifest.save()
+        return stale, downstream
+
+    def _clean(self, node: Dict) -> None:
+        key = self.manifest.key(node)
+        if self.manifest.started.get(node["id"]) == key:
+            return
+        for path in node["outputs"] + node.get("clean", []):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        self.manifest.started[node["id"]] = key
+
+    def _settle(self, node_id: str, status: str) -> None:
+        self.status[node_id] = status
+        for dependent in self.dependents[node_id]:
+            if dependent not in self.status and dependent not in self.scheduler.jobs:
+                self._visit(self.nodes[dependent])
+
+    def _visit(self, node: Dict) -> None:
+        """
+        Decide whether a node whose dependencies may all have finished is current,
+        and queue it otherwise.
+        """
+        statuses = [self.status.get(dependency) for dependency in node["depends"] if dependency in self.nodes]
+        if None in statuses:
+            return
+        if FAILED in statuses:
+            print(f"{node['id']}: not built (dependency failed)")
+            return self._settle(node["id"], FAILED)
+        try:
+            if not self._is_stale(node):
+                return self._settle(node["id"], 'current')
+            self._clean(node)
+        except FileNotFoundError as e:
+            print(f"{node['id']}: not built ({e})")
+            return self._settle(node["id"], FAILED)
+        self.manifest.save()
+        # The dependencies have finished already
+        self.scheduler.add([dict(node, depends=[])])
+        job = self.scheduler.jobs[node["id"]]
+        if job["status"] == DONE:
+            self._finished(job)
+
+    def _finished(self, job: Dict) -> None:
+        if job["status"] == DONE:
+            self.manifest.record(self.nodes[job["id"]])
+            self.manifest.save()
+        self._settle(job["id"], job["status"])
+
+    def run(self, force: Iterable[str] = (), dry_run: bool = False) -> Dict[str, int]:
+        """
+        Rebuild the stale nodes and return the number of nodes in every status
+        ('current' for the nodes that did not need to run). With dry_run, only
+        list the stale nodes and the nodes that may be rebuilt after them.
+        """
+        if dry_run:
+            stale, downstream = self.stale(force)
+            for node in stale:
+                print(f"stale: {node['id']}")
+            for node in downstream:
+                print(f"rebuilt if its inputs change: {node['id']}")
+            return {'current': len(self.nodes) - len(stale) - len(downstream), 'stale': len(stale),
+                    'downstream': len(downstream)}
+
+        self.force = tuple(force)
+        order = self._order()
+        self.status = {}
+        if os.path.exists(self.queue_file):
+            os.remove(self.queue_file)
+        self.scheduler = Scheduler(self.queue_file, self.devices, self.per_device, self.retries,
+                                   poll_interval=self.poll_interval, on_finish=self._finished,
+                                   host_slots=self.host_slots)
+        for node in order:
+            if node["id"] not in self.status and node["id"] not in self.scheduler.jobs:
+                self._visit(node)
+        try:
+            self.scheduler.run()
+        finally:
+            self.manifest.save()
+
+        counts = {}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
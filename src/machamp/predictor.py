@@ -0,0 +1,301 @@
+import os
+import sys
+import json
+import queue
+import tempfile
+import threading
+import multiprocessing
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.data.codelin import read_label_blocks
+from src.data.labels_index import LabelsReader, shard_bounds
+from src.data.transforms import write_atomic
+
+
+MACHAMP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'machamp'))
+
+# Raw sentences are written as word, one unused column and the ci/ni/ui task columns
+N_COLUMNS = 5
+EMPTY_LABEL = '_'
+
+
+def _import_machamp():
+    """
+    Make the MaChAmp submodule importable and return torch and its prediction function.
+    """
+    if MACHAMP_DIR not in sys.path:
+        sys.path.insert(0, MACHAMP_DIR)
+
+    import torch
+    from machamp.predictor.predict import predict_with_paths
+    return torch, predict_with_paths
+
+
+def write_sentences(sentences, labels_file):
+    """
+    Write lists of tokens as a .labels file MaChAmp can tag.
+    """
+    with open(labels_file, 'w', encoding='utf-8') as f:
+        for tokens in sentences:
+            for token in tokens:
+                f.write('\t'.join([token] + [EMPTY_LABEL] * (N_COLUMNS - 1)) + '\n')
+            f.write('\n')
+    return labels_file
+
+
+class ModelCache:
+    """
+    LRU cache of loaded MaChAmp models, so each model.pt is deserialized once.
+    """
+    def __init__(self, device='cpu', max_models=2, batch_size=32):
+        self.torch, self.predict_with_paths = _import_machamp()
+        self.device = device
+        self.max_models = max_models
+        self.batch_size = batch_size
+        self.models = OrderedDict()
+
+    def get(self, model_path):
+        model_path = os.path.abspath(model_path)
+        if model_path in self.models:
+            self.models.move_to_end(model_path)
+        else:
+            model = self.torch.load(model_path, map_location=self.device)
+            model.device = self.device
+            model.eval()
+            self.models[model_path] = model
+            while len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+        return self.models[model_path]
+
+    def predict_file(self, model_path, input_file, output_file, dataset=None):
+        model = self.get(model_path)
+        with self.torch.no_grad():
+            self.predict_with_paths(model, input_file, output_file, dataset, self.batch_size,
+                                    False, self.device, '===', None)
+        return output_file
+
+    def predict_sentences(self, model_path, sentences, dataset=None):
+        """
+        Tag lists of tokens and return the predicted .labels block of every sentence.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = write_sentences(sentences, os.path.join(tmp_dir, 'input.labels'))
+            output_file = self.predict_file(model_path, input_file, os.path.join(tmp_dir, 'output.labels'), dataset)
+            with open(output_file, 'r', encoding='utf-8') as f:
+                return list(read_label_blocks(f))
+
+
+_shard_models = None
+
+
+def _init_shard_worker(device, batch_size, threads, cores):
+    """
+    Pin the thread count (and the CPU cores, where supported) of a prediction
+    worker before torch is imported, and create its model cache.
+    """
+    global _shard_models
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    _shard_models = ModelCache(device, max_models=1, batch_size=batch_size)
+    _shard_models.torch.set_num_threads(threads)
+
+
+def _predict_shard(task):
+    model_path, input_file, output_file, dataset = task
+    return _shard_models.predict_file(model_path, input_file, output_file, dataset)
+
+
+def _worker_cores(workers, threads_per_worker):
+    """
+    Disjoint sets of threads_per_worker cores for every worker, or None for all of
+    them if CPU affinity is not supported or there are not enough cores.
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * workers
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < workers * threads_per_worker:
+        return [None] * workers
+    return [set(cores[i * threads_per_worker:(i + 1) * threads_per_worker]) for i in range(workers)]
+
+
+def predict_sharded(model_path, input_file, output_file, dataset=None, workers=2, threads_per_worker=1,
+                    batch_size=32):
+    """
+    Tag a .labels file on CPU with workers processes of threads_per_worker torch
+    threads each. The input is split into contiguous shards at sentence boundaries
+    (through the .labels index), every worker loads the model once and tags its
+    shard, and the outputs are stitched back in input order into output_file.
+    """
+    reader = LabelsReader(input_file)
+    bounds = [(start, end) for start, end in shard_bounds(len(reader), workers) if end > start]
+    # One process per shard, each with its own cores: spawned, so that the thread
+    # settings are in place before torch is imported
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tasks = []
+        for shard_id, (start, end) in enumerate(bounds):
+            shard_input = os.path.join(tmp_dir, f'input_{shard_id}.labels')
+            write_atomic((line for block in reader.blocks(start, end) for line in (block, '')), shard_input)
+            tasks.append((os.path.abspath(model_path), shard_input,
+                          os.path.join(tmp_dir, f'output_{shard_id}.labels'), dataset))
+
+        pools = [
+            context.Pool(1, initializer=_init_shard_worker, initargs=('cpu', batch_size, threads_per_worker, cores))
+            for cores in _worker_cores(len(tasks), threads_per_worker)
+        ]
+        try:
+            results = [pool.apply_async(_predict_shard, (task,)) for pool, task in zip(pools, tasks)]
+            shard_outputs = [result.get() for result in results]
+        finally:
+            for pool in pools:
+                pool.terminate()
+
+        def lines():
+            for shard_output in shard_outputs:
+                with open(shard_output, 'r', encoding='utf-8') as f:
+                    for block in read_label_blocks(f):
+                        yield block
+                        yield ''
+
+        return write_atomic(lines(), output_file)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """
+    Long-lived prediction worker serving requests over HTTP on localhost.
+
+    POST /predict with a JSON body {"model": path, "dataset": name} and either
+    "sentences" (lists of tokens) or "input"/"output" (.labels paths). Sentence
+    requests arriving within batch_window seconds for the same model are tagged
+    together in one MaChAmp call. GET /health lists the loaded models.
+    """
+    def __init__(self, port=8765, host='127.0.0.1', device='cpu', max_models=2,
+                 batch_window=0.01, max_batch_sentences=256):
+        super().__init__((host, port), PredictionHandler)
+        self.models = ModelCache(device, max_models)
+        self.batch_window = batch_window
+        self.max_batch_sentences = max_batch_sentences
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._serve_predictions, daemon=True)
+        self.worker.start()
+
+    def submit(self, request):
+        future = Future()
+        self.requests.put((request, future))
+        return future.result()
+
+    def _next_batch(self):
+        """
+        Block for one request, then collect the sentence requests for the same
+        model and dataset that arrive within the batching window.
+        """
+        first = self.requests.get()
+        batch = [first]
+        request = first[0]
+        if 'sentences' not in request:
+            return batch
+
+        n_sentences = len(request['sentences'])
+        deferred = []
+        while n_sentences < self.max_batch_sentences:
+            try:
+                item = self.requests.get(timeout=self.batch_window)
+            except queue.Empty:
+                break
+            other = item[0]
+            if 'sentences' in other and (other['model'], other.get('dataset')) == (request['model'], request.get('dataset')):
+                batch.append(item)
+                n_sentences += len(other['sentences'])
+            else:
+                deferred.append(item)
+        for item in deferred:
+            self.requests.put(item)
+        return batch
+
+    def _serve_predictions(self):
+        # Models are only used from this thread, one MaChAmp call at a time
+        while True:
+            batch = self._next_batch()
+            request = batch[0][0]
+            try:
+                if 'sentences' in request:
+                    sentences = [tokens for item, _ in batch for tokens in item['sentences']]
+                    blocks = self.models.predict_sentences(request['model'], sentences, request.get('dataset'))
+                    for item, future in batch:
+                        n = len(item['sentences'])
+                        future.set_result({"labels": blocks[:n]})
+                        blocks = blocks[n:]
+                else:
+                    output = self.models.predict_file(request['model'], request['input'], request['output'],
+                                                      request.get('dataset'))
+                    batch[0][1].set_result({"output": output})
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        self._reply(200, {"models": list(self.server.models.models)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if 'model' not in request or not ('sentences' in request or 'input' in request and 'output' in request):
+                return self._reply(400, {"error": "Expected 'model' and either 'sentences' or 'input' and 'output'"})
+            self._reply(200, self.server.submit(request))
+        except Exception as e:
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+
+class PredictionClient:
+    """
+    Client for a running PredictionServer.
+    """
+    def __init__(self, url='http://127.0.0.1:8765'):
+        self.url = url.rstrip('/')
+
+    def _post(self, body):
+        request = urllib.request.Request(
+            f'{self.url}/predict', data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Prediction server error: {json.loads(e.read()).get('error')}") from e
+
+    def predict_sentences(self, model_path, sentences, dataset=None):
+        """
+        Tag lists of tokens and return the predicted .labels block of every sentence.
+        """
+        body = {"model": os.path.abspath(model_path), "dataset": dataset, "sentences": sentences}
+        return self._post(body)["labels"]
+
+    def predict_file(self, model_path, input_file, output_file, dataset=None):
+        body = {
+            "model": os.path.abspath(model_path), "dataset": dataset,
+            "input": os.path.abspath(input_file), "output": os.path.abspath(output_file)
+        }
+        self._post(body)
+        return output_file
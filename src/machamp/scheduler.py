@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from typing import Callable, Dict, Iterable, List, Optional
+
+from src.data.transforms import write_atomic
+
+TRAIN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'scripts', 'train.py'))
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def prepare_job(dataset: str, encoding: str, workers: int = 1) -> Dict:
+    """
+    Job creating the .trees and .labels files of a (dataset, encoding).
+    """
+    return {
+        "id": f"prepare/{dataset}/{encoding}",
+        "command": [sys.executable, TRAIN_SCRIPT, '--dataset', dataset, '--encoding', encoding,
+                    '--workers', str(workers), '--prepare_only'],
+        "depends": [],
+        "output": f"data/{dataset}/{encoding}/train.labels",
+        "uses_device": False,
+    }
+
+
+def train_job(dataset: str, encoder: str, encoding: str, seed: int, num_epochs: int = 30) -> Dict:
+    """
+    Job training one seed of a (dataset, encoder, encoding).
+    """
+    encoder_name = encoder.split('/')[-1]
+    return {
+        "id": f"train/{dataset}/{encoder_name}/{encoding}/seed_{seed}",
+        "command": [sys.executable, TRAIN_SCRIPT, '--dataset', dataset, '--encoder', encoder, '--encoding', encoding,
+                    '--seeds', str(seed), '--num_epochs', str(num_epochs)],
+        "depends": [f"prepare/{dataset}/{encoding}"],
+        "output": f"logs/machamp/{dataset}/{encoder_name}/{encoding}/seed_{seed}/model.pt",
+        "uses_device": True,
+    }
+
+
+def grid_jobs(datasets: Iterable[str], encoders: Iterable[str], encodings: Iterable[str],
+              seeds: Iterable[int], num_epochs: int = 30, workers: int = 1) -> List[Dict]:
+    """
+    Prepare and train jobs of every combination of dataset, encoder, encoding and seed.
+    """
+    jobs = []
+    for dataset in datasets:
+        for encoding in encodings:
+            jobs.append(prepare_job(dataset, encoding, workers))
+            for encoder in encoders:
+                for seed in seeds:
+                    jobs.append(train_job(dataset, encoder, encoding, seed, num_epochs))
+    return jobs
+
+
+class Scheduler:
+    """
+    Persistent job queue run on a set of device slots. Jobs are dictionaries with
+    an id, a command, the ids of the jobs they depend on and the output file that
+    shows they are finished. The queue is saved (atomically) to queue_file after
+    every change, so an interrupted scheduler can be restarted: finished jobs are
+    skipped, and jobs that were running are queued again.
+
+    devices is a list of device ids (e.g. ['0', '1'] or ['cpu']); every device
+    runs at most per_device jobs at a time. Jobs that do not use a device (e.g.
+    data preparation) run on the host, at most host_slots at a time. Jobs that
+    exit with an error or do not
+    produce their output are retried up to retries times. on_finish, if given, is
+    called with every job that is done or has failed for good, and may add jobs.
+    """
+    def __init__(self, queue_file: str, devices: List[str], per_device: int = 1, retries: int = 1,
+                 log_dir: Optional[str] = None, poll_interval: float = 5.0,
+                 on_finish: Optional[Callable[[Dict], None]] = None, host_slots: int = 1):
+        if not devices:
+            raise ValueError("At least one device is needed")
+        if host_slots < 1:
+            raise ValueError("At least one host slot is needed")
+        self.queue_file = queue_file
+        self.slots = [device for device in devices for _ in range(per_device)]
+        self.host_slots = host_slots
+        self.retries = retries
+        self.log_dir = log_dir or os.path.join(os.path.dirname(os.path.abspath(queue_file)), 'jobs')
+        self.poll_interval = poll_interval
+        self.on_finish = on_finish
+        self.jobs = {}
+        if os.path.exists(queue_file):
+            with open(queue_file, 'r') as f:
+                for job in json.load(f)["jobs"]:
+                    # Running jobs of a previous scheduler did not finish, and
+                    # finished jobs whose output was removed have to run again
+                    if job["status"] == RUNNING or job["status"] == DONE and not os.path.exists(job["output"]):
+                        job["status"] = PENDING
+                    self.jobs[job["id"]] = job
+        self.running = {}  # job id -> (process, slot index, log file)
+
+    def add(self, jobs: Iterable[Dict]) -> None:
+        """
+        Add jobs that are not in the queue yet. Jobs whose output already exists are
+        marked as done without running them.
+        """
+        for job in jobs:
+            if job["id"] in self.jobs:
+                continue
+            job = dict(job, status=PENDING, attempts=0, returncode=None, device=None)
+            if os.path.exists(job["output"]):
+                job["status"] = DONE
+            self.jobs[job["id"]] = job
+        self.save()
+
+    def reset_failed(self) -> None:
+        """
+        Queue the failed jobs again, with a new retry budget.
+        """
+        for job in self.jobs.values():
+            if job["status"] == FAILED:
+                job["status"], job["attempts"] = PENDING, 0
+        self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.queue_file)), exist_ok=True)
+        write_atomic([json.dumps({"jobs": list(self.jobs.values())}, indent=2)], self.queue_file)
+
+    def _log(self, job: Dict, message: str) -> None:
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {job['id']}: {message}", flush=True)
+
+    def _runnable(self) -> List[Dict]:
+        jobs = []
+        for job in self.jobs.values():
+            if job["status"] != PENDING or job["id"] in self.running:
+                continue
+            depends = [self.jobs.get(d) for d in job["depends"]]
+            if any(d is not None and d["status"] == FAILED for d in depends):
+                job["status"] = FAILED
+                self._log(job, "failed (dependency failed)")
+            elif all(d is None or d["status"] == DONE for d in depends):
+                jobs.append(job)
+        return jobs
+
+    def _launch(self, job: Dict, slot: Optional[int]) -> None:
+        device = self.slots[slot] if slot is not None else None
+        command = list(job["command"])
+        if job["uses_device"]:
+            command += ['--device', '-1' if device == 'cpu' else str(device)]
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_file = os.path.join(self.log_dir, job["id"].replace('/', '__') + '.log')
+        log = open(log_file, 'a')
+        job["status"], job["device"] = RUNNING, device
+        job["attempts"] += 1
+        job["log"] = log_file
+        self.running[job["id"]] = (subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), slot, log)
+        self._log(job, f"started on {device or 'host'} (attempt {job['attempts']}), log in {log_file}")
+
+    def _reap(self) -> None:
+        for job_id, (process, slot, log) in list(self.running.items()):
+            returncode = process.poll()
+            if returncode is None:
+                continue
+            log.close()
+            del self.running[job_id]
+            job = self.jobs[job_id]
+            job["returncode"] = returncode
+            if returncode == 0 and os.path.exists(job["output"]):
+                job["status"] = DONE
+                self._log(job, "done")
+            elif job["attempts"] <= self.retries:
+                job["status"] = PENDING
+                self._log(job, f"failed with exit code {returncode}, retrying")
+            else:
+                job["status"] = FAILED
+                self._log(job, f"failed with exit code {returncode}")
+            if self.on_finish is not None and job["status"] != PENDING:
+                self.on_finish(job)
+
+    def run(self) -> Dict[str, int]:
+        """
+        Run the queue until no job can be started, and return the number of jobs
+        in every status.
+        """
+        try:
+            while True:
+                self._reap()
+                busy = {slot for _, slot, _ in self.running.values() if slot is not None}
+                free = [slot for slot in range(len(self.slots)) if slot not in busy]
+                free_host = self.host_slots - sum(1 for _, slot, _ in self.running.values() if slot is None)
+                for job in self._runnable():
+                    if not job["uses_device"]:
+                        if free_host > 0:
+                            self._launch(job, None)
+                            free_host -= 1
+                    elif free:
+                        self._launch(job, free.pop(0))
+                self.save()
+                if not self.running:
+                    if not self._runnable():
+                        break
+                    continue
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            for process, _, _ in self.running.values():
+                process.terminate()
+            raise
+        finally:
+            self.save()
+
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
@@ -0,0 +1,125 @@
+import os
+import time
+from itertools import islice
+
+from src.data.codelin import get_codelin, read_label_blocks
+from src.data.utils import add_bos_eos_block, parse_tree
+from src.evaluation.tracing import span
+from src.machamp.predictor import ModelCache
+
+
+def escape_tokens(tokens):
+    """
+    Escape brackets as in the .trees files the models were trained on.
+    """
+    return [token.replace('(', '-LB-').replace(')', '-RB-') for token in tokens]
+
+
+def labels_to_entities(blocks, encoding, batch_size=1024):
+    """
+    Given predicted .labels blocks (one string per sentence, with or without
+    -BOS-/-EOS- rows), yields the (tokens, entities) of every sentence, decoding
+    batch_size sentences at a time. Entities are (start, end, type) tuples sorted
+    by start and end.
+    """
+    for tokens, entities, _ in labels_to_trees(blocks, encoding, batch_size):
+        yield tokens, entities
+
+
+def labels_to_trees(blocks, encoding, batch_size=1024, tracer=None, latency=False):
+    """
+    Same as labels_to_entities, also yielding the decoded tree of every sentence.
+    With a Tracer, the BOS/EOS fix-up, decoding and span extraction of every batch
+    are recorded as spans. If latency is also set, sentences are decoded one by
+    one (slower than the batched decode) to record their 'sentence_decode' latency.
+    """
+    codelin = get_codelin(encoding)
+    blocks = iter(blocks)
+    while True:
+        with span(tracer, 'bos_eos'):
+            batch = [add_bos_eos_block(block) for block in islice(blocks, batch_size)]
+        if not batch:
+            return
+        with span(tracer, 'decode', sentences=len(batch)):
+            if tracer is None or not latency:
+                trees = codelin.decode(batch)
+            else:
+                trees, latencies = [], []
+                for block in batch:
+                    start = time.perf_counter_ns()
+                    trees.extend(codelin.decode([block]))
+                    latencies.append(time.perf_counter_ns() - start)
+                tracer.add_latencies('sentence_decode', latencies)
+        with span(tracer, 'trees_to_data', sentences=len(batch)):
+            sentences = []
+            for tree in trees:
+                tokens, entities = parse_tree(tree)
+                tokens = [token.replace('-LB-', '(').replace('-RB-', ')') for token in tokens]
+                entities.sort(key=lambda x: (x[0], x[1]))
+                sentences.append((tokens, entities, tree))
+        yield from sentences
+
+
+def labels_to_data(encoding, labels_file, data_file, trees_file=None, tracer=None, latency=False):
+    """
+    Decode a predicted .labels file into a .data file (and optionally a .trees
+    file) in one streaming pass, without rewriting the .labels file. tracer and
+    latency are passed to labels_to_trees.
+    """
+    trees = open(trees_file, 'w', encoding='utf-8') if trees_file else None
+    try:
+        with open(labels_file, 'r', encoding='utf-8') as f, open(data_file, 'w', encoding='utf-8') as out:
+            for tokens, entities, tree in labels_to_trees(read_label_blocks(f), encoding, tracer=tracer, latency=latency):
+                annotations = "|".join(f"{start},{end} {etype}" for start, end, etype in entities)
+                out.write(f"{' '.join(tokens)}\n{annotations}\n\n")
+                if trees:
+                    trees.write(tree + '\n')
+    finally:
+        if trees:
+            trees.close()
+    return data_file
+
+
+class Tagger:
+    """
+    In-memory nested NER tagging: model inference, -BOS-/-EOS- handling, label
+    decoding and span extraction, without intermediate files.
+
+    The predictor is anything with a predict_sentences(model_path, sentences, dataset)
+    method returning one .labels block per sentence: a ModelCache (models loaded in
+    this process, the default) or a PredictionClient talking to a running server.
+    """
+    def __init__(self, model_path, encoding, dataset=None, predictor=None, device='cpu', batch_size=256):
+        self.model_path = os.path.abspath(model_path)
+        self.encoding = encoding
+        self.dataset = dataset
+        self.predictor = predictor if predictor is not None else ModelCache(device)
+        self.batch_size = batch_size
+
+    def tag_iter(self, sentences):
+        """
+        Yield the (start, end, type) entities of every list of tokens, tagging
+        batch_size sentences at a time.
+        """
+        sentences = iter(sentences)
+        while True:
+            batch = [escape_tokens(tokens) for tokens in islice(sentences, self.batch_size)]
+            if not batch:
+                return
+            # Empty sentences are not sent to the model, they have no entities
+            non_empty = [tokens for tokens in batch if tokens]
+            blocks = self.predictor.predict_sentences(self.model_path, non_empty, self.dataset) if non_empty else []
+            tagged = labels_to_entities(blocks, self.encoding, self.batch_size)
+            for tokens in batch:
+                yield next(tagged)[1] if tokens else []
+
+    def tag(self, sentences):
+        return list(self.tag_iter(sentences))
+
+
+def tag(sentences, model_path, encoding, dataset=None, predictor=None, device='cpu'):
+    """
+    Tag lists of tokens with the model at model_path and return the list of
+    (start, end, type) entities of every sentence.
+    """
+    return Tagger(model_path, encoding, dataset, predictor, device).tag(sentences)
@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from src.data.binary import BinaryCorpus, binary_path, compile_data, is_binary, resolve
+from src.data.utils import find_entities, read_data
+from src.evaluation.evaluator import Evaluator
+
+DATA = ('IL-2 gene expression\n0,1 G#DNA|0,0 G#protein|0,1 G#DNA\n\n'
+        'no entities here\n\n\n'
+        'CD28 ( surface ) receptor\n0,4 G#protein|0,0 G#protein|2,2 G#other\n\n'
+        'last\n0,0 G#cell\n')
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'test.data'
+    path.write_text(DATA, encoding='utf-8')
+    return str(path)
+
+
+def test_round_trip(data_file):
+    corpus = BinaryCorpus(compile_data(data_file))
+    expected = list(read_data(io.StringIO(DATA)))
+    assert len(corpus) == len(expected)
+    for (tokens, entities), (expected_tokens, expected_entities) in zip(corpus, expected):
+        assert tokens == expected_tokens
+        assert set(entities) == set(expected_entities)
+    assert corpus.entity_sets() == find_entities(data_file)
+    assert corpus.entity_sets(1, 3) == find_entities(data_file)[1:3]
+
+
+def test_find_entities_and_resolve(data_file):
+    assert resolve(data_file) == data_file
+    compiled = compile_data(data_file)
+    assert compiled == binary_path(data_file) and is_binary(compiled)
+    assert resolve(data_file) == compiled
+    assert find_entities(compiled) == find_entities(data_file)
+
+
+def test_empty_corpus(tmp_path):
+    path = tmp_path / 'empty.data'
+    path.write_text('')
+    corpus = BinaryCorpus(compile_data(str(path)))
+    assert len(corpus) == 0 and corpus.entity_sets() == []
+
+
+def test_evaluation_matches_text(data_file, tmp_path):
+    compiled = compile_data(data_file)
+    pred = tmp_path / 'pred.data'
+    pred.write_text('IL-2 gene expression\n0,1 G#DNA\n\nno entities here\n0,0 G#cell\n\n'
+                    'CD28 ( surface ) receptor\n0,4 G#protein\n\nlast\n\n')
+    evaluator = Evaluator(backend='columnar')
+    assert evaluator.evaluate_all(compiled, str(pred)) == evaluator.evaluate_all(data_file, str(pred))
+
+
+def test_not_a_corpus(data_file):
+    with pytest.raises(ValueError):
+        BinaryCorpus(data_file)
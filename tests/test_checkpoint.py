@@ -0,0 +1,264 @@
+import os
+import sys
+import pickle
+import types
+
+import pytest
+
+from src.machamp.checkpoint import CheckpointManager, EpochCheckpointing, read_dev_score
+
+
+class Module:
+    def __init__(self, weight=0.0):
+        self.training = True
+        self.weight = [weight]
+
+    def parameters(self):
+        return [self.weight]
+
+    def train(self, mode=True):
+        self.training = mode
+        return self
+
+    def eval(self):
+        return self.train(False)
+
+    def state_dict(self):
+        return {'weight': self.weight[0]}
+
+    def load_state_dict(self, state):
+        self.weight[0] = state['weight']
+
+
+class Optimizer:
+    def __init__(self, params):
+        self.param_groups = [{'params': list(params)}]
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+        for p in self.param_groups[0]['params']:
+            p[0] += 1.0
+
+    def state_dict(self):
+        return {'steps': self.steps}
+
+    def load_state_dict(self, state):
+        self.steps = state['steps']
+
+
+class Scheduler:
+    def __init__(self, optimizer, num_epochs):
+        self.optimizer = optimizer
+        self.num_epochs = num_epochs
+        self.last_epoch = 0
+
+    def step(self):
+        self.last_epoch += 1
+
+    def state_dict(self):
+        return {'num_epochs': self.num_epochs, 'last_epoch': self.last_epoch}
+
+    def load_state_dict(self, state):
+        self.__dict__.update(state)
+
+
+class FailingWrite:
+    pass
+
+
+def fake_save(obj, f):
+    if isinstance(obj, dict) and obj.get('model', {}).get('weight') is FailingWrite:
+        f.write(b'partial')
+        raise OSError("disk full")
+    pickle.dump(obj, f)
+
+
+def fake_load(path, map_location=None, weights_only=True):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(autouse=True)
+def torch(monkeypatch):
+    """
+    Just enough of torch for the checkpoints: pickle serialization, a random
+    generator state and the patched Optimizer and Module classes.
+    """
+    torch = types.ModuleType('torch')
+    torch.save, torch.load = fake_save, fake_load
+    torch.get_rng_state = lambda: b'rng'
+    torch.set_rng_state = lambda state: None
+    torch.cuda = types.SimpleNamespace(is_available=lambda: False)
+    torch.optim = types.SimpleNamespace(Optimizer=Optimizer)
+    torch.nn = types.SimpleNamespace(Module=Module)
+    monkeypatch.setitem(sys.modules, 'torch', torch)
+    return torch
+
+
+def test_atomic_save(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    path = manager.save(1, Module(1.0), Optimizer([]))
+    assert path == os.path.join(str(tmp_path), 'checkpoints', 'epoch_001.pt')
+
+    model = Module()
+    model.weight[0] = FailingWrite
+    with pytest.raises(OSError):
+        manager.save(2, model)
+    # Neither a truncated checkpoint nor a temporary file is left
+    assert os.listdir(manager.directory) == ['epoch_001.pt']
+    assert manager.latest()['model'] == {'weight': 1.0}
+
+
+def test_rotation(tmp_path):
+    manager = CheckpointManager(str(tmp_path), keep=2)
+    for epoch in range(1, 5):
+        manager.save(epoch, Module(epoch))
+    assert manager.epochs() == [4, 3]
+    assert sorted(os.listdir(manager.directory)) == ['epoch_003.pt', 'epoch_004.pt']
+    manager.clear()
+    assert manager.epochs() == [] and not os.path.exists(manager.directory)
+
+
+def test_latest_skips_corrupt(tmp_path):
+    manager = CheckpointManager(str(tmp_path), keep=3)
+    for epoch in (1, 2, 3):
+        manager.save(epoch, Module(epoch))
+    with open(manager.path(3), 'wb') as f:
+        f.write(b'not a checkpoint')
+    # A checkpoint renamed to another epoch is not trusted either
+    os.replace(manager.path(1), manager.path(2))
+    manager.save(1, Module(1.0))
+    with pytest.warns(UserWarning, match='epoch_003'):
+        state = manager.latest()
+    assert state['epoch'] == 1 and state['model'] == {'weight': 1.0}
+
+
+def train(manager, num_epochs, state=None, epochs=None, scheduler=True, dev_score=None, model_file=None):
+    """
+    Training loop the checkpointing only sees through torch, as in MaChAmp, which
+    saves the final model to model_file.
+    """
+    checkpointing = EpochCheckpointing(manager, state, num_epochs, dev_score)
+    checkpointing.install()
+    try:
+        model = Module()
+        optimizer = Optimizer(model.parameters())
+        lr_scheduler = Scheduler(optimizer, num_epochs - (state['epoch'] if state else 0)) if scheduler else None
+        for _ in range(epochs or num_epochs - (state['epoch'] if state else 0)):
+            model.train()
+            optimizer.step()
+            if lr_scheduler:
+                lr_scheduler.step()
+            model.eval()
+        model.train()
+        checkpointing.check()
+        if model_file is not None:
+            with open(model_file, 'wb') as f:
+                fake_save(model, f)
+            checkpointing.keep_best(model_file)
+    finally:
+        checkpointing.uninstall()
+    return model, optimizer, lr_scheduler
+
+
+def test_resume(tmp_path):
+    full, _, _ = train(CheckpointManager(str(tmp_path / 'full')), 5)
+
+    manager = CheckpointManager(str(tmp_path / 'interrupted'), keep=5)
+    train(manager, 5, epochs=3)
+    assert manager.epochs() == [3, 2, 1]
+    state = manager.latest()
+    assert state['num_epochs'] == 5 and state['scheduler'] == {'num_epochs': 5, 'last_epoch': 3}
+
+    model, optimizer, lr_scheduler = train(manager, 5, state)
+    assert model.weight == full.weight and optimizer.steps == 5
+    # The restored state overrides the horizon of the scheduler built for 2 epochs
+    assert lr_scheduler.num_epochs == 5 and lr_scheduler.last_epoch == 5
+
+
+def test_uninstall(tmp_path):
+    optimizer_init, module_train = Optimizer.__init__, Module.train
+    checkpointing = EpochCheckpointing(CheckpointManager(str(tmp_path)))
+    checkpointing.install()
+    assert Optimizer.__init__ is not optimizer_init and Module.train is not module_train
+    checkpointing.uninstall()
+    assert Optimizer.__init__ is optimizer_init and Module.train is module_train
+
+
+def test_resume_horizon_mismatch(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    train(manager, 5, epochs=3)
+    state = manager.latest()
+    state['scheduler']['num_epochs'] = 4
+    with pytest.warns(UserWarning, match='spans 4 epochs instead of the 5'):
+        train(manager, 5, state)
+
+
+def test_no_scheduler(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    with pytest.warns(UserWarning, match='No learning rate scheduler'):
+        train(manager, 3, scheduler=False)
+    assert manager.epochs() == []
+
+    train(manager, 3, epochs=2)
+    state = manager.latest()
+    with pytest.raises(RuntimeError, match='no learning rate scheduler was found'):
+        train(manager, 3, state, scheduler=False)
+    state['scheduler'] = None
+    with pytest.raises(ValueError, match='no scheduler state'):
+        EpochCheckpointing(manager, state)
+
+
+def test_not_restored(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    train(manager, 3, epochs=2)
+    checkpointing = EpochCheckpointing(manager, manager.latest(), 3)
+    with pytest.raises(RuntimeError, match='was not restored'):
+        checkpointing.check()
+
+
+def test_keep_best_epoch_before_resume(tmp_path):
+    manager = CheckpointManager(str(tmp_path), keep=1)
+    model_file = str(tmp_path / 'model.pt')
+    # Dev scores per epoch of the current trainer run (numbered from 1 in every run)
+    scores = {1: 0.5, 2: 0.9, 3: 0.6}
+    train(manager, 5, epochs=3, dev_score=scores.get)
+    state = manager.latest()
+    assert state['best'] == {'epoch': 2, 'score': 0.9}
+    # The best weights survive the rotation
+    assert manager.epochs() == [3] and manager.load_best()['model'] == {'weight': 2.0}
+
+    scores.clear()
+    scores.update({1: 0.7, 2: 0.8})
+    train(manager, 5, state, dev_score=scores.get, model_file=model_file)
+    assert fake_load(model_file).weight == [2.0]
+
+
+def test_keep_best_epoch_after_resume(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    model_file = str(tmp_path / 'model.pt')
+    scores = {1: 0.5, 2: 0.9, 3: 0.6}
+    train(manager, 5, epochs=3, dev_score=scores.get)
+    scores.clear()
+    scores.update({1: 0.7, 2: 0.95})
+    train(manager, 5, manager.latest(), dev_score=scores.get, model_file=model_file)
+    assert fake_load(model_file).weight == [5.0]
+
+
+def test_keep_best_without_scores(tmp_path):
+    manager = CheckpointManager(str(tmp_path))
+    model_file = str(tmp_path / 'model.pt')
+    train(manager, 5, epochs=3, dev_score={1: 0.5, 2: 0.9, 3: 0.6}.get)
+    # The resumed epochs cannot be compared: the trainer's choice is kept
+    with pytest.warns(UserWarning, match='No dev score found'):
+        train(manager, 5, manager.latest(), dev_score={}.get, model_file=model_file)
+    assert fake_load(model_file).weight == [5.0]
+
+
+def test_read_dev_score(tmp_path):
+    (tmp_path / 'metrics_epoch_2.json').write_text('{"dev_sum": 1.5, "dev_ner_f1": 0.75}')
+    assert read_dev_score(str(tmp_path), 2) == 1.5
+    assert read_dev_score(str(tmp_path), 2, metric='dev_ner_f1') == 0.75
+    assert read_dev_score(str(tmp_path), 1) is None
+    assert read_dev_score(str(tmp_path), 2, metric='missing') is None
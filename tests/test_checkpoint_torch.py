@@ -0,0 +1,59 @@
+import pytest
+
+from src.machamp.checkpoint import CheckpointManager, EpochCheckpointing
+
+torch = pytest.importorskip('torch')
+
+STEPS = 4
+
+
+def train(manager, num_epochs, state=None, epochs=None):
+    """
+    A small real training loop (dropout, AdamW and a linear learning rate decay
+    stepped every batch), observed by EpochCheckpointing only through torch.
+    """
+    checkpointing = EpochCheckpointing(manager, state, num_epochs)
+    checkpointing.install()
+    try:
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.Dropout(0.5), torch.nn.Linear(8, 1))
+        optimizer = torch.optim.AdamW(model.parameters(), lr=0.01)
+        remaining = num_epochs - (state['epoch'] if state is not None else 0)
+        # Built for the remaining epochs, as MaChAmp is on resume
+        scheduler = torch.optim.lr_scheduler.LinearLR(optimizer, start_factor=1.0, end_factor=0.1,
+                                                      total_iters=remaining * STEPS)
+        for _ in range(epochs or remaining):
+            model.train()
+            for _ in range(STEPS):
+                loss = model(torch.randn(8, 4)).pow(2).mean()
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                scheduler.step()
+            model.eval()
+            with torch.no_grad():
+                model(torch.randn(2, 4))
+        model.train()
+        checkpointing.check()
+    finally:
+        checkpointing.uninstall()
+    assert checkpointing.scheduler is scheduler
+    return model, scheduler
+
+
+def test_resume_matches_uninterrupted_run(tmp_path):
+    module_train, optimizer_init = torch.nn.Module.train, torch.optim.Optimizer.__init__
+    full, full_scheduler = train(CheckpointManager(str(tmp_path / 'full')), 5)
+
+    manager = CheckpointManager(str(tmp_path / 'interrupted'))
+    train(manager, 5, epochs=3)
+    state = manager.latest()
+    assert state['epoch'] == 3 and state['scheduler'] is not None
+
+    resumed, scheduler = train(manager, 5, state)
+    # The restored state overrides the horizon of the scheduler built for 2 epochs
+    assert scheduler.total_iters == 5 * STEPS
+    assert scheduler.get_last_lr() == full_scheduler.get_last_lr()
+    for p, q in zip(full.parameters(), resumed.parameters()):
+        assert torch.equal(p, q)
+    assert torch.nn.Module.train is module_train and torch.optim.Optimizer.__init__ is optimizer_init
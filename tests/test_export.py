@@ -0,0 +1,84 @@
+import pytest
+
+import src.tagger
+from src.machamp import export
+
+LABELS = 'IL-2\t_\tB\t1\tx\ngene\t_\tI\t1\ty\n\nCD28\t_\tB\t2\tz\n'
+GOLD = 'IL-2 gene\n0,1 G#DNA|0,0 G#protein\n\nCD28\n0,0 G#protein\n'
+# The int8 model misses the single-token protein of the first sentence
+INT8_DATA = 'IL-2 gene\n0,1 G#DNA\n\nCD28\n0,0 G#protein\n'
+
+
+class FakeModelCache:
+    """
+    Stands in for ModelCache: the model.int8.pt 'model' changes the last label of
+    the first token, the fp32 one copies the input.
+    """
+    def __init__(self, device='cpu', max_models=2, batch_size=32):
+        assert device == 'cpu'
+
+    def get(self, model_path):
+        return model_path
+
+    def predict_file(self, model_path, input_file, output_file, dataset=None):
+        with open(input_file, 'r', encoding='utf-8') as f:
+            labels = f.read()
+        if model_path.endswith(export.QUANTIZED_MODEL):
+            labels = labels.replace('\tx\n', '\tw\n', 1)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(labels)
+        return output_file
+
+
+def fake_labels_to_data(encoding, labels_file, data_file, *args, **kwargs):
+    with open(data_file, 'w', encoding='utf-8') as f:
+        f.write(INT8_DATA if 'int8' in labels_file else GOLD)
+    return data_file
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'ModelCache', FakeModelCache)
+    monkeypatch.setattr(src.tagger, 'labels_to_data', fake_labels_to_data)
+    (tmp_path / 'model.pt').write_bytes(b'0' * 4096)
+    (tmp_path / export.QUANTIZED_MODEL).write_bytes(b'0' * 1024)
+    (tmp_path / 'test.labels').write_text(LABELS, encoding='utf-8')
+    (tmp_path / 'test.data').write_text(GOLD, encoding='utf-8')
+    return tmp_path
+
+
+def test_label_agreement(tmp_path):
+    a, b = tmp_path / 'a.labels', tmp_path / 'b.labels'
+    a.write_text(LABELS, encoding='utf-8')
+    b.write_text(LABELS.replace('\tz\n', '\tw\n').replace('\t2\t', '\t3\t'), encoding='utf-8')
+    assert export.label_agreement(str(a), str(b)) == {1: 1.0, 2: 1.0, 3: pytest.approx(2 / 3),
+                                                       4: pytest.approx(2 / 3)}
+
+
+def test_accuracy_report(model_dir):
+    report = export.accuracy_report(str(model_dir), str(model_dir / 'test.labels'))
+    assert report['fp32_size_mb'] == 4096 / 2 ** 20
+    assert report['int8_size_mb'] == 1024 / 2 ** 20
+    assert report['speedup'] > 0
+    assert report['label_agreement'][4] == pytest.approx(2 / 3)
+    assert 'f1_delta' not in report
+
+
+def test_accuracy_report_f1(model_dir):
+    report = export.accuracy_report(str(model_dir), str(model_dir / 'test.labels'),
+                                    gold_data=str(model_dir / 'test.data'), encoding='relative')
+    assert report['fp32_metrics']['f1'] == pytest.approx(1.0)
+    assert report['int8_metrics']['recall'] == pytest.approx(2 / 3)
+    assert report['f1_delta'] == pytest.approx(report['int8_metrics']['f1'] - 1.0)
+    assert report['f1_delta'] < 0
+
+
+def test_compare_predictions(model_dir):
+    # The int8 side is an existing prediction: nothing is tagged again
+    fp32, int8 = model_dir / 'fp32.labels', model_dir / 'int8.labels'
+    fp32.write_text(LABELS, encoding='utf-8')
+    int8.write_text(LABELS.replace('\tx\n', '\tw\n'), encoding='utf-8')
+    report = export.compare_predictions(str(fp32), str(int8), 3.0, 1.5, str(model_dir / 'test.data'), 'relative')
+    assert report['speedup'] == 2.0
+    assert report['label_agreement'][4] == pytest.approx(2 / 3)
+    assert report['f1_delta'] < 0
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from src.data import labels_index
+from src.data.labels_index import LabelsIndex, LabelsReader, StaleIndexError, build_index, shard_bounds
+
+BLOCKS = ['a\tX\tY\nb\tX\tY', 'c\tX\tY', 'd\tX\tY\ne\tX\tY\nf\tX\tY', 'g\tX\tY']
+
+
+@pytest.fixture
+def labels_file(tmp_path):
+    path = tmp_path / 'test.labels'
+    path.write_text('\n\n'.join(BLOCKS) + '\n\n\n', encoding='utf-8')
+    return str(path)
+
+
+def test_reader(labels_file):
+    reader = LabelsReader(labels_file)
+    assert len(reader) == len(BLOCKS)
+    assert [reader[i] for i in range(len(reader))] == BLOCKS
+    assert list(reader.blocks(chunk_size=3)) == BLOCKS
+    assert list(reader.blocks(1, 3)) == BLOCKS[1:3]
+    assert [block for i in range(3) for block in reader.shard(i, 3)] == BLOCKS
+    sample = list(reader.sample(2, seed=1))
+    assert len(sample) == 2 and sample == [block for block in BLOCKS if block in sample]
+
+
+def test_shard_bounds():
+    assert shard_bounds(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert shard_bounds(2, 3) == [(0, 1), (1, 2), (2, 2)]
+
+
+def test_touched_file_is_fresh(labels_file, monkeypatch):
+    build_index(labels_file)
+    stat = os.stat(labels_file)
+    os.utime(labels_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    hashed = []
+    content_hash = labels_index.content_hash
+    monkeypatch.setattr(labels_index, 'content_hash', lambda path: hashed.append(path) or content_hash(path))
+    assert not LabelsIndex(labels_file).is_stale()
+    assert len(hashed) == 1
+    # The new mtime was recorded: later loads do not hash the file again
+    index = LabelsIndex.load(labels_file, rebuild=False)
+    assert index.mtime_ns == stat.st_mtime_ns + 10 ** 9 and len(hashed) == 1
+    assert list(LabelsReader(labels_file).blocks()) == BLOCKS and len(hashed) == 1
+    assert sorted(os.listdir(os.path.dirname(labels_file))) == ['test.labels', 'test.labels.idx']
+
+
+def test_same_size_edit_is_stale(labels_file):
+    build_index(labels_file)
+    stat = os.stat(labels_file)
+    # Same-size edit in the middle of the file, with a new mtime
+    with open(labels_file, 'r+b') as f:
+        f.seek(len(BLOCKS[0]) + 2)
+        f.write(b'z')
+    os.utime(labels_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert LabelsIndex(labels_file).is_stale()
+    with pytest.raises(StaleIndexError):
+        LabelsIndex.load(labels_file, rebuild=False)
+    assert LabelsReader(labels_file)[1] == 'z' + BLOCKS[1][1:]
+
+
+def test_size_change_is_stale(labels_file):
+    build_index(labels_file)
+    with open(labels_file, 'a', encoding='utf-8') as f:
+        f.write('h\tX\tY\n')
+    assert LabelsIndex(labels_file).is_stale()
+    assert LabelsReader(labels_file)[-1] == 'h\tX\tY'
@@ -0,0 +1,155 @@
+import sys
+import shutil
+
+import pytest
+
+from src.machamp.pipeline import SPLITS, Build, Manifest, prepare_node, train_node, evaluate_node
+
+# Dummy step: logs its node id, then writes every output=input[,input...] argument
+# as the upper-cased concatenation of the inputs (or fails at an argument 'fail')
+STEP = '''
+import sys
+log, node_id = sys.argv[1:3]
+with open(log, 'a') as f:
+    f.write(node_id + '\\n')
+for spec in sys.argv[3:]:
+    if spec == 'fail':
+        sys.exit(1)
+    output, inputs = spec.split('=')
+    with open(output, 'w') as f:
+        for path in inputs.split(','):
+            f.write(open(path).read().upper())
+'''
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    (tmp_path / 'step.py').write_text(STEP)
+    (tmp_path / 'train.txt').write_text('train sentences\n')
+    (tmp_path / 'test.txt').write_text('test sentences\n')
+    return tmp_path
+
+
+def node(workspace, node_id, depends, outputs, fail=False, step='step.py'):
+    """
+    Node writing every output from its inputs with the dummy step.
+    """
+    path = lambda name: str(workspace / name)
+    specs = [f"{path(output)}={','.join(path(i) for i in inputs)}" for output, inputs in outputs.items()]
+    return {
+        "id": node_id,
+        "command": [sys.executable, path(step), path('runs.log'), node_id] + ['fail'] * fail + specs,
+        "depends": depends,
+        "inputs": sorted({path(i) for inputs in outputs.values() for i in inputs}),
+        "outputs": [path(output) for output in outputs],
+        "output": path(list(outputs)[-1]),
+        "uses_device": False,
+    }
+
+
+def graph(workspace, fail=None):
+    """
+    prepare (train.txt, test.txt) -> train (train.labels) -> evaluate (model, test.labels)
+    """
+    train = node(workspace, 'train', ['prepare'], {'model': ['train.labels']}, fail == 'train')
+    train["clean"] = [str(workspace / 'checkpoints')]
+    return [
+        node(workspace, 'prepare', [], {'train.labels': ['train.txt'], 'test.labels': ['test.txt']}),
+        train,
+        node(workspace, 'evaluate', ['train'], {'results': ['model', 'test.labels']}, fail == 'evaluate'),
+    ]
+
+
+def build(workspace, force=(), dry_run=False, **kwargs):
+    log = workspace / 'runs.log'
+    if log.exists():
+        log.unlink()
+    counts = Build(graph(workspace, **kwargs), str(workspace / 'build' / 'manifest.json'), ['cpu'],
+                   retries=0, poll_interval=0.01).run(force, dry_run)
+    runs = log.read_text().split() if log.exists() else []
+    return counts, runs
+
+
+def test_first_build_and_no_op(workspace):
+    assert build(workspace) == ({'done': 3}, ['prepare', 'train', 'evaluate'])
+    assert (workspace / 'results').read_text() == 'TRAIN SENTENCES\nTEST SENTENCES\n'
+    assert build(workspace) == ({'current': 3}, [])
+
+
+def test_early_cutoff(workspace):
+    build(workspace)
+    (workspace / 'checkpoints').mkdir()
+    (workspace / 'test.txt').write_text('other test sentences\n')
+
+    counts, runs = build(workspace, dry_run=True)
+    assert counts == {'current': 0, 'stale': 1, 'downstream': 2} and runs == []
+
+    # The train inputs did not change: the model and its checkpoints are kept
+    assert build(workspace) == ({'done': 2, 'current': 1}, ['prepare', 'evaluate'])
+    assert (workspace / 'checkpoints').is_dir()
+    assert (workspace / 'results').read_text() == 'TRAIN SENTENCES\nOTHER TEST SENTENCES\n'
+    assert build(workspace) == ({'current': 3}, [])
+
+
+def test_rebuild(workspace):
+    build(workspace)
+    (workspace / 'checkpoints').mkdir()
+    (workspace / 'train.txt').write_text('more train sentences\n')
+    assert build(workspace) == ({'done': 3}, ['prepare', 'train', 'evaluate'])
+    assert not (workspace / 'checkpoints').exists()
+
+    # Modified or removed outputs are rebuilt, and so is a forced node; the model
+    # they write is the same as before, so it is not evaluated again
+    (workspace / 'model').write_text('tampered\n')
+    assert build(workspace) == ({'done': 1, 'current': 2}, ['train'])
+    (workspace / 'results').unlink()
+    assert build(workspace) == ({'done': 1, 'current': 2}, ['evaluate'])
+    assert build(workspace, force=['train']) == ({'done': 1, 'current': 2}, ['train'])
+    assert build(workspace, force=['train', 'evaluate']) == ({'done': 2, 'current': 1}, ['train', 'evaluate'])
+
+
+def test_failed_dependency(workspace):
+    build(workspace)
+    (workspace / 'train.txt').write_text('more train sentences\n')
+    assert build(workspace, fail='train') == ({'done': 1, 'failed': 2}, ['prepare', 'train'])
+    assert not (workspace / 'model').exists()
+    assert build(workspace) == ({'done': 2, 'current': 1}, ['train', 'evaluate'])
+
+
+def test_params_key(workspace):
+    # The same nodes run by a step script at another path, e.g. a moved checkout
+    moved = workspace / 'moved'
+    moved.mkdir()
+    shutil.copy(workspace / 'step.py', moved / 'step.py')
+    nodes = [dict(n, params={"node": n["id"]}) for n in graph(workspace)]
+    manifest_file = str(workspace / 'build' / 'manifest.json')
+    run = lambda nodes: Build(nodes, manifest_file, ['cpu'], retries=0, poll_interval=0.01).run()
+
+    assert run(nodes) == {'done': 3}
+    moved_nodes = [dict(n, command=[sys.executable, str(moved / 'step.py')] + n["command"][2:]) for n in nodes]
+    assert run(moved_nodes) == {'current': 3}
+    # A changed setting rebuilds the node (the dummy model it writes is the same)
+    moved_nodes[1]["params"] = {"node": "train", "num_epochs": 10}
+    assert run(moved_nodes) == {'done': 1, 'current': 2}
+
+
+def test_pipeline_node_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for path in [f'data/genia/{split}.data' for split in SPLITS] + \
+                [f'data/genia/REL/{split}.labels' for split in SPLITS] + ['parameter_configs/bert.json']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    manifest = Manifest('manifest.json')
+
+    # Neither the number of workers nor the location of the scripts is part of the key
+    prepare = prepare_node('genia', 'REL', workers=1)
+    moved = dict(prepare_node('genia', 'REL', workers=8), command=['/usr/bin/python3', '/elsewhere/train.py'])
+    assert manifest.key(prepare) == manifest.key(moved)
+
+    train = train_node('genia', 'bert-base-cased', 'REL', 0, num_epochs=30)
+    assert manifest.key(train) == manifest.key(train_node('genia', 'bert-base-cased', 'REL', 0, num_epochs=30))
+    for other in (train_node('genia', 'bert-base-cased', 'REL', 1, num_epochs=30),
+                  train_node('genia', 'bert-base-cased', 'REL', 0, num_epochs=20),
+                  train_node('genia', 'roberta-base', 'REL', 0, num_epochs=30)):
+        assert manifest.key(other) != manifest.key(train)
+    assert evaluate_node('genia', 'bert-base-cased', 'REL', [0, 1])["params"]["seeds"] == [0, 1]
@@ -0,0 +1,143 @@
+import sys
+import json
+
+import pytest
+
+from src.machamp.scheduler import Scheduler, PENDING, RUNNING, DONE, FAILED
+
+# Dummy job: logs when it starts and ends (with its --device, if any), sleeps,
+# fails on its first `fails` attempts and writes its output otherwise
+JOB = '''
+import sys, time, os
+log, job_id, output, fails, sleep = sys.argv[1:6]
+device = sys.argv[sys.argv.index('--device') + 1] if '--device' in sys.argv else 'host'
+with open(log, 'a') as f:
+    f.write(f'start {job_id} {device} {time.time()}\\n')
+attempts_file = output + '.attempts'
+attempts = int(open(attempts_file).read()) + 1 if os.path.exists(attempts_file) else 1
+open(attempts_file, 'w').write(str(attempts))
+time.sleep(float(sleep))
+with open(log, 'a') as f:
+    f.write(f'end {job_id} {device} {time.time()}\\n')
+if attempts <= int(fails):
+    sys.exit(1)
+open(output, 'w').write(job_id)
+'''
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    (tmp_path / 'job.py').write_text(JOB)
+    return tmp_path
+
+
+def job(workspace, job_id, depends=(), fails=0, sleep=0.0, uses_device=True):
+    return {
+        "id": job_id,
+        "command": [sys.executable, str(workspace / 'job.py'), str(workspace / 'jobs.log'), job_id,
+                    str(workspace / f'{job_id}.out'), str(fails), str(sleep)],
+        "depends": list(depends),
+        "output": str(workspace / f'{job_id}.out'),
+        "uses_device": uses_device,
+    }
+
+
+def scheduler(workspace, devices=('cpu',), **kwargs):
+    kwargs.setdefault('retries', 1)
+    return Scheduler(str(workspace / 'queue.json'), list(devices), poll_interval=0.01, **kwargs)
+
+
+def events(workspace):
+    """
+    Start and end events of the jobs, as (job id, device, start, end) tuples.
+    """
+    starts, runs = {}, []
+    for line in (workspace / 'jobs.log').read_text().splitlines():
+        kind, job_id, device, moment = line.split()
+        if kind == 'start':
+            starts[job_id, device] = float(moment)
+        else:
+            runs.append((job_id, device, starts.pop((job_id, device)), float(moment)))
+    return runs
+
+
+def max_overlap(runs):
+    moments = sorted([(start, 1) for _, _, start, _ in runs] + [(end, -1) for _, _, _, end in runs])
+    running = peak = 0
+    for _, change in moments:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def test_retries_and_failed_dependencies(workspace):
+    queue = scheduler(workspace, retries=1)
+    queue.add([job(workspace, 'flaky', fails=1), job(workspace, 'broken', fails=2),
+               job(workspace, 'after_flaky', ['flaky']), job(workspace, 'after_broken', ['broken'])])
+    assert queue.run() == {DONE: 2, FAILED: 2}
+    assert queue.jobs['flaky']['attempts'] == 2 and queue.jobs['flaky']['returncode'] == 0
+    assert queue.jobs['broken']['attempts'] == 2 and queue.jobs['broken']['returncode'] == 1
+    # The dependent of a failed job never runs
+    assert queue.jobs['after_broken']['attempts'] == 0
+    assert sorted({job_id for job_id, _, _, _ in events(workspace)}) == ['after_flaky', 'broken', 'flaky']
+
+    # Failed jobs only run again when reset, with a new retry budget
+    queue = scheduler(workspace, retries=1)
+    assert queue.run() == {DONE: 2, FAILED: 2}
+    queue.reset_failed()
+    assert queue.run() == {DONE: 4}
+    assert queue.jobs['broken']['attempts'] == 1
+
+
+def test_restart(workspace):
+    jobs = [job(workspace, name) for name in ('finished', 'removed', 'interrupted', 'new')]
+    (workspace / 'finished.out').write_text('finished')
+    queue = [dict(j, status=status, attempts=1, returncode=None, device='cpu')
+             for j, status in zip(jobs[:3], (DONE, DONE, RUNNING))]
+    (workspace / 'queue.json').write_text(json.dumps({"jobs": queue}))
+
+    restarted = scheduler(workspace)
+    # Running jobs did not finish, and a finished job whose output was removed runs again
+    assert {job_id: j['status'] for job_id, j in restarted.jobs.items()} == \
+           {'finished': DONE, 'removed': PENDING, 'interrupted': PENDING}
+    restarted.add(jobs)
+    assert restarted.jobs['new']['status'] == PENDING
+    assert restarted.run() == {DONE: 4}
+    assert sorted(job_id for job_id, _, _, _ in events(workspace)) == ['interrupted', 'new', 'removed']
+    assert (workspace / 'finished.out').read_text() == 'finished'
+
+    # Jobs whose output exists are not run again
+    (workspace / 'queue.json').unlink()
+    (workspace / 'jobs.log').unlink()
+    queue = scheduler(workspace)
+    queue.add(jobs)
+    assert queue.run() == {DONE: 4} and not (workspace / 'jobs.log').exists()
+
+
+def test_per_device_packing(workspace):
+    queue = scheduler(workspace, devices=['0', 'cpu'], per_device=2)
+    queue.add([job(workspace, f'job_{i}', sleep=0.3) for i in range(6)])
+    assert queue.run() == {DONE: 6}
+    runs = events(workspace)
+    # The cpu device is passed as -1
+    assert {device for _, device, _, _ in runs} == {'0', '-1'}
+    assert max_overlap(runs) == 4
+    for device in ('0', '-1'):
+        assert max_overlap([run for run in runs if run[1] == device]) == 2
+
+
+def test_host_slots(workspace):
+    queue = scheduler(workspace, host_slots=2)
+    queue.add([job(workspace, f'prepare_{i}', sleep=0.3, uses_device=False) for i in range(4)] +
+              [job(workspace, 'train', ['prepare_0'], sleep=0.3)])
+    assert queue.run() == {DONE: 5}
+    runs = events(workspace)
+    assert max_overlap([run for run in runs if run[1] == 'host']) == 2
+    # Device jobs do not take host slots
+    assert [device for job_id, device, _, _ in runs if job_id == 'train'] == ['-1']
+    assert max_overlap(runs) == 3
+
+
+def test_host_slots_validation(workspace):
+    with pytest.raises(ValueError):
+        scheduler(workspace, host_slots=0)
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from src.evaluation.evaluator import Evaluator
+
+TYPES = ['PER', 'ORG', 'LOC', 'G#DNA']
+
+
+def random_sentence(rng, empty=False):
+    n_tokens = rng.randint(1, 15)
+    entities = []
+    if not empty:
+        for _ in range(rng.randint(0, 6)):
+            start = rng.randrange(n_tokens)
+            end = rng.randrange(start, min(n_tokens, start + 5))
+            entities.append((rng.choice(TYPES), start, end))
+        if entities and rng.random() < 0.3:
+            # Same span twice, with the same and with another type
+            entity_type, start, end = entities[0]
+            entities += [(entity_type, start, end), (rng.choice(TYPES), start, end)]
+    return [f'w{i}' for i in range(n_tokens)], entities
+
+
+def perturb(rng, entities):
+    predicted = [e for e in entities if rng.random() < 0.7]
+    for entity_type, start, end in entities:
+        if rng.random() < 0.2:
+            predicted.append((rng.choice(TYPES), start, end))
+        if rng.random() < 0.2:
+            predicted.append((entity_type, start, end + 1))
+    return predicted
+
+
+def write_data(path, sentences):
+    with open(path, 'w', encoding='utf-8') as f:
+        for tokens, entities in sentences:
+            annotation = '|'.join(f'{start},{end} {entity_type}' for entity_type, start, end in entities)
+            f.write(' '.join(tokens) + '\n' + annotation + '\n\n')
+    return str(path)
+
+
+@pytest.fixture
+def data_files(tmp_path):
+    rng = random.Random(0)
+    gold, pred = [], []
+    for i in range(300):
+        tokens, entities = random_sentence(rng, empty=i % 10 == 0)
+        gold.append((tokens, entities))
+        # Empty predictions for sentences with entities and vice versa
+        if i % 17 == 0:
+            pred.append((tokens, []))
+        elif i % 10 == 0:
+            pred.append((tokens, [('PER', 0, 0)]))
+        else:
+            pred.append((tokens, perturb(rng, entities)))
+    return write_data(tmp_path / 'gold.data', gold), write_data(tmp_path / 'pred.data', pred)
+
+
+def normalize(results):
+    if isinstance(results, dict):
+        return {str(key): normalize(value) for key, value in results.items()}
+    return pytest.approx(float(results))
+
+
+def test_evaluate_all_backends_match(data_files):
+    gold, pred = data_files
+    python = Evaluator(backend='python').evaluate_all(gold, pred)
+    columnar = Evaluator(backend='columnar').evaluate_all(gold, pred)
+    assert set(python) == {'overall', 'by_depth', 'by_length', 'by_label'}
+    assert normalize(columnar) == normalize(python)
+
+
+def test_calculate_metrics_backends_match(data_files):
+    gold, pred = data_files
+    python = Evaluator(backend='python')
+    columnar = Evaluator(backend='columnar')
+    assert normalize(columnar.calculate_metrics(gold, pred)) == normalize(python.calculate_metrics(gold, pred))
+    assert normalize(columnar.calculate_metrics_by_label(gold, pred)) == \
+        normalize(python.calculate_metrics_by_label(gold, pred))
+
+
+def test_identical_files_score_one(data_files):
+    gold, _ = data_files
+    for backend in ('python', 'columnar'):
+        overall = Evaluator(backend=backend).evaluate_all(gold, gold, breakdowns=())['overall']
+        assert overall['precision'] == overall['recall'] == overall['f1'] == 1
+
+
+def test_evaluate_all_matches_breakdown_methods(data_files):
+    gold, pred = data_files
+    evaluator = Evaluator(backend='python')
+    results = evaluator.evaluate_all(gold, pred)
+    assert normalize(results['overall']) == normalize(evaluator.calculate_metrics(gold, pred))
+    assert normalize(results['by_depth']) == normalize(evaluator.calculate_metrics_by_depth(gold, pred))
+    assert normalize(results['by_length']) == normalize(evaluator.calculate_metrics_by_length(gold, pred))
+    assert normalize(results['by_label']) == normalize(evaluator.calculate_metrics_by_label(gold, pred))
+    # Leaving out breakdowns does not change the others
+    assert evaluator.evaluate_all(gold, pred, breakdowns=('label',)) == \
+        {'overall': results['overall'], 'by_label': results['by_label']}
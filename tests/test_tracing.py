@@ -0,0 +1,57 @@
+import pytest
+
+from src.evaluation import tracing
+from src.evaluation.tracing import Tracer
+
+MB = 2 ** 20
+
+requires_clear_refs = pytest.mark.skipif(tracing.hwm_rss_mb() is None or not tracing.reset_peak_rss(),
+                                         reason="the RSS high-water mark cannot be reset here")
+
+
+def allocate(mb):
+    # Touch every page, then free them before the span ends
+    block = bytearray(mb * MB)
+    for i in range(0, len(block), 4096):
+        block[i] = 1
+    del block
+
+
+@requires_clear_refs
+def test_peak_of_a_transient_allocation():
+    tracer = Tracer()
+    allocate(64)
+    with tracer.span('small'):
+        pass
+    with tracer.span('transient'):
+        allocate(64)
+    small, transient = (event["args"] for event in tracer.events)
+    # The 64 MB freed before the end are in the peak of their span only
+    assert transient["peak_rss_mb"] - transient["rss_mb"] > 48
+    assert small["peak_rss_mb"] - small["rss_mb"] < 16
+    assert abs(transient["rss_delta_mb"]) < 16
+    assert "process_peak_rss_mb" not in transient
+
+
+@requires_clear_refs
+def test_nested_spans_keep_their_peak():
+    tracer = Tracer()
+    with tracer.span('outer'):
+        allocate(64)
+        with tracer.span('inner'):
+            pass
+    inner, outer = (event["args"] for event in tracer.events)
+    assert outer["peak_rss_mb"] - outer["rss_mb"] > 48
+    assert inner["peak_rss_mb"] - inner["rss_mb"] < 16
+    summary = tracer.summary()["stages"]
+    assert summary["outer"]["peak_rss_mb"] == outer["peak_rss_mb"]
+
+
+def test_fallback_without_proc(monkeypatch):
+    monkeypatch.setattr(tracing, 'reset_peak_rss', lambda: False)
+    tracer = Tracer()
+    with tracer.span('stage'):
+        pass
+    args = tracer.events[0]["args"]
+    assert "peak_rss_mb" not in args and args["process_peak_rss_mb"] > 0
+    assert tracer.summary()["stages"]["stage"]["process_peak_rss_mb"] == args["process_peak_rss_mb"]
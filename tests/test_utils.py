@@ -0,0 +1,117 @@
+import io
+import random
+
+import pytest
+
+from src.data.utils import (find_entities, nesting_depths, parse_annotation, parse_tree, read_data,
+                            to_parenthesized, trees_to_data)
+
+
+def baseline_depths(entities):
+    """
+    Quadratic definition: one more than the deepest enclosing span (other than an
+    identical one).
+    """
+    depths = {}
+
+    def depth(entity):
+        if entity not in depths:
+            enclosing = [other for other in entities if other[1:] != entity[1:]
+                         and other[1] <= entity[1] and entity[2] <= other[2]]
+            depths[entity] = 1 + max((depth(other) for other in enclosing), default=0)
+        return depths[entity]
+
+    return {entity: depth(entity) for entity in entities}
+
+
+def test_parse_annotation():
+    assert parse_annotation('0,5 ORG|4,5 GPE|12,12 GPE') == [('ORG', 0, 5), ('GPE', 4, 5), ('GPE', 12, 12)]
+    assert parse_annotation('') == []
+    assert parse_annotation('\n') == []
+
+
+def test_read_data():
+    lines = io.StringIO('a b c\n0,1 PER|2,2 LOC\n\nd e\n\n\nf\n0,0 ORG\n')
+    assert list(read_data(lines)) == [
+        (['a', 'b', 'c'], [('PER', 0, 1), ('LOC', 2, 2)]),
+        (['d', 'e'], []),
+        (['f'], [('ORG', 0, 0)]),
+    ]
+
+
+def test_read_data_file_endings():
+    # A trailing blank line adds no sentence, a missing one loses no entities
+    for text in ('a b\n0,1 PER\n\n', 'a b\n0,1 PER\n', 'a b\n0,1 PER'):
+        assert list(read_data(io.StringIO(text))) == [(['a', 'b'], [('PER', 0, 1)])]
+    assert list(read_data(io.StringIO('a b\n'))) == [(['a', 'b'], [])]
+
+
+def test_find_entities_deduplicates(tmp_path):
+    data_file = tmp_path / 'test.data'
+    data_file.write_text('a b\n0,1 PER|0,1 PER|0,1 ORG\n\nc\n\n')
+    assert find_entities(str(data_file)) == [{('PER', 0, 1), ('ORG', 0, 1)}, set()]
+
+
+def test_parse_tree():
+    tokens, entities = parse_tree('(S (PER John (LOC New York)) (ROOT lives) here)')
+    assert tokens == ['John', 'New', 'York', 'lives', 'here']
+    assert entities == [(0, 2, 'PER'), (1, 2, 'LOC')]
+
+
+def test_parse_tree_malformed():
+    for tree in ('(S (PER John)', '(S John))', '(S John) x', 'John'):
+        with pytest.raises(ValueError):
+            parse_tree(tree)
+
+
+def test_trees_to_data_round_trip(tmp_path):
+    data_file = tmp_path / 'test.data'
+    data_file.write_text('John ( New York ) lives\n0,4 PER|2,3 LOC\n\nhere\n\n')
+    trees_file = to_parenthesized(str(data_file), str(tmp_path / 'test.trees'))
+    output_file = trees_to_data(trees_file, str(tmp_path / 'output.data'))
+    assert find_entities(output_file) == find_entities(str(data_file))
+    assert open(output_file).read().split('\n')[0] == 'John ( New York ) lives'
+
+
+def test_trees_to_data_malformed(tmp_path):
+    trees_file = tmp_path / 'test.trees'
+    trees_file.write_text('(S (PER John))\n(S (PER John)\n')
+    output_file = tmp_path / 'output.data'
+    output_file.write_text('previous')
+    with pytest.raises(ValueError):
+        trees_to_data(str(trees_file), str(output_file))
+    # The output is untouched and no temporary file is left behind
+    assert output_file.read_text() == 'previous'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['output.data', 'test.trees']
+
+
+def test_nesting_depths():
+    entities = [('ORG', 0, 5), ('GPE', 4, 5), ('PER', 4, 4), ('LOC', 7, 8), ('GPE', 12, 12)]
+    assert nesting_depths(entities) == {('ORG', 0, 5): 1, ('GPE', 4, 5): 2, ('PER', 4, 4): 3,
+                                        ('LOC', 7, 8): 1, ('GPE', 12, 12): 1}
+    assert nesting_depths([]) == {}
+
+
+def test_nesting_depths_identical_spans():
+    # Identical spans with different types share their depth, and both enclose the rest
+    entities = [('ORG', 0, 3), ('GPE', 0, 3), ('PER', 1, 2), ('LOC', 1, 2), ('MISC', 2, 2)]
+    assert nesting_depths(entities) == {('ORG', 0, 3): 1, ('GPE', 0, 3): 1, ('PER', 1, 2): 2,
+                                        ('LOC', 1, 2): 2, ('MISC', 2, 2): 3}
+
+
+def test_nesting_depths_crossing_spans():
+    a, b, c, d = ('A', 0, 6), ('B', 1, 6), ('C', 2, 9), ('D', 3, 4)
+    assert nesting_depths([a, b, c, d]) == {a: 1, b: 2, c: 1, d: 3}
+    # Crossing spans do not enclose each other
+    assert nesting_depths([('A', 0, 3), ('B', 2, 5), ('C', 2, 3)]) == {('A', 0, 3): 1, ('B', 2, 5): 1,
+                                                                      ('C', 2, 3): 2}
+
+
+def test_nesting_depths_random():
+    rng = random.Random(0)
+    for _ in range(300):
+        entities = set()
+        for _ in range(rng.randint(1, 15)):
+            start = rng.randint(0, 10)
+            entities.add((rng.choice('ABC'), start, start + rng.randint(0, 5)))
+        assert nesting_depths(entities) == baseline_depths(entities)